@@ -2,8 +2,16 @@ from dotenv import load_dotenv
 from flask import Flask, request
 import os
 from utils.db.connection import get_connection
-from utils import api_requests
+from utils import api_requests, http_client
+from utils.event_log_store import EventLogStore
+from utils.db.intent_confidence import intent_confidence_rollup
+from utils.bot import parse_lib
+from utils.render_cache import render_cache
+from conformance import alignments, fast
+from conformance.alignments import alignment_cache
 from bot_blueprint import bot_resource
+from jobs_blueprint import jobs_resource
+from utils.jobs import job_manager
 from flasgger import Swagger
 from flask_cors import CORS
 import logging
@@ -49,10 +57,85 @@ app.db_connection = db_connection
 app.default_bot_pw = os.environ.get('DEFAULT_BOT_PASSWORD', '123456')
 app.default_group_id = "343da947a6db1296fadb5eca3987bf71f2e36a6d088e224a006f4e20e6e7935bb0d5ce0c13ada9966228f86ea7cc2cf3a1435827a48329f46b0e3963213123e0"
 app.default_service_id = "i5.las2peer.services.mensaService.MensaService"
+# social bot manager of requests that do not pass a bot-manager-url
+app.default_bot_manager_url = os.environ.get(
+    'SOCIAL_BOT_MANAGER_ENDPOINT', 'https://mobsos.tech4comp.dbis.rwth-aachen.de/SBFManager')
+
+# parsed bot models, see utils/bot/parse_lib.get_parser
+parse_lib.bot_parsers.max_size = int(
+    os.environ.get('BOT_PARSER_CACHE_SIZE', 32))
+# rendered svg visualizations, see utils/render_cache
+render_cache.max_bytes = int(
+    os.environ.get('RENDER_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# requests to the bot manager and other services, see utils/http_client
+http_client.read_timeout = float(os.environ.get('HTTP_TIMEOUT', 60))
+http_client.retries = int(os.environ.get('HTTP_RETRIES', 3))
+# event log cache, see utils/api_requests.fetch_event_log
+api_requests.event_log_cache.max_size = int(
+    os.environ.get('EVENT_LOG_CACHE_SIZE', 16))
+api_requests.event_log_cache.ttl = float(
+    os.environ.get('EVENT_LOG_CACHE_TTL', 300))
+api_requests.event_log_snapshots.max_size = api_requests.event_log_cache.max_size
+# bot name -> resource ids index of the bot manager
+api_requests.bot_index_cache.ttl = float(
+    os.environ.get('BOT_INDEX_TTL', 300))
+# parsed event logs are kept on disk, so that they are shared by all workers and survive restarts. An empty value disables the store
+event_log_store_dir = os.environ.get(
+    'EVENT_LOG_STORE_DIR', os.path.join(current_dir, 'event_log_store'))
+if event_log_store_dir:
+    # at most EVENT_LOG_STORE_SIZE snapshots are kept, each for at most EVENT_LOG_STORE_MAX_AGE seconds
+    api_requests.event_log_store = EventLogStore(
+        event_log_store_dir,
+        max_files=int(os.environ.get('EVENT_LOG_STORE_SIZE', 16)),
+        max_age=float(os.environ.get('EVENT_LOG_STORE_MAX_AGE', 86400)))
+# refresh expired event logs with the events that are newer than the last fetch
+app.event_log_incremental = os.environ.get(
+    'EVENT_LOG_INCREMENTAL', 'false').lower() == 'true'
+# "generator" fetches event logs from the event log generator, "database" reads them from the MESSAGE table
+app.event_log_backend = os.environ.get('EVENT_LOG_BACKEND', 'generator')
+# "log" computes the statistics endpoint from the event log, "database" aggregates the events in MySQL
+app.statistics_aggregation = os.environ.get('STATISTICS_AGGREGATION', 'log')
+# alignments of trace variants are persisted, so that only new variants have to be aligned. An empty value keeps them only in memory
+alignment_cache.path = os.environ.get(
+    'ALIGNMENT_CACHE_PATH', os.path.join(current_dir, 'alignment_cache.sqlite3')) or None
+alignment_cache.memory.max_size = int(
+    os.environ.get('ALIGNMENT_CACHE_SIZE', 10000))
+# variants that are not cached are aligned by a pool of worker processes, started on the first request of each web worker
+alignments.alignment_workers = int(
+    os.environ.get('ALIGNMENT_WORKERS', os.cpu_count() or 1))
+# time budgets of the optimal alignments of a single variant and of all variants of a request, variants that
+# exceed them are aligned heuristically and counted as approximateTraces in the responses.
+# The request budget must stay well below the worker timeout of gunicorn (--timeout, 30 seconds by default),
+# which kills the worker before the fallback runs. Loading the event log and rendering count toward that timeout too
+if os.environ.get('ALIGNMENT_VARIANT_TIMEOUT'):
+    alignments.variant_timeout = float(
+        os.environ['ALIGNMENT_VARIANT_TIMEOUT'])
+if os.environ.get('ALIGNMENT_REQUEST_TIMEOUT'):
+    alignments.request_timeout = float(
+        os.environ['ALIGNMENT_REQUEST_TIMEOUT'])
+alignments.fallback_max_states = int(
+    os.environ.get('ALIGNMENT_FALLBACK_MAX_STATES', 10000))
+# "fast" estimates the fitness from a sample of the variants and computes token-based precision, the mode
+# can be chosen per request with the mode parameter of the statistics endpoint
+app.conformance_mode = os.environ.get('CONFORMANCE_MODE', 'exact')
+fast.default_sample_size = int(
+    os.environ.get('CONFORMANCE_FAST_SAMPLE_SIZE', 20))
+# long running endpoints can be submitted as background jobs, see jobs_blueprint
+job_manager.workers = int(os.environ.get('JOB_WORKERS', 2))
+job_manager.max_pending = int(os.environ.get('JOB_MAX_PENDING', 16))
+job_manager.retention = float(os.environ.get('JOB_RETENTION', 3600))
+
+# average intent confidences are rolled up from new messages. "table" shares the rollup between workers,
+# "index" reads the confidences of the bot from the MESSAGE_BOT_INTENT index, both require utils/db/migrations.py
+intent_confidence_rollup.backend = os.environ.get(
+    'INTENT_CONFIDENCE_BACKEND', 'memory')
+intent_confidence_rollup.refresh_interval = float(
+    os.environ.get('INTENT_CONFIDENCE_REFRESH_INTERVAL', 10))
 
 app.swagger = swagger
 app.logger = logger
 app.register_blueprint(bot_resource, url_prefix='/bot')
+app.register_blueprint(jobs_resource, url_prefix='/jobs')
 
 
 @app.route("/services")
@@ -60,6 +143,21 @@ def getL2PServices():
     return api_requests.fetchL2PServices(request.args['services-endpoint'])
 
 
+@app.route("/cache/stats")
+def get_cache_stats():
+    """
+    Returns the hit and miss counters of the caches of this worker process
+    """
+    return {
+        "eventLogs": api_requests.event_log_cache.stats(),
+        "botIndex": api_requests.bot_index_cache.stats(),
+        "alignments": alignment_cache.stats(),
+        "botParsers": parse_lib.bot_parsers.stats(),
+        "renders": render_cache.stats(),
+        "http": http_client.stats(),
+    }
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=8088)
     file_handler = logging.FileHandler('app.log')
@@ -1,18 +1,50 @@
 from flask import Blueprint, current_app, request, jsonify, make_response
 from flasgger import swag_from
-from utils.bot.parse_lib import get_parser, extract_state_label
-from utils.api_requests import fetch_event_log, fetch_bot_model, fetch_success_model, fetchL2PGroups
-from enhancement.main import repair_petri_net, enhance_bot_model, average_intent_confidence, case_durations
+from utils.bot.parse_lib import get_parser, extract_state_label, model_hash
+from utils.render_cache import render_cache, log_fingerprint
+from utils.api_requests import fetch_event_log, fetch_bot_model, fetch_success_model, fetchL2PGroups, get_resource_ids_from_bot_manager
+from enhancement.main import repair_petri_net, enhance_bot_model, average_intent_confidence, case_duration_page, case_durations
 from pm4py.visualization.petri_net import visualizer as pn_visualizer
 from pm4py.visualization.dfg import visualizer as dfg_visualizer
 from pm4py.visualization.bpmn import visualizer as bpmn_visualizer
 from pm4py.convert import convert_to_bpmn
-from discovery.main import bot_statistics, discover_petri_net, discover_bpmn
-from conformance.main import conformance
+from discovery.main import bot_statistics, database_bot_statistics, discover_petri_net, discover_bpmn
+from conformance.main import conformance, conformance_modes
 import utils.llm_interface as llm
 import math
 
 bot_resource = Blueprint('dynamic_resource', __name__)
+# maximum number of cases that are returned at once by the case-durations endpoint
+max_case_page_size = 1000
+
+
+def load_event_log(botName, event_log_url, bot_manager_url):
+    """
+    Fetches the event log of a bot using the event log settings of the app
+    """
+    return fetch_event_log(botName, event_log_url, bot_manager_url,
+                           incremental=getattr(
+                               current_app, 'event_log_incremental', False),
+                           db_connection=current_app.db_connection,
+                           backend=getattr(current_app, 'event_log_backend', 'generator'))
+
+
+def render_svg(variant, botName, bot_model_json, event_log, event_log_url, render):
+    """
+    Renders a visualization as svg or returns the cached rendering.
+    While the rendering for a new version of the event log is computed, the rendering of the previous version is returned.
+    :param variant: name of the visualization
+    :param botName: name of the bot
+    :param bot_model_json: the visualized bot model (optional)
+    :param event_log: the visualized event log (optional)
+    :param event_log_url: url of the event log generator
+    :param render: function without arguments that returns the graphviz object
+    :return: the svg
+    """
+    model = model_hash(bot_model_json) if bot_model_json is not None else None
+    key = (model, log_fingerprint(event_log), variant, 'svg')
+    return render_cache.get_or_render(key, lambda: render().pipe(format='svg').decode('utf-8'),
+                                      group=(botName, model, event_log_url, variant, 'svg'))
 
 
 @bot_resource.route('/<botName>/enhanced-model', methods=['GET', 'POST'])
@@ -52,7 +84,7 @@ def enhanced_bot_model(botName):
             }, 400
 
     try:
-        event_log = fetch_event_log(botName, event_log_url, bot_manager_url)
+        event_log = load_event_log(botName, event_log_url, bot_manager_url)
         if event_log is None:
             print(f"Could not fetch event log from {event_log_url}")
             return {
@@ -66,14 +98,17 @@ def enhanced_bot_model(botName):
 
     try:
         bot_parser = get_parser(bot_model_json)
-        bot_model_dfg, start_activities, end_activities, frequency_dfg, performance_dfg = enhance_bot_model(
-            event_log, bot_parser, repair=False)
         if res_format == 'svg':
-            gviz = dfg_visualizer.apply(bot_model_dfg)
-            return gviz.pipe(format='svg').decode('utf-8')
-
-        return serialize_response(
-            bot_model_dfg, bot_parser, start_activities, end_activities, performance_dfg, botName, frequency_dfg)
+            return render_svg('enhanced-model', botName, bot_model_json, event_log, event_log_url,
+                              lambda: dfg_visualizer.apply(enhance_bot_model(event_log, bot_parser, repair=False).dfg))
+        result = enhance_bot_model(event_log, bot_parser, repair=False)
+
+        response = serialize_response(
+            result.dfg, bot_parser, result.start_activities, result.end_activities, result.performance_dfg, botName, result.frequency_dfg, result.performance_statistics, result.new_nodes)
+        if response is not None:
+            # cases whose alignment exceeded the time budget were replayed with a heuristic alignment
+            response["approximateTraces"] = result.approximate_traces
+        return response
     except Exception as e:
         print(e)
         return {
@@ -88,15 +123,13 @@ def get_petri_net(botName):
     bot_manager_url = request.args.get('bot-manager-url', None)
 
     if discover_model is not None:
-        event_log = fetch_event_log(botName, event_log_url, bot_manager_url)
+        event_log = load_event_log(botName, event_log_url, bot_manager_url)
         if event_log is None:
             return {
                 "error": f"Could not fetch event log from {event_log_url}"
             }, 500
-        net, im, fm = discover_petri_net(event_log)
-        gviz = pn_visualizer.apply(
-            net, im, fm, variant=pn_visualizer.Variants.PERFORMANCE)
-        return gviz.pipe(format='svg').decode('utf-8')
+        return render_svg('discovered-petri-net', botName, None, event_log, event_log_url,
+                          lambda: pn_visualizer.apply(*discover_petri_net(event_log), variant=pn_visualizer.Variants.PERFORMANCE))
     if request.method == 'GET':
         try:
             bot_model_json = fetch_bot_model(botName, bot_manager_url)
@@ -130,7 +163,7 @@ def get_petri_net(botName):
 
         event_log_url = request.args['event-log-url']
         try:
-            event_log = fetch_event_log(botName, event_log_url,bot_manager_url)
+            event_log = load_event_log(botName, event_log_url,bot_manager_url)
             if event_log is None:
                 print("Could not fetch event log")
                 return {
@@ -143,13 +176,16 @@ def get_petri_net(botName):
                 "error": f"Could not fetch event log from {event_log_url}, make sure the service is running and the bot name is correct"
             }, 400
 
-    net, im, fm = bot_parser.to_petri_net()
-    if request.args.get('enhance', 'false') == 'true':
-        net, _, _ = repair_petri_net(event_log, net, im, fm)
+    enhance = request.args.get('enhance', 'false') == 'true'
 
-    gviz = pn_visualizer.apply(
-        net, im, fm, variant=pn_visualizer.Variants.PERFORMANCE)
-    return gviz.pipe(format='svg').decode('utf-8')
+    def render():
+        net, im, fm = bot_parser.to_petri_net()
+        if enhance:
+            net, _, _ = repair_petri_net(event_log, net, im, fm)
+        return pn_visualizer.apply(
+            net, im, fm, variant=pn_visualizer.Variants.PERFORMANCE)
+    return render_svg('enhanced-petri-net' if enhance else 'petri-net', botName, bot_model_json,
+                      event_log if enhance else None, event_log_url if enhance else None, render)
 
 
 @bot_resource.route('/<botName>/bpmn', methods=['GET', 'POST'])
@@ -159,15 +195,13 @@ def get_bpmn(botName):
     bot_manager_url = request.args.get('bot-manager-url', None)
 
     if discover_model is not None:
-        event_log = fetch_event_log(botName, event_log_url, bot_manager_url)
+        event_log = load_event_log(botName, event_log_url, bot_manager_url)
         if event_log is None:
             return {
                 "error": f"Could not fetch event log from {event_log_url}"
             }, 500
-        net, im, fm = discover_petri_net(event_log)
-        bpmn_graph = convert_to_bpmn(net, im, fm)
-        gviz = bpmn_visualizer.apply(bpmn_graph)
-        return gviz.pipe(format='svg').decode('utf-8')
+        return render_svg('discovered-bpmn', botName, None, event_log, event_log_url,
+                          lambda: bpmn_visualizer.apply(convert_to_bpmn(*discover_petri_net(event_log))))
     if request.method == 'GET':
         if 'bot-manager-url' not in request.args:
             return {
@@ -201,7 +235,7 @@ def get_bpmn(botName):
     bot_parser = get_parser(bot_model_json)
     if request.args.get('enhance', 'false') == 'true':
         try:
-            event_log = fetch_event_log(botName, event_log_url,bot_manager_url)
+            event_log = load_event_log(botName, event_log_url,bot_manager_url)
             if event_log is None:
                 print("Could not fetch event log")
                 return {
@@ -214,13 +248,15 @@ def get_bpmn(botName):
                 "error": f"Could not fetch event log from {event_log_url}, make sure the service is running and the bot name is correct"
             }, 400
 
-    net, im, fm = bot_parser.to_petri_net()
-    if request.args.get('enhance', 'false') == 'true':
-        net, _, _ = repair_petri_net(event_log, net, im, fm)
+    enhance = request.args.get('enhance', 'false') == 'true'
 
-    bpmn_graph = convert_to_bpmn(net, im, fm)
-    gviz = bpmn_visualizer.apply(bpmn_graph)
-    return gviz.pipe(format='svg').decode('utf-8')
+    def render():
+        net, im, fm = bot_parser.to_petri_net()
+        if enhance:
+            net, _, _ = repair_petri_net(event_log, net, im, fm)
+        return bpmn_visualizer.apply(convert_to_bpmn(net, im, fm))
+    return render_svg('enhanced-bpmn' if enhance else 'bpmn', botName, bot_model_json,
+                      event_log if enhance else None, event_log_url if enhance else None, render)
 
 
 @bot_resource.route('/<botName>/intent-confidence')
@@ -230,23 +266,50 @@ def get_intent_confidence(botName):
 
 @bot_resource.route('/<botName>/case-durations')
 def get_case_durations(botName):
+    """
+    Returns the durations and traces of the conversations of the bot.
+    Without limit and cursor, all conversations are returned as dict case id -> durations and trace.
+    With them, one page at a time is returned as {cases, nextCursor, total}.
+    Query parameters: sort (startTime, endTime, caseDuration or length), order (asc or desc),
+    limit (cases per page) and cursor (nextCursor of the previous page)
+    """
     event_log_generator_url = request.args.get('event-log-url', None)
     if event_log_generator_url is None:
         return {
-            "error": "event-log-generator-url parameter is missing"
+            "error": "event-log-url parameter is missing"
         }, 400
+    bot_manager_url = request.args.get(
+        'bot-manager-url', current_app.default_bot_manager_url)
+    paginated = 'limit' in request.args or 'cursor' in request.args
     try:
-        event_log = fetch_event_log(botName, event_log_generator_url)
-
+        limit = min(int(request.args.get('limit', 100)), max_case_page_size)
+    except ValueError:
+        return {
+            "error": "limit must be a number"
+        }, 400
+    try:
+        event_log = load_event_log(
+            botName, event_log_generator_url, bot_manager_url)
+        if event_log is None:
+            return {
+                "error": f"Could not fetch event log from {event_log_generator_url}"
+            }, 500
     except Exception as e:
         print(e)
         return {
             "error": f"Could not fetch event log from {event_log_generator_url}, make sure the service is running and the bot name is correct"
         }, 500
 
-    event_log = fetch_event_log(
-        botName, event_log_generator_url, bot_manager_url=current_app.default_bot_manager_url)
-    return case_durations(event_log)
+    if not paginated:
+        return case_durations(event_log)
+    try:
+        return case_duration_page(event_log, sort_by=request.args.get('sort', 'startTime'),
+                                  ascending=request.args.get('order', 'asc') != 'desc', limit=limit,
+                                  cursor=request.args.get('cursor', None))
+    except ValueError as e:
+        return {
+            "error": str(e)
+        }, 400
 
 
 @bot_resource.route('/<botName>/success-model')
@@ -269,12 +332,34 @@ def get_bot_statistics(botName):
     """
     event_log_generator_url = request.args.get('event-log-url', None)
     bot_manager_url = request.args.get('bot-manager-url', None)
+    # "database" computes the statistics in the events database without loading the event log,
+    # conformance checking (POST) always needs the event log
+    aggregation = request.args.get(
+        'aggregation', getattr(current_app, 'statistics_aggregation', 'log'))
+    if aggregation == 'database' and request.method == 'GET':
+        if bot_manager_url is None:
+            return {
+                "error": "bot-manager-url parameter is missing"
+            }, 400
+        try:
+            resource_ids = get_resource_ids_from_bot_manager(
+                bot_manager_url, botName)
+            if len(resource_ids) == 0:
+                return {
+                    "error": f"Could not find bot {botName} at {bot_manager_url}"
+                }, 404
+            return database_bot_statistics(current_app.db_connection, resource_ids)
+        except Exception as e:
+            print(e)
+            return {
+                "error": "Could not compute the statistics in the database"
+            }, 500
     if event_log_generator_url is None:
         return {
             "error": "event-log-generator-url parameter is missing"
         }, 400
     try:
-        event_log = fetch_event_log(
+        event_log = load_event_log(
             botName, event_log_generator_url, bot_manager_url)
 
     except Exception as e:
@@ -305,11 +390,18 @@ def get_bot_statistics(botName):
             return {
                 "error": "bot-model parameter is missing"
             }, 400
+        mode = request.args.get('mode', current_app.conformance_mode)
+        if mode not in conformance_modes:
+            return {
+                "error": f"mode must be one of {conformance_modes}"
+            }, 400
         try:
 
             bot_parser = get_parser(bot_model_json)
             net, im, fm = bot_parser.to_petri_net()
-            conformance_results = conformance(event_log, net, im, fm)
+            conformance_results = conformance(
+                event_log, net, im, fm, include_unfitting=request.args.get('unfitting', 'false').lower() == 'true',
+                mode=mode)
             statistics['conformance'] = conformance_results
         except Exception as e:
             print(e)
@@ -331,8 +423,10 @@ def get_groups(botName):
     return fetchL2PGroups(contact_service_url, botName, current_app.default_bot_pw)
 
 
-def serialize_response(bot_model_dfg, bot_parser, start_activities, end_activities, performance_dfg, botName, frequency_dfg):
+def serialize_response(bot_model_dfg, bot_parser, start_activities, end_activities, performance_dfg, botName, frequency_dfg, performance_statistics=None, new_nodes=None):
     added_edges = set()
+    # names of the nodes of the bot model and of the nodes that were added by the enhancement
+    names = {**bot_parser.id_name_map, **(new_nodes or {})}
     try:
         # serialize the bot model
         edges = []
@@ -350,10 +444,8 @@ def serialize_response(bot_model_dfg, bot_parser, start_activities, end_activiti
                     else:
                         avg_confidence[keyword] = row['averageConfidence']
         for edge, _ in bot_model_dfg.items():
-            source_intent = bot_parser.id_name_map[edge[0]
-                                                   ] if edge[0] in bot_parser.id_name_map else None
-            target_intent = bot_parser.id_name_map[edge[1]
-                                                   ] if edge[1] in bot_parser.id_name_map else None
+            source_intent = names[edge[0]] if edge[0] in names else None
+            target_intent = names[edge[1]] if edge[1] in names else None
             source_label = bot_parser.id_state_map[edge[0]
                                                    ] if edge[0] in bot_parser.id_state_map else None
             target_label = bot_parser.id_state_map[edge[1]
@@ -365,6 +457,7 @@ def serialize_response(bot_model_dfg, bot_parser, start_activities, end_activiti
                 "target": edge[1],
                 "performance": performance_dfg[(edge[0], edge[1])] if (edge[0], edge[1]) in performance_dfg else None,
                 "frequency": frequency_dfg[(edge[0], edge[1])] if (edge[0], edge[1]) in frequency_dfg else None,
+                "performance_statistics": performance_statistics.get((edge[0], edge[1])) if performance_statistics is not None else None,
             })
             added_edges.add((edge[0], edge[1]))
 
@@ -383,7 +476,7 @@ def serialize_response(bot_model_dfg, bot_parser, start_activities, end_activiti
             "start_activities": list(start_activities),
             "end_activities": list(end_activities),
             "confidence": avg_confidence,
-            "names": bot_parser.id_name_map
+            "names": names
         }
 
         return res
@@ -408,7 +501,7 @@ def get_improvements_for_dfg(botName):
         return {
             "error": "event-log-url parameter is missing"
         }, 400
-    event_log = fetch_event_log(
+    event_log = load_event_log(
         botName, event_log_generator_url, bot_manager_url)
     prompt = llm.recommendations_from_event_log(event_log)
     # log the prompt
@@ -502,8 +595,8 @@ def get_custom_improvements(botName):
                 "error": "bot-manager-url parameter is missing"
             }, 400
         bot_manager_url = request.args['bot-manager-url']
-        event_log = fetch_event_log(
-            botName, event_log_generator_url, botManagerUrl=bot_manager_url)
+        event_log = load_event_log(
+            botName, event_log_generator_url, bot_manager_url)
 
     prompt = llm.custom_prompt(inputPrompt, average_intent_confidence_df,
                                event_log, net, initial_marking, final_marking)
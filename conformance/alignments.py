@@ -0,0 +1,405 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from copy import copy
+from pm4py.algo.conformance.alignments.petri_net import algorithm as alignments_algorithm
+from pm4py.algo.conformance.alignments.petri_net.algorithm import Parameters
+from pm4py.objects.petri_net.utils import check_soundness
+from pm4py.objects.log.obj import Trace, Event
+from pm4py.util.lp import solver
+from utils.cache import LRUCache
+from conformance.heuristic import heuristic_alignment
+
+# parameters that do not change the alignment itself: format, time limits and values derived from the net
+_format_parameters = {Parameters.PARAM_ALIGNMENT_RESULT_IS_SYNC_PROD_AWARE.value, Parameters.PARAM_MAX_ALIGN_TIME_TRACE.value,
+                      Parameters.PARAM_MAX_ALIGN_TIME.value, Parameters.SHOW_PROGRESS_BAR.value,
+                      Parameters.BEST_WORST_COST_INTERNAL.value}
+
+# number of worker processes that align variants in parallel, 1 aligns in the calling process. The pool is started
+# once per process with this size and shared by all threads
+alignment_workers = 1
+# maximum time in seconds spent on the optimal alignment of a single variant and on all variants of a call of
+# align_variants. Variants that exceed the budget get a heuristic alignment, see conformance.heuristic
+variant_timeout = None
+request_timeout = None
+# maximum number of markings that the heuristic alignment explores per event
+fallback_max_states = 10000
+# starting the worker processes does not pay off for fewer variants
+min_parallel_variants = 8
+
+# pool of worker processes of this process, started on first use, see _get_pool
+_pool = None
+_pool_lock = threading.Lock()
+# nets received by a worker process keyed by their fingerprint, see _align_chunk
+_worker_nets = LRUCache(max_size=8)
+
+
+class AlignmentCache:
+    """
+    Cache of alignments of trace variants against Petri nets.
+    Alignments are keyed by the fingerprint of the net and the variant. Recently used alignments are kept in memory,
+    all alignments are persisted in a sqlite database so that they survive restarts and are shared by all worker processes.
+    """
+
+    def __init__(self, path=None, max_size=10000):
+        """
+        :param path: path of the sqlite database, None keeps the alignments only in memory
+        :param max_size: maximum number of alignments kept in memory
+        """
+        self.path = path
+        self.memory = LRUCache(max_size=max_size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialized_path = None
+
+    def get_many(self, net_hash, variants, count=True):
+        """
+        Gets the cached alignments of variants
+        :param net_hash: fingerprint of the net, see net_fingerprint
+        :param variants: list of variants (tuples of activities)
+        :param count: whether the lookups count as hits and misses, False for lookups that only probe the cache
+        :return: dict variant -> alignment of the variants that are cached
+        """
+        found = {}
+        missing = []
+        for variant in variants:
+            alignment = self.memory.get((net_hash, variant))
+            if alignment is not None:
+                found[variant] = alignment
+            else:
+                missing.append(variant)
+        if missing and self.path is not None:
+            for variant, alignment in self._read(net_hash, missing).items():
+                self.memory.set((net_hash, variant), alignment)
+                found[variant] = alignment
+        if count:
+            with self._lock:
+                self.hits += len(found)
+                self.misses += len(variants) - len(found)
+        return found
+
+    def set_many(self, net_hash, alignments):
+        """
+        Stores alignments
+        :param net_hash: fingerprint of the net
+        :param alignments: dict variant -> alignment
+        """
+        for variant, alignment in alignments.items():
+            self.memory.set((net_hash, variant), alignment)
+        if self.path is not None and len(alignments) > 0:
+            self._write(net_hash, alignments)
+
+    def stats(self):
+        """
+        Gets the size and the hit ratio of the cache
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            stats = {
+                "size": len(self.memory),
+                "maxSize": self.memory.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": self.hits / requests if requests > 0 else None,
+            }
+        if self.path is not None:
+            connection = self._connect()
+            try:
+                stats["persistedSize"] = connection.execute(
+                    "SELECT COUNT(*) FROM alignments").fetchone()[0]
+            finally:
+                connection.close()
+        return stats
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        if self._initialized_path != self.path:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS alignments (net_hash TEXT, variant TEXT, alignment TEXT, PRIMARY KEY (net_hash, variant))")
+            self._initialized_path = self.path
+        return connection
+
+    def _read(self, net_hash, variants):
+        keys = {json.dumps(variant): variant for variant in variants}
+        found = {}
+        connection = self._connect()
+        try:
+            key_list = list(keys)
+            for i in range(0, len(key_list), 500):
+                chunk = key_list[i:i + 500]
+                rows = connection.execute(
+                    f"SELECT variant, alignment FROM alignments WHERE net_hash = ? AND variant IN ({','.join('?' * len(chunk))})",
+                    [net_hash] + chunk)
+                for variant, alignment in rows:
+                    found[keys[variant]] = _deserialize(alignment)
+        finally:
+            connection.close()
+        return found
+
+    def _write(self, net_hash, alignments):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO alignments VALUES (?, ?, ?)", [
+                    (net_hash, json.dumps(variant), json.dumps(alignment, default=float)) for variant, alignment in alignments.items()])
+        finally:
+            connection.close()
+
+
+alignment_cache = AlignmentCache()
+
+
+def net_fingerprint(net, im, fm, parameters=None):
+    """
+    Computes a hash of the structure of an accepting Petri net that does not depend on object identities
+    :param net: petri net
+    :param im: initial marking
+    :param fm: final marking
+    :param parameters: alignment parameters, parameters that change the alignment are part of the fingerprint
+    :return: hex digest
+    """
+    canonical = {
+        "places": sorted(place.name for place in net.places),
+        "transitions": sorted(([transition.name, transition.label] for transition in net.transitions), key=str),
+        "arcs": sorted([arc.source.name, arc.target.name, arc.weight] for arc in net.arcs),
+        "im": sorted([place.name, count] for place, count in im.items()),
+        "fm": sorted([place.name, count] for place, count in fm.items()),
+        "parameters": sorted(repr(item) for item in normalize_parameters(parameters).items() if item[0] not in _format_parameters),
+    }
+    return hashlib.sha256(json.dumps(canonical, default=str).encode('utf-8')).hexdigest()
+
+
+def get_variants(event_log):
+    """
+    Gets the trace of each case in the same order as pm4py's alignment algorithm
+    :param event_log: event log as a dataframe
+    :return: list of variants (tuples of activities), one per case
+    """
+    return list(event_log.groupby("case:concept:name")["concept:name"].apply(tuple))
+
+
+def align_variants(variants, net, im, fm, parameters=None, cache=alignment_cache, workers=None):
+    """
+    Aligns trace variants against a net. Only variants that are not in the cache are aligned.
+    The alignments always describe moves as ((log transition name, model transition name), (log label, model label)).
+    :param variants: list of variants (tuples of activities)
+    :param net: petri net
+    :param im: initial marking
+    :param fm: final marking
+    :param parameters: parameters of the alignment algorithm
+    :param cache: alignment cache, None disables caching
+    :param workers: number of worker processes, defaults to alignment_workers
+    :return: dict variant -> alignment. Alignments of variants that exceeded variant_timeout or request_timeout are
+        computed heuristically and have approximate set to True, they are not cached. The alignment is None if
+        the heuristic could not reach the final marking either
+    """
+    deadline = time.time() + request_timeout if request_timeout is not None else None
+    parameters = normalize_parameters(parameters)
+    parameters[Parameters.PARAM_ALIGNMENT_RESULT_IS_SYNC_PROD_AWARE.value] = True
+    variants = list(dict.fromkeys(variants))
+    net_hash = net_fingerprint(net, im, fm, parameters)
+    results = cache.get_many(net_hash, variants) if cache is not None else {}
+    missing = [variant for variant in variants if variant not in results]
+    if len(missing) == 0:
+        return results
+
+    if solver.DEFAULT_LP_SOLVER_VARIANT is not None and not check_soundness.check_easy_soundness_net_in_fin_marking(net, im, fm):
+        raise Exception(
+            "trying to apply alignments on a Petri net that is not a easy sound net!!")
+    parameters[Parameters.BEST_WORST_COST_INTERNAL.value] = alignments_algorithm.DEFAULT_VARIANT.value.get_best_worst_cost(
+        net, im, fm, parameters=copy(parameters))
+    if variant_timeout is not None:
+        parameters.setdefault(
+            Parameters.PARAM_MAX_ALIGN_TIME_TRACE.value, variant_timeout)
+    computed = dict(zip(missing, _align_all(
+        missing, net, im, fm, parameters, workers, deadline, net_hash)))
+    if cache is not None:
+        cache.set_many(net_hash, {variant: alignment for variant, alignment in computed.items()
+                                  if alignment is not None and not alignment.get('approximate', False)})
+    results.update(computed)
+    return results
+
+
+def align_log(event_log, net, im, fm, parameters=None, cache=alignment_cache, workers=None):
+    """
+    Aligns an event log against a net, drop-in replacement of pm4py's alignment algorithm for dataframes
+    that computes each variant only once and reuses cached alignments.
+    :param event_log: event log as a dataframe
+    :param net: petri net
+    :param im: initial marking
+    :param fm: final marking
+    :param parameters: parameters of the alignment algorithm
+    :param cache: alignment cache, None disables caching
+    :param workers: number of worker processes, defaults to alignment_workers
+    :return: list of alignments, one per case ordered by case id
+    """
+    traces = get_variants(event_log)
+    results = align_variants(traces, net, im, fm, parameters, cache, workers)
+    sync_prod_aware = normalize_parameters(parameters).get(
+        Parameters.PARAM_ALIGNMENT_RESULT_IS_SYNC_PROD_AWARE.value, False)
+    if not sync_prod_aware:
+        results = {variant: labels_only(alignment)
+                   for variant, alignment in results.items()}
+    return [results[trace] for trace in traces]
+
+
+def _align_all(variants, net, im, fm, parameters, workers=None, deadline=None, net_hash=None):
+    """
+    Aligns variants, in parallel if there are enough variants and more than one worker.
+    The worker processes are started once and reused. A net is shipped only with the first chunks after it changed,
+    the workers keep it by its fingerprint and chunks that reach a worker without the net are sent again with it.
+    :param workers: whether variants are aligned in parallel, 1 aligns in the calling process. Defaults to
+        alignment_workers, which also sets the size of the pool
+    :param deadline: time after which the remaining variants are aligned heuristically (optional)
+    :param net_hash: fingerprint of the net, see net_fingerprint (optional)
+    :return: list of alignments in the order of the variants
+    """
+    if workers is None:
+        workers = alignment_workers
+    if workers <= 1 or len(variants) < min_parallel_variants:
+        return [_align_variant(variant, net, im, fm, parameters, deadline) for variant in variants]
+    if net_hash is None:
+        net_hash = net_fingerprint(net, im, fm, parameters)
+    executor, pool_size, shipped = _get_pool()
+    first = 0 if shipped.get(net_hash) else pool_size
+    shipped.set(net_hash, True)
+    chunksize = max(1, len(variants) // (pool_size * 4))
+    chunks = [variants[i:i + chunksize]
+              for i in range(0, len(variants), chunksize)]
+    settings = (parameters, deadline, fallback_max_states)
+    try:
+        results = list(executor.map(_align_chunk, chunks, [
+            (net_hash, (net, im, fm) if i < first else None, settings) for i in range(len(chunks))]))
+        unknown = [i for i, result in enumerate(results) if result is None]
+        if unknown:
+            for i, result in zip(unknown, executor.map(_align_chunk, [chunks[i] for i in unknown], [
+                    (net_hash, (net, im, fm), settings)] * len(unknown))):
+                results[i] = result
+        return [alignment for chunk in results for alignment in chunk]
+    except BrokenProcessPool as e:
+        # a worker died, e.g. killed by the OS. The pool is started again by the next call
+        print(e)
+        _reset_pool(executor)
+        return [_align_variant(variant, net, im, fm, parameters, deadline) for variant in variants]
+
+
+def _get_pool():
+    """
+    Gets the pool of worker processes of this process, it is started with alignment_workers processes on first use.
+    The pool is shared by all threads and only replaced after it broke or in a forked child, whose parent owns it.
+    The workers are started by a fork server (or spawned), forking the threads of the web server could deadlock.
+    :return: the executor, its number of workers and the fingerprints of the nets that were sent to it
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool[0] != os.getpid():
+            _pool = None
+        if _pool is None:
+            # callers that ask for parallel alignments get at least two workers
+            workers = max(2, alignment_workers)
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                # pm4py is imported once by the fork server instead of by each worker
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context('spawn')
+            _pool = (os.getpid(), workers, ProcessPoolExecutor(
+                max_workers=workers, mp_context=context), LRUCache(max_size=_worker_nets.max_size))
+        return _pool[2], _pool[1], _pool[3]
+
+
+def _reset_pool(executor):
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool[2] is executor:
+            _pool = None
+    executor.shutdown(wait=False)
+
+
+def _align_chunk(variants, context):
+    """
+    Aligns a chunk of variants in a worker process
+    :param context: fingerprint of the net, the net as (net, im, fm) or None if the worker should already have it,
+        and the parameters, deadline and fallback limit. The settings of this module are not shared with spawned workers
+    :return: list of alignments, None if the net was not sent and the worker does not have it
+    """
+    net_hash, accepting_net, (parameters, deadline, max_states) = context
+    if accepting_net is None:
+        accepting_net = _worker_nets.get(net_hash)
+        if accepting_net is None:
+            return None
+    else:
+        _worker_nets.set(net_hash, accepting_net)
+    net, im, fm = accepting_net
+    return [_align_variant(variant, net, im, fm, parameters, deadline, max_states) for variant in variants]
+
+
+def _align_variant(variant, net, im, fm, parameters, deadline=None, max_states=None):
+    """
+    Aligns a variant optimally within the time limit of the parameters and the deadline,
+    falls back to the heuristic alignment if the limit is exceeded
+    :return: the alignment, None if neither alignment could be computed
+    """
+    parameters = copy(parameters)
+    key = Parameters.PARAM_MAX_ALIGN_TIME_TRACE.value
+    alignment = None
+    if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining > 0:
+            parameters[key] = min(parameters.get(key, remaining), remaining)
+    if deadline is None or remaining > 0:
+        alignment = alignments_algorithm.apply_trace(variant_to_trace(
+            variant, parameters), net, im, fm, parameters=parameters)
+    if alignment is None:
+        alignment = heuristic_alignment(variant, net, im, fm, best_worst_cost=parameters.get(
+            Parameters.BEST_WORST_COST_INTERNAL.value) or 0,
+            max_states=max_states if max_states is not None else fallback_max_states)
+    return alignment
+
+
+def variant_to_trace(variant, parameters=None):
+    """
+    Converts a variant to a trace that can be aligned
+    """
+    activity_key = normalize_parameters(parameters).get(
+        Parameters.ACTIVITY_KEY.value, "concept:name")
+    trace = Trace()
+    for activity in variant:
+        trace.append(Event({activity_key: activity}))
+    return trace
+
+
+def normalize_parameters(parameters):
+    """
+    Copies alignment parameters with the enum keys replaced by their values.
+    The variants of the alignment algorithm each define their own Parameters enum, the values are shared by all of them.
+    """
+    if parameters is None:
+        return {}
+    return {getattr(key, 'value', key): value for key, value in parameters.items()}
+
+
+def labels_only(alignment):
+    """
+    Converts a sync product aware alignment to the default format of pm4py which only contains the labels of the moves
+    """
+    if alignment is None:
+        return None
+    alignment = copy(alignment)
+    alignment['alignment'] = [labels for _, labels in alignment['alignment']]
+    return alignment
+
+
+def _deserialize(value):
+    alignment = json.loads(value)
+    alignment['alignment'] = [(tuple(names), tuple(labels))
+                              for names, labels in alignment['alignment']]
+    return alignment
@@ -0,0 +1,244 @@
+import bisect
+import logging
+import math
+import random
+from collections import Counter
+from statistics import NormalDist
+from pm4py.algo.conformance.tokenreplay import algorithm as token_replay
+from pm4py.algo.conformance.tokenreplay.variants.token_replay import Parameters as TokenReplayParameters
+from pm4py.objects.log.obj import EventLog
+from pm4py.objects.petri_net.utils.align_utils import get_visible_transitions_eventually_enabled_by_marking
+from conformance.alignments import align_variants, alignment_cache, get_variants, net_fingerprint, variant_to_trace, labels_only
+
+logger = logging.getLogger(__name__)
+
+# number of variants that are aligned in fast mode, variants with cached alignments are used in addition
+default_sample_size = 20
+
+
+def fast_conformance(event_log, net, im, fm, include_unfitting=False, sample_size=None, confidence=0.95, seed=0, cache=alignment_cache):
+    """
+    Estimates the fitness of a net on an event log from the alignments of a stratified sample of the variants
+    and computes the token-based ETConformance precision.
+    The most frequent variants and the variants with cached alignments are aligned completely, the fitness of the other
+    cases is estimated from a random sample of them. The estimates are reported with confidence intervals.
+    The precision is not estimated: token replay covers all variants, so it is exact and has no interval, but it is the
+    token-based precision, which can differ from the alignment-based precision of the exact mode.
+    :param event_log: event log as a dataframe
+    :param net: petri net
+    :param im: initial marking
+    :param fm: final marking
+    :param include_unfitting: whether the alignments of the aligned unfitting traces are added as unfittingTraces
+    :param sample_size: number of variants that are aligned at most, defaults to default_sample_size
+    :param confidence: confidence level of the intervals
+    :param seed: seed of the random sample
+    :param cache: alignment cache
+    :return: dict with fitness, precision, precisionMethod ("token-based") and approximateTraces like
+        conformance.main.conformance, the fitness has confidenceIntervals. approximateTraces counts the cases of the
+        aligned variants
+    """
+    variants = get_variants(event_log)
+    counts = Counter(variants)
+    result = {"mode": "fast"}
+    try:
+        fitness, alignments = estimate_fitness(
+            counts, net, im, fm, sample_size=sample_size, confidence=confidence, seed=seed, cache=cache)
+    except Exception:
+        logger.exception("Could not estimate the fitness")
+        fitness, alignments = None, {}
+    result["fitness"] = fitness
+    try:
+        result["precision"] = token_precision(
+            counts, net, im, fm, number_of_events=len(event_log))
+    except Exception:
+        logger.exception("Could not compute the token-based precision")
+        result["precision"] = None
+    # computed from all variants, it has no confidence interval
+    result["precisionMethod"] = "token-based"
+    result["approximateTraces"] = sum(counts[variant] for variant, alignment in alignments.items()
+                                      if alignment is not None and alignment.get('approximate', False))
+    if include_unfitting:
+        result["unfittingTraces"] = [labels_only(alignments[variant]) for variant in variants
+                                     if alignments.get(variant) is not None and alignments[variant]['fitness'] < 1]
+    return result
+
+
+def estimate_fitness(counts, net, im, fm, sample_size=None, confidence=0.95, seed=0, cache=alignment_cache):
+    """
+    Estimates the alignment based fitness of pm4py (see replay_fitness.evaluate) from a stratified sample.
+    The census stratum contains the cached and the most frequent variants and is aligned completely.
+    The cases of the other variants are sampled uniformly without replacement.
+    :param counts: dict variant -> number of cases
+    :return: (fitness dict with confidenceIntervals, dict variant -> alignment of the aligned variants)
+    """
+    if sample_size is None:
+        sample_size = default_sample_size
+    # only probes which variants are cached, the lookup of align_variants counts as hits and misses
+    cached = cache.get_many(net_fingerprint(
+        net, im, fm), list(counts), count=False) if cache is not None else {}
+    frequent = [variant for variant, _ in counts.most_common()
+                if variant not in cached][:sample_size // 2]
+    census = set(cached) | set(frequent)
+
+    # cases of the other variants, in a fixed order so that the sample is reproducible
+    rest = sorted((variant for variant in counts if variant not in census), key=repr)
+    rest_cases = list(_cumulative(counts[variant] for variant in rest))
+    rest_size = rest_cases[-1] if rest_cases else 0
+    sampled_cases = random.Random(seed).sample(
+        range(rest_size), min(sample_size - len(frequent), rest_size))
+    sample = [rest[bisect.bisect_right(rest_cases, case)] for case in sampled_cases]
+
+    alignments = align_variants(list(census) + sample, net, im, fm, cache=cache)
+
+    # totals of the census stratum, alignments that timed out are left out like in pm4py
+    census_cases = fit_cases = fitness_sum = cost_sum = bwc_sum = 0
+    for variant in census:
+        alignment = alignments[variant]
+        if alignment is None:
+            continue
+        count = counts[variant]
+        census_cases += count
+        fitness_sum += count * alignment['fitness']
+        fit_cases += count * (alignment['fitness'] == 1.0)
+        cost_sum += count * alignment['cost']
+        bwc_sum += count * alignment['bwc']
+    sampled = [alignments[variant]
+               for variant in sample if alignments[variant] is not None]
+    # cases whose alignment timed out are left out of the population, like in the census stratum
+    rest_size = rest_size * len(sampled) / len(sample) if sample else 0
+    cases = census_cases + rest_size
+    if cases == 0:
+        return None, alignments
+
+    fitness_values = [alignment['fitness'] for alignment in sampled]
+    fit_values = [float(alignment['fitness'] == 1.0) for alignment in sampled]
+    average_fitness, average_fitness_se = _stratified_mean(
+        fitness_sum, census_cases, fitness_values, rest_size)
+    fit_ratio, fit_ratio_se = _stratified_mean(
+        fit_cases, census_cases, fit_values, rest_size)
+    cost_ratio, cost_ratio_se = _stratified_ratio(cost_sum, bwc_sum, [alignment['cost'] for alignment in sampled],
+                                                  [alignment['bwc'] for alignment in sampled], rest_size)
+    log_fitness = 1.0 - cost_ratio if cost_ratio is not None else 0.0
+
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    intervals = {
+        "averageFitness": _interval(average_fitness, average_fitness_se, z, 1.0),
+        "percFitTraces": _interval(100.0 * fit_ratio, None if fit_ratio_se is None else 100.0 * fit_ratio_se, z, 100.0),
+        "log_fitness": _interval(log_fitness, cost_ratio_se, z, 1.0),
+    }
+    fitness = {
+        "percFitTraces": 100.0 * fit_ratio,
+        "averageFitness": average_fitness,
+        "percentage_of_fitting_traces": 100.0 * fit_ratio,
+        "average_trace_fitness": average_fitness,
+        "log_fitness": log_fitness,
+        "confidence": confidence,
+        "confidenceIntervals": intervals,
+        "alignedVariants": len(census) + len(set(sample)),
+        "sampledCases": len(sampled),
+        "cases": sum(counts.values()),
+    }
+    return fitness, alignments
+
+
+def token_precision(counts, net, im, fm, number_of_events=None):
+    """
+    Computes the token-based ETConformance precision of pm4py from the variants of a log.
+    pm4py converts the whole dataframe to an event log to find the start activities, here only the prefixes of the
+    variants are replayed.
+    :param counts: dict variant -> number of cases
+    :param number_of_events: weight of the initial marking, pm4py uses the length of the dataframe. Defaults to the number of cases
+    :return: precision between 0 and 1
+    """
+    prefixes = {}  # prefix -> activities that follow the prefix
+    prefix_count = Counter()
+    for variant, count in counts.items():
+        for i in range(1, len(variant)):
+            prefixes.setdefault(variant[:i], set()).add(variant[i])
+            prefix_count[variant[:i]] += count
+    prefix_keys = list(prefixes)
+    parameters = {
+        TokenReplayParameters.SHOW_PROGRESS_BAR: False,
+        TokenReplayParameters.CONSIDER_REMAINING_IN_FITNESS: False,
+        TokenReplayParameters.TRY_TO_REACH_FINAL_MARKING_THROUGH_HIDDEN: False,
+        TokenReplayParameters.STOP_IMMEDIATELY_UNFIT: True,
+        TokenReplayParameters.WALK_THROUGH_HIDDEN_TRANS: True,
+        TokenReplayParameters.CLEANING_TOKEN_FLOOD: False,
+    }
+    replayed = token_replay.apply(EventLog([variant_to_trace(prefix) for prefix in prefix_keys]), net, im, fm,
+                                  variant=token_replay.Variants.TOKEN_REPLAY, parameters=parameters) if prefix_keys else []
+
+    activated_sum = 0
+    escaping_sum = 0
+    # the empty prefix, as in pm4py
+    start_activities = {variant[0] for variant in counts if len(variant) > 0}
+    initially_enabled = {transition.label for transition in get_visible_transitions_eventually_enabled_by_marking(
+        net, im)}
+    weight = number_of_events if number_of_events is not None else sum(counts.values())
+    activated_sum += weight * len(initially_enabled)
+    escaping_sum += weight * len(initially_enabled - start_activities)
+
+    for prefix, trace in zip(prefix_keys, replayed):
+        if trace["trace_is_fit"]:
+            activated = {transition.label for transition in trace["enabled_transitions_in_marking"]
+                         if transition.label is not None}
+            activated_sum += len(activated) * prefix_count[prefix]
+            escaping_sum += len(activated - prefixes[prefix]) * prefix_count[prefix]
+
+    if activated_sum == 0:
+        return 1.0
+    return 1 - escaping_sum / activated_sum
+
+
+def _cumulative(values):
+    total = 0
+    for value in values:
+        total += value
+        yield total
+
+
+def _stratified_mean(census_sum, census_size, sample, rest_size):
+    """
+    Estimates the mean of a population that consists of a completely known stratum and a sampled stratum
+    :return: (estimate, standard error), the standard error is None if it can not be estimated from the sample
+    """
+    size = census_size + rest_size
+    if len(sample) == 0:
+        return census_sum / size, 0.0
+    mean = sum(sample) / len(sample)
+    estimate = (census_sum + rest_size * mean) / size
+    if len(sample) >= rest_size:
+        return estimate, 0.0
+    if len(sample) < 2:
+        return estimate, None
+    variance = sum((value - mean) ** 2 for value in sample) / (len(sample) - 1)
+    finite_population = 1 - len(sample) / rest_size
+    return estimate, rest_size / size * math.sqrt(finite_population * variance / len(sample))
+
+
+def _stratified_ratio(census_numerator, census_denominator, numerators, denominators, rest_size):
+    """
+    Estimates the ratio of two population totals (e.g. costs and best worst costs) with the linearization of the ratio estimator
+    :return: (estimate, standard error), None if the denominator is 0
+    """
+    n = len(numerators)
+    numerator = census_numerator + (rest_size * sum(numerators) / n if n > 0 else 0)
+    denominator = census_denominator + (rest_size * sum(denominators) / n if n > 0 else 0)
+    if denominator == 0:
+        return None, None
+    ratio = numerator / denominator
+    if n == 0 or n >= rest_size:
+        return ratio, 0.0
+    if n < 2:
+        return ratio, None
+    residuals = [x - ratio * y for x, y in zip(numerators, denominators)]
+    mean = sum(residuals) / n
+    variance = sum((value - mean) ** 2 for value in residuals) / (n - 1)
+    finite_population = 1 - n / rest_size
+    return ratio, rest_size * math.sqrt(finite_population * variance / n) / denominator
+
+
+def _interval(estimate, standard_error, z, upper):
+    if standard_error is None:
+        return None
+    return [max(0.0, estimate - z * standard_error), min(upper, estimate + z * standard_error)]
@@ -0,0 +1,107 @@
+import heapq
+from itertools import count
+from pm4py.objects.petri_net import semantics
+from pm4py.objects.petri_net.utils.align_utils import STD_MODEL_LOG_MOVE_COST, STD_TAU_COST
+
+
+def heuristic_alignment(variant, net, im, fm, best_worst_cost=0, max_states=10000):
+    """
+    Computes an alignment of a variant greedily, used when the optimal alignment exceeds its time budget.
+    Each event is matched with the first visible transition with its label that becomes enabled by firing invisible
+    transitions, events that can not be matched are log moves. Afterwards the final marking is reached with the cheapest
+    model moves. The result is a valid but not necessarily optimal alignment, so its fitness is a lower bound of the
+    fitness of the optimal alignment. The standard costs of pm4py are used.
+    :param variant: variant (tuple of activities)
+    :param net: petri net
+    :param im: initial marking
+    :param fm: final marking
+    :param best_worst_cost: cost of the cheapest run of the model without events, see get_best_worst_cost of pm4py
+    :param max_states: maximum number of markings that are explored per search
+    :return: alignment in the sync product aware format of conformance.alignments.align_variants with approximate set to True.
+        None if the final marking can not be reached within max_states, like alignments that time out in pm4py
+    """
+    marking = im
+    moves = []
+    cost = 0
+    for i, activity in enumerate(variant):
+        log_name = f"t_{activity}_{i}"
+        path = _shortest_path(net, marking, max_states,
+                              lambda transition, m: transition.label == activity,
+                              lambda transition: transition.label is None)
+        if path is None:
+            moves.append(((log_name, '>>'), (activity, '>>')))
+            cost += STD_MODEL_LOG_MOVE_COST
+            continue
+        *invisible, transition = path
+        for model_transition in invisible:
+            moves.append((('>>', model_transition.name), ('>>', None)))
+            cost += STD_TAU_COST
+        moves.append(((log_name, transition.name), (activity, transition.label)))
+        for model_transition in path:
+            marking = semantics.weak_execute(model_transition, marking)
+
+    final_cost = _move_to_final_marking(net, marking, fm, moves, max_states)
+
+    # fitness as in pm4py's alignment algorithm
+    bwc = len(variant) * STD_MODEL_LOG_MOVE_COST + best_worst_cost
+    if final_cost is None or cost + final_cost > bwc:
+        # the greedy matching is stuck or worse than moving on the log only and running the model without events
+        moves = [((f"t_{activity}_{i}", '>>'), (activity, '>>')) for i, activity in enumerate(variant)]
+        final_cost = _move_to_final_marking(net, im, fm, moves, max_states)
+        if final_cost is None:
+            return None
+        cost = len(variant) * STD_MODEL_LOG_MOVE_COST
+    cost += final_cost
+    denominator = bwc // STD_MODEL_LOG_MOVE_COST
+    return {
+        "alignment": moves,
+        "cost": cost,
+        "visited_states": 0,
+        "queued_states": 0,
+        "traversed_arcs": 0,
+        "fitness": 1 - (cost // STD_MODEL_LOG_MOVE_COST) / denominator if denominator > 0 else 0,
+        "bwc": bwc,
+        "approximate": True,
+    }
+
+
+def _move_to_final_marking(net, marking, fm, moves, max_states):
+    """
+    Appends the cheapest model moves from a marking to the final marking to the moves
+    :return: cost of the model moves, None if the final marking is not reached within max_states
+    """
+    path = _shortest_path(net, marking, max_states, lambda transition, m: m == fm) if marking != fm else []
+    if path is None:
+        return None
+    cost = 0
+    for transition in path:
+        moves.append((('>>', transition.name), ('>>', transition.label)))
+        cost += STD_TAU_COST if transition.label is None else STD_MODEL_LOG_MOVE_COST
+    return cost
+
+
+def _shortest_path(net, marking, max_states, is_goal, is_allowed=lambda transition: True):
+    """
+    Searches the cheapest sequence of transitions from a marking whose last transition satisfies is_goal
+    :param is_goal: function (transition, marking after the transition) -> whether the search ends
+    :param is_allowed: function transition -> whether the transition may be fired before the goal
+    :return: list of transitions, None if no sequence is found within max_states markings
+    """
+    tie_breaker = count()
+    queue = [(0, next(tie_breaker), marking, [], False)]
+    closed = set()
+    while queue and len(closed) < max_states:
+        cost, _, current, path, reached = heapq.heappop(queue)
+        if reached:
+            return path
+        if current in closed:
+            continue
+        closed.add(current)
+        for transition in semantics.enabled_transitions(net, current):
+            following = semantics.weak_execute(transition, current)
+            transition_cost = STD_TAU_COST if transition.label is None else STD_MODEL_LOG_MOVE_COST
+            if is_goal(transition, following):
+                heapq.heappush(queue, (cost + transition_cost, next(tie_breaker), following, path + [transition], True))
+            elif is_allowed(transition) and following not in closed:
+                heapq.heappush(queue, (cost + transition_cost, next(tie_breaker), following, path + [transition], False))
+    return None
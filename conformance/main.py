@@ -1,5 +1,13 @@
 import pm4py
+from pm4py.algo.evaluation.replay_fitness.variants import alignment_based as replay_fitness
 from utils.api_requests import fetch_event_log
+from conformance.alignments import align_variants, get_variants, labels_only
+from conformance.precision import precision_from_alignments
+from conformance.fast import fast_conformance
+
+conformance_modes = ["exact", "fast"]
+# Align-ETConformance precision with the markings of the prefixes read from the trace alignments, see conformance.precision
+precision_method = "trace-alignments"
 
 
 def custom_trace_cost_function(log):
@@ -18,28 +26,87 @@ def custom_trace_cost_function(log):
     return cost
 
 
-def conformance( event_log, net, im, fm):
+def conformance(event_log, net, im, fm, include_unfitting=False, mode="exact"):
+    """
+    Computes the fitness and the precision of a net on an event log.
+    Each variant is aligned once, fitness, precision and the unfitting traces are derived from the same alignments.
+    :param event_log: event log as a dataframe
+    :param net: petri net
+    :param im: initial marking
+    :param fm: final marking
+    :param include_unfitting: whether the alignments of the unfitting traces are added as unfittingTraces
+    :param mode: "exact" aligns all variants, "fast" estimates the fitness from a sample and uses token-based precision,
+        see conformance.fast.fast_conformance
+    :return: dict with fitness and precision, None if they could not be computed, the precisionMethod and the number of
+        approximateTraces whose alignment exceeded the time budget and was computed heuristically.
+        The precision of the exact mode is read from the trace alignments, see conformance.precision
+    """
+    if mode not in conformance_modes:
+        raise ValueError(f"conformance mode must be one of {conformance_modes}")
+    if mode == "fast":
+        return fast_conformance(event_log, net, im, fm, include_unfitting=include_unfitting)
+    try:
+        variants = get_variants(event_log)
+        alignments = align_variants(variants, net, im, fm)
+    except Exception as e:
+        print(e)
+        result = {"fitness": None, "precision": None, "precisionMethod": precision_method, "approximateTraces": None}
+        if include_unfitting:
+            result["unfittingTraces"] = None
+        return result
+    case_alignments = [alignments[variant] for variant in variants]
     try:
-        fitness = pm4py.conformance.fitness_alignments(event_log, net, im, fm)
-    except:
+        fitness = replay_fitness.evaluate(case_alignments)
+    except Exception as e:
+        print(e)
         fitness = None
     try:
-        precision = pm4py.conformance.precision_alignments(
-            event_log, net, im, fm)
-    except:
+        precision = precision_from_alignments(
+            variants, alignments, net, im, number_of_events=len(event_log))
+    except Exception as e:
+        print(e)
         precision = None
-    return {
-        "fitness":fitness,
-        "precision":precision,
+    result = {
+        "fitness": fitness,
+        "precision": precision,
+        "precisionMethod": precision_method,
+        "approximateTraces": count_approximate(case_alignments),
     }
+    if include_unfitting:
+        result["unfittingTraces"] = unfitting_alignments(case_alignments)
+    return result
+
 
 def find_unfitting_traces(event_log, net, im, fm):
-    diagnostics = pm4py.conformance.conformance_diagnostics_alignments(event_log,net,im,fm)
-    unfitting = list(trace for trace in diagnostics if trace['fitness'] < 1)
-    return unfitting
+    variants = get_variants(event_log)
+    alignments = align_variants(variants, net, im, fm)
+    return unfitting_alignments([alignments[variant] for variant in variants])
+
+
+def unfitting_alignments(case_alignments):
+    """
+    Gets the alignments of the traces that do not fit the model, in the label format of pm4py
+    :param case_alignments: list of alignments, one per case
+    """
+    return [labels_only(alignment) for alignment in case_alignments if alignment is not None and alignment['fitness'] < 1]
+
+
+def count_approximate(case_alignments):
+    """
+    Counts the cases whose alignment was computed heuristically, see conformance.heuristic
+    """
+    return sum(1 for alignment in case_alignments if alignment is not None and alignment.get('approximate', False))
 
 
 def trace_is_fitting(trace, net, im, fm):
-    from pm4py.algo.conformance.alignments.petri_net import algorithm as alignments
-    return alignments.apply_trace(trace, net, im, fm)['fitness'] == 1
+    """
+    Checks whether a trace fits the net. If the alignment exceeds its time budget, the trace is only fitting
+    if the heuristic alignment fits
+    :return: whether the trace fits, None if no alignment could be computed
+    """
+    variant = tuple(event["concept:name"] for event in trace)
+    alignment = align_variants([variant], net, im, fm, cache=None)[variant]
+    if alignment is None:
+        return None
+    return alignment['fitness'] == 1
 
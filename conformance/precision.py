@@ -0,0 +1,84 @@
+from collections import Counter
+from pm4py.objects.petri_net import semantics
+from pm4py.objects.petri_net.utils.align_utils import get_visible_transitions_eventually_enabled_by_marking
+
+
+def precision_from_alignments(variants, alignments, net, im, number_of_events=None):
+    """
+    Approximates the Align-ETConformance precision of pm4py from the alignments of the complete traces.
+    pm4py aligns every prefix of the log again and uses all markings in which an optimal alignment of the prefix ends.
+    Here the marking after a prefix is read from the optimal alignment of each trace with that prefix, so the alignments
+    that were computed for the fitness are reused. The result is the same if the model replays each prefix in one way.
+    If a choice of the model is only resolved by a later event, e.g. two transitions with the same label in different
+    branches, only the markings of the branches taken by the traces count and the precision is higher than pm4py's.
+    :param variants: list of variants (tuples of activities), one per case
+    :param alignments: dict variant -> alignment with transition names, see conformance.alignments.align_variants
+    :param net: petri net
+    :param im: initial marking
+    :param number_of_events: weight of the initial marking, pm4py uses the length of the dataframe. Defaults to the number of cases
+    :return: precision between 0 and 1
+    """
+    transitions = {transition.name: transition for transition in net.transitions}
+    prefixes = {}  # prefix -> [activities that follow the prefix, number of occurrences, {key: marking after the prefix}]
+    for variant, count in Counter(variants).items():
+        alignment = alignments.get(variant)
+        markings = prefix_markings(
+            alignment, transitions, im) if alignment is not None else None
+        for i in range(1, len(variant)):
+            prefix = prefixes.setdefault(variant[:i], [set(), 0, {}])
+            prefix[0].add(variant[i])
+            prefix[1] += count
+            if markings is not None and i <= len(markings):
+                marking = markings[i - 1]
+                prefix[2][frozenset(marking.items())] = marking
+
+    enabled_labels = {}  # marking -> labels of the visible transitions that are eventually enabled
+
+    def enabled(key, marking):
+        if key not in enabled_labels:
+            enabled_labels[key] = {transition.label for transition in get_visible_transitions_eventually_enabled_by_marking(
+                net, marking) if transition.label is not None}
+        return enabled_labels[key]
+
+    activated_sum = 0
+    escaping_sum = 0
+    for following, count, markings in prefixes.values():
+        if len(markings) == 0:
+            # the model can not replay the prefix without deviations
+            continue
+        activated = set().union(*(enabled(key, marking)
+                                  for key, marking in markings.items()))
+        activated_sum += len(activated) * count
+        escaping_sum += len(activated - following) * count
+
+    # the empty prefix, as in pm4py
+    start_activities = {variant[0] for variant in variants if len(variant) > 0}
+    initially_enabled = enabled(frozenset(im.items()), im)
+    weight = number_of_events if number_of_events is not None else len(variants)
+    activated_sum += weight * len(initially_enabled)
+    escaping_sum += weight * len(initially_enabled - start_activities)
+
+    if activated_sum == 0:
+        return 1.0
+    return 1 - escaping_sum / activated_sum
+
+
+def prefix_markings(alignment, transitions, im):
+    """
+    Replays the model moves of an alignment up to the first deviation.
+    Like pm4py, only prefixes that the model can replay with synchronous and invisible moves have a marking.
+    :param alignment: alignment with transition names
+    :param transitions: dict transition name -> transition
+    :param im: initial marking
+    :return: list of markings, the i-th marking is reached after the i-th event of the trace.
+        The list ends at the first log move or visible model move
+    """
+    marking = im
+    markings = []
+    for (log_name, model_name), (_, model_label) in alignment['alignment']:
+        if model_name == '>>' or (log_name == '>>' and model_label is not None):
+            break
+        marking = semantics.weak_execute(transitions[model_name], marking)
+        if log_name != '>>':
+            markings.append(marking)
+    return markings
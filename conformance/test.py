@@ -0,0 +1,227 @@
+import unittest
+import json
+import os
+import sys
+import tempfile
+import pm4py
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pm4py.algo.conformance.alignments.petri_net import algorithm as alignments_algorithm
+from pm4py.objects.petri_net import semantics
+from pm4py.objects.petri_net.obj import PetriNet, Marking
+from pm4py.objects.petri_net.utils import petri_utils
+from conformance import alignments
+from conformance.alignments import AlignmentCache, align_log, align_variants, get_variants, net_fingerprint
+from conformance.heuristic import heuristic_alignment
+from conformance.main import conformance, find_unfitting_traces
+from conformance.fast import fast_conformance
+from utils.bot.parse_lib import BotParser
+
+
+def get_bot_model_json(rel_path):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(current_dir, rel_path), 'r', encoding='UTF-8') as f:
+        return json.load(f)
+
+
+def get_event_log(rel_path):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return pm4py.read_xes(os.path.join(current_dir, rel_path))
+
+
+class TestAlignments(unittest.TestCase):
+    def setUp(self):
+        bot_parser = BotParser(get_bot_model_json(
+            '../enhancement/assets/alignment-test.json'))
+        self.net, self.im, self.fm = bot_parser.to_petri_net()
+        self.event_log = get_event_log('../enhancement/assets/test.xes')
+
+    def test_same_costs_as_pm4py(self):
+        expected = alignments_algorithm.apply(
+            self.event_log, self.net, self.im, self.fm)
+        result = align_log(self.event_log, self.net,
+                           self.im, self.fm, cache=None)
+        self.assertEqual([a['cost'] for a in result],
+                         [a['cost'] for a in expected])
+        self.assertEqual([a['fitness'] for a in result],
+                         [a['fitness'] for a in expected])
+
+    def test_cache_is_persisted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'alignments.sqlite3')
+            cache = AlignmentCache(path)
+            first = align_log(self.event_log, self.net,
+                              self.im, self.fm, cache=cache)
+            self.assertEqual(cache.stats()['hits'], 0)
+
+            restarted = AlignmentCache(path)
+            second = align_log(self.event_log, self.net,
+                               self.im, self.fm, cache=restarted)
+            self.assertEqual(first, second)
+            stats = restarted.stats()
+            self.assertEqual(stats['misses'], 0)
+            self.assertEqual(stats['hitRatio'], 1.0)
+
+    def test_fingerprint_does_not_depend_on_object_identity(self):
+        bot_parser = BotParser(get_bot_model_json(
+            '../enhancement/assets/alignment-test.json'))
+        net, im, fm = bot_parser.to_petri_net()
+        self.assertEqual(net_fingerprint(net, im, fm),
+                         net_fingerprint(self.net, self.im, self.fm))
+
+    def test_parallel_results_are_identical(self):
+        bot_parser = BotParser(get_bot_model_json(
+            '../assets/models/mensabot.json'))
+        net, im, fm = bot_parser.to_petri_net()
+        event_log = get_event_log('../assets/event_logs/demo.xes')
+        event_log = event_log[event_log['lifecycle:transition'] == 'complete']
+        min_parallel_variants = alignments.min_parallel_variants
+        alignments.min_parallel_variants = 2
+        try:
+            serial = align_log(event_log, net, im, fm, cache=None, workers=1)
+            parallel = align_log(event_log, net, im, fm,
+                                 cache=None, workers=2)
+            # the workers keep the net, it is only sent again to workers that did not get it yet
+            again = align_log(event_log, net, im, fm, cache=None, workers=2)
+        finally:
+            alignments.min_parallel_variants = min_parallel_variants
+        # ties between optimal alignments are broken arbitrarily by pm4py, the costs are always the same
+        self.assertEqual([(a['cost'], a['fitness']) for a in serial],
+                         [(a['cost'], a['fitness']) for a in parallel])
+        self.assertEqual([(a['cost'], a['fitness']) for a in serial],
+                         [(a['cost'], a['fitness']) for a in again])
+
+
+class TestConformance(unittest.TestCase):
+    def test_same_fitness_and_precision_as_pm4py(self):
+        for model, log in [('../enhancement/assets/alignment-test.json', '../enhancement/assets/test.xes'),
+                           ('../assets/models/mensabot-simplified.json', '../assets/event_logs/demo.xes')]:
+            net, im, fm = BotParser(get_bot_model_json(model)).to_petri_net()
+            event_log = get_event_log(log)
+            result = conformance(event_log, net, im, fm, include_unfitting=True)
+            self.assertEqual(result['fitness'], pm4py.conformance.fitness_alignments(event_log, net, im, fm))
+            self.assertAlmostEqual(result['precision'], pm4py.conformance.precision_alignments(event_log, net, im, fm))
+            self.assertEqual(result['unfittingTraces'], find_unfitting_traces(event_log, net, im, fm))
+            self.assertTrue(all(trace['fitness'] < 1 for trace in result['unfittingTraces']))
+
+    def test_precision_of_choice_resolved_later(self):
+        # two branches start with the same label, the choice is only resolved by the second event
+        net = PetriNet('choice')
+        places = {name: PetriNet.Place(name) for name in ['source', 'p1', 'p2', 'p3', 'p4', 'sink']}
+        net.places.update(places.values())
+        for name, label, source, target in [('tau1', None, 'source', 'p1'), ('tau2', None, 'source', 'p2'),
+                                            ('a1', 'a', 'p1', 'p3'), ('a2', 'a', 'p2', 'p4'),
+                                            ('b', 'b', 'p3', 'sink'), ('c', 'c', 'p4', 'sink')]:
+            transition = PetriNet.Transition(name, label)
+            net.transitions.add(transition)
+            petri_utils.add_arc_from_to(places[source], transition, net)
+            petri_utils.add_arc_from_to(transition, places[target], net)
+        im, fm = Marking({places['source']: 1}), Marking({places['sink']: 1})
+        event_log = pd.DataFrame({'case:concept:name': ['1', '1'], 'concept:name': ['a', 'b'],
+                                  'time:timestamp': pd.to_datetime(['2023-01-01 10:00', '2023-01-01 10:01'], utc=True)})
+        result = conformance(event_log, net, im, fm)
+        self.assertEqual(result['precisionMethod'], 'trace-alignments')
+        # the alignment of the trace only reaches the branch of b after a, pm4py also counts the branch of c
+        self.assertEqual(result['precision'], 1.0)
+        self.assertAlmostEqual(pm4py.conformance.precision_alignments(event_log, net, im, fm), 0.75)
+        # once the log takes both branches, the results agree
+        event_log = pd.concat([event_log, event_log.assign(**{'case:concept:name': '2', 'concept:name': ['a', 'c']})])
+        self.assertAlmostEqual(conformance(event_log, net, im, fm)['precision'],
+                               pm4py.conformance.precision_alignments(event_log, net, im, fm))
+
+
+class TestTimeBudget(unittest.TestCase):
+    def setUp(self):
+        self.net, self.im, self.fm = BotParser(get_bot_model_json(
+            '../assets/models/mensabot.json')).to_petri_net()
+        self.variants = list(dict.fromkeys(get_variants(
+            get_event_log('../assets/event_logs/demo.xes'))))
+        self.request_timeout = alignments.request_timeout
+
+    def tearDown(self):
+        alignments.request_timeout = self.request_timeout
+
+    def test_heuristic_alignment_is_a_lower_bound(self):
+        exact = align_variants(self.variants, self.net, self.im, self.fm, cache=None)
+        best_worst_cost = alignments_algorithm.DEFAULT_VARIANT.value.get_best_worst_cost(
+            self.net, self.im, self.fm)
+        for variant in self.variants:
+            heuristic = heuristic_alignment(variant, self.net, self.im, self.fm, best_worst_cost)
+            self.assertTrue(heuristic['approximate'])
+            self.assertEqual(tuple(log_label for _, (log_label, _) in heuristic['alignment'] if log_label != '>>'),
+                             variant)
+            self.assertEqual(heuristic['bwc'], exact[variant]['bwc'])
+            self.assertGreaterEqual(heuristic['cost'], exact[variant]['cost'])
+            self.assertGreaterEqual(heuristic['fitness'], 0)
+            self.assertLessEqual(heuristic['fitness'], exact[variant]['fitness'])
+
+    def test_heuristic_alignment_reaches_final_marking(self):
+        transitions = {transition.name: transition for transition in self.net.transitions}
+        results = set()
+        for max_states in [1, 3, 10000]:
+            for variant in self.variants:
+                heuristic = heuristic_alignment(variant, self.net, self.im, self.fm, max_states=max_states)
+                results.add(heuristic is None)
+                if heuristic is None:
+                    continue
+                marking = self.im
+                for (_, model_name), _ in heuristic['alignment']:
+                    if model_name != '>>':
+                        marking = semantics.weak_execute(transitions[model_name], marking)
+                self.assertEqual(marking, self.fm)
+        # incomplete alignments are left out like alignments that time out
+        self.assertEqual(results, {True, False})
+
+    def test_exceeded_request_budget_falls_back_without_caching(self):
+        alignments.request_timeout = 0
+        cache = AlignmentCache()
+        result = align_variants(self.variants, self.net, self.im, self.fm, cache=cache)
+        self.assertTrue(all(result[variant]['approximate'] for variant in self.variants))
+        self.assertEqual(len(cache.memory), 0)
+        event_log = get_event_log('../assets/event_logs/demo.xes')
+        self.assertEqual(conformance(event_log, self.net, self.im, self.fm)['approximateTraces'],
+                         event_log['case:concept:name'].nunique())
+
+
+class TestFastConformance(unittest.TestCase):
+    def setUp(self):
+        self.net, self.im, self.fm = BotParser(get_bot_model_json(
+            '../assets/models/mensabot-simplified.json')).to_petri_net()
+        self.event_log = get_event_log('../assets/event_logs/demo.xes')
+
+    def test_same_precision_as_pm4py(self):
+        result = fast_conformance(self.event_log, self.net, self.im, self.fm, cache=None)
+        self.assertAlmostEqual(result['precision'], pm4py.conformance.precision_token_based_replay(
+            self.event_log, self.net, self.im, self.fm))
+        self.assertEqual(result['precisionMethod'], 'token-based')
+
+    def test_exact_fitness_if_all_variants_are_aligned(self):
+        result = fast_conformance(self.event_log, self.net, self.im, self.fm, sample_size=100, cache=None)
+        expected = pm4py.conformance.fitness_alignments(self.event_log, self.net, self.im, self.fm)
+        for key in ['averageFitness', 'percFitTraces', 'log_fitness']:
+            self.assertAlmostEqual(result['fitness'][key], expected[key])
+            low, high = result['fitness']['confidenceIntervals'][key]
+            self.assertAlmostEqual(low, high)
+
+    def test_sampled_fitness_has_confidence_intervals(self):
+        result = fast_conformance(self.event_log, self.net, self.im, self.fm, sample_size=6, cache=None)
+        fitness = result['fitness']
+        self.assertEqual(fitness['cases'], self.event_log['case:concept:name'].nunique())
+        self.assertLessEqual(fitness['alignedVariants'], 6)
+        low, high = fitness['confidenceIntervals']['averageFitness']
+        self.assertLessEqual(low, fitness['averageFitness'])
+        self.assertGreaterEqual(high, fitness['averageFitness'])
+        self.assertEqual(result, fast_conformance(
+            self.event_log, self.net, self.im, self.fm, sample_size=6, cache=None))
+
+    def test_cache_stats_count_aligned_variants_once(self):
+        cache = AlignmentCache()
+        result = fast_conformance(self.event_log, self.net, self.im, self.fm, sample_size=6, cache=cache)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (0, result['fitness']['alignedVariants']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,10 @@
 import pm4py
-import json
+import numpy as np
+import pandas as pd
+from utils.db.connection import read_bot_statistics
+
+# user attribute of the json REMARKS of an event
+user_pattern = r'"user"\s*:\s*"([^"]*)"'
     
 def discover_petri_net(event_log,algorithm="inductive"):
     """
@@ -78,18 +83,77 @@ def discover_bpmn(event_log):
     return pm4py.discover_bpmn_inductive(event_log)
 
 def bot_statistics(event_log):
+    """
+    compute the statistics of the conversations of a bot
+
+    Parameters
+    ----------
+    event_log : pandas dataframe
+        event log of the bot
+
+    Returns
+    -------
+    stats : dict
+        number of conversations, states and users, average length (events) and duration (seconds) of the conversations
+    """
     stats = dict()
     if (event_log is None):
         return stats
-    stats['numberOfConversations'] = event_log.groupby('case:concept:name').ngroups
-    stats['numberOfStates'] = event_log['concept:name'].nunique()
+    # length and first and last timestamp of each conversation in one pass
+    cases = event_log.groupby('case:concept:name', observed=True, sort=False)[
+        'time:timestamp'].agg(['size', 'min', 'max'])
+    # distinct states and users in one pass
+    distinct = pd.DataFrame({'states': event_log['concept:name'].to_numpy(),
+                             'users': user_column(event_log)}).nunique()
+    stats['numberOfConversations'] = len(cases)
+    stats['numberOfStates'] = int(distinct['states'])
+    stats['numberOfUsers'] = int(distinct['users'])
+    stats['averageConversationLength'] = cases['size'].mean()
+    stats['averageConversationDuration'] = (
+        cases['max'] - cases['min']).mean().total_seconds()
+    return stats
+
+
+def user_column(event_log):
+    """
+    get the user of each event, read from the user column or from the REMARKS of the events
+
+    The user is extracted from the REMARKS with a regular expression on each distinct value instead of parsing the json,
+    users that are not strings are not found.
+
+    Parameters
+    ----------
+    event_log : pandas dataframe
+        event log of the bot
+
+    Returns
+    -------
+    users : numpy array
+        user of each event, NaN if the event has no user
+    """
     if 'user' in event_log.columns:
-        stats['numberOfUsers'] = event_log['user'].nunique()
-    else:
-        users = event_log['REMARKS'].apply(lambda x: json.loads(x)['user'])
-        stats['numberOfUsers'] = users.nunique()
-    stats['averageConversationLength'] = event_log.groupby(
-        'case:concept:name').size().mean()
-    stats['averageConversationDuration'] = event_log.groupby(
-        'case:concept:name')['time:timestamp'].apply(lambda x: x.max() - x.min()).mean().total_seconds()
-    return stats
\ No newline at end of file
+        return event_log['user'].to_numpy()
+    # many events share the same remarks, each distinct value is matched once
+    remarks = event_log['REMARKS'].astype('category')
+    users = remarks.cat.categories.astype(str).to_series().str.extract(
+        user_pattern, expand=False).to_numpy()
+    return np.append(users, np.nan)[remarks.cat.codes.to_numpy()]
+
+
+def database_bot_statistics(db_connection, resource_ids):
+    """
+    compute the statistics of the conversations of a bot in the events database, without reading the event log
+
+    Parameters
+    ----------
+    db_connection : sqlalchemy engine
+        connection to the events database
+    resource_ids : list
+        resource ids of the bot
+
+    Returns
+    -------
+    stats : dict
+        the same statistics as bot_statistics
+    """
+    return read_bot_statistics(db_connection, resource_ids)
@@ -0,0 +1,47 @@
+import unittest
+import os
+import sys
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from discovery.main import bot_statistics
+
+
+def get_event_log():
+    return pd.DataFrame({
+        'case:concept:name': ['1', '1', '1', '2', '2'],
+        'concept:name': ['greet', 'menu', 'bye', 'greet', 'bye'],
+        'time:timestamp': pd.to_datetime(['2023-01-01 10:00:00', '2023-01-01 10:00:10', '2023-01-01 10:00:30',
+                                          '2023-01-02 10:00:00', '2023-01-02 10:00:10'], utc=True),
+        'REMARKS': ['{"user": "a"}', '{"user": "a"}', '{"user": "a", "in-service-context": true}',
+                    '{"user": "b"}', '{"user": "b"}'],
+    })
+
+
+class TestBotStatistics(unittest.TestCase):
+    def test_statistics(self):
+        stats = bot_statistics(get_event_log())
+        self.assertEqual(stats['numberOfConversations'], 2)
+        self.assertEqual(stats['numberOfStates'], 3)
+        self.assertEqual(stats['numberOfUsers'], 2)
+        self.assertEqual(stats['averageConversationLength'], 2.5)
+        self.assertEqual(stats['averageConversationDuration'], 20)
+
+    def test_user_column_is_preferred(self):
+        event_log = get_event_log().assign(user=['a', 'a', 'a', 'a', 'a'])
+        self.assertEqual(bot_statistics(event_log)['numberOfUsers'], 1)
+
+    def test_events_without_user(self):
+        event_log = get_event_log()
+        event_log['REMARKS'] = ['{"user": "a"}', None, '{"user": null}', '{"intent": {"user": 1}}', '{"user" : "b"}']
+        self.assertEqual(bot_statistics(event_log)['numberOfUsers'], 2)
+        event_log['REMARKS'] = None
+        self.assertEqual(bot_statistics(event_log)['numberOfUsers'], 0)
+
+    def test_no_event_log(self):
+        self.assertEqual(bot_statistics(None), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,25 @@
 import pm4py
 import uuid
+import json
+import base64
 import pandas as pd
 import itertools
-import uuid
-import statistics
 import numpy as np
-from pm4py.statistics.traces.generic.log import case_statistics
-from pm4py.algo.conformance.alignments.petri_net import algorithm as alignments_algorithm
+from collections import namedtuple
 from pm4py.algo.conformance.alignments.petri_net.variants.state_equation_a_star import Parameters
 from process_model_repair_algorithm import repair_process_model
+from conformance.alignments import align_log
+from utils.bot.dfg import DFG
+from utils.db.intent_confidence import intent_confidence_rollup
 
 bot_model_json_path = "./assets/models/test_bot_model.json"
+# namespace of the ids of nodes that are added to the bot model, the ids are derived from the activity label
+new_node_namespace = uuid.uuid5(
+    uuid.NAMESPACE_URL, "https://github.com/rwth-acis/process-mining-for-bots/nodes")
+
+# result of the enhancement of a bot model. new_nodes maps the ids of the nodes that were added to the bot model to their activity labels
+EnhancementResult = namedtuple('EnhancementResult', [
+                               'dfg', 'start_activities', 'end_activities', 'frequency_dfg', 'performance_dfg', 'performance_statistics', 'new_nodes', 'approximate_traces'])
 
 
 def enhance_bot_model(event_log, bot_parser, repair=False):
@@ -22,24 +31,18 @@ def enhance_bot_model(event_log, bot_parser, repair=False):
     We say that the bot is in the service context in that case.
     The event log contains the information whether we are in a service context as an additional attribute.
     :param event_log: event log
-    :param bot_model_dfg: bot model as a DFG
-    :return: enhanced bot model
+    :param bot_parser: bot parser, it is not modified
+    :return: enhanced bot model as an EnhancementResult
     """
     dfg, start_activities, end_activities = bot_parser.get_dfg()  # initial dfg
     net, im, fm = bot_parser.to_petri_net()
     if repair == True:
         net, _, _ = repair_petri_net(event_log, net, im, fm)  # repair the dfg
-    alignments_results = alignments_algorithm.apply(event_log, net, im, fm, {
+    # only variants that were not aligned against this net before are aligned
+    alignments_results = align_log(event_log, net, im, fm, {
         Parameters.PARAM_ALIGNMENT_RESULT_IS_SYNC_PROD_AWARE: True})
-    frequency_dfg = add_edge_frequency(event_log, dfg, start_activities,
-                                       end_activities, bot_parser, alignments_results)  # add the edge frequency
-    performance_dfg = add_edge_performance(
-        event_log, dfg, start_activities, end_activities, bot_parser, alignments_results)  # add the edge performance
-    # performance = pm4py.discovery.discover_performance_dfg(event_log)
-    # frequency = pm4py.discovery.discover_dfg(event_log)
-    # replace NaN values with None
-    # performance = __replace_nan_with_null(performance[0])
-    return dfg, start_activities, end_activities, frequency_dfg, performance_dfg
+    # add the edge frequency and performance
+    return replay_alignments(event_log, dfg, start_activities, end_activities, bot_parser, alignments_results)
 
 
 def repair_petri_net(event_log, net, im, fm):
@@ -61,240 +64,281 @@ def repair_petri_net(event_log, net, im, fm):
     return net, fm, im
 
 
-def add_edge_frequency(event_log, dfg, start_act, end_act, bot_parser, alignments_results=None):
+def replay_alignments(event_log, dfg, start_act, end_act, bot_parser, alignments_results=None, percentiles=(25, 75, 90)):
     """
-    Add the edge frequency to the bot model
+    Replays the alignments of the event log on the bot model in a single pass.
+    Each variant is resolved to edges of the bot model once and weighted by the number of its cases.
+    Moves on log become new nodes, edges that are not in the bot model are added.
+    Sources of new edges without incoming edges become start activities and targets without outgoing edges become end activities.
+    None of the arguments are modified.
     :param event_log: event log
-    :param bot_model_dfg: bot model as a DFG
+    :param dfg: bot model as a DFG
     :param start_act: start activities
     :param end_act: end activities
-    :param bot_parser: bot parser
-    :return: bot model with edge frequency
+    :param bot_parser: bot parser, used to compute the alignments if they are not provided
+    :param alignments_results: sync product aware alignments of the cases ordered by case id (optional)
+    :param percentiles: percentiles of the edge durations
+    :return: EnhancementResult with the frequency dfg, the performance dfg with the mean duration of each edge in seconds,
+        the duration statistics (mean, median and percentiles) of each edge, the added nodes and the number of cases
+        whose alignment exceeded the time budget and was computed heuristically
     """
-    frequency_dfg = dfg.copy()
-    net, im, fm = bot_parser.to_petri_net(frequency_dfg, start_act, end_act)
     if alignments_results is None:
-        alignments_results = alignments_algorithm.apply(event_log, net, im, fm, {
+        net, im, fm = bot_parser.to_petri_net(dfg.copy(), start_act, end_act)
+        alignments_results = align_log(event_log, net, im, fm, {
             Parameters.PARAM_ALIGNMENT_RESULT_IS_SYNC_PROD_AWARE: True})
-    variants = pm4py.stats.get_variants_as_tuples(event_log)
-    new_nodes = dict()  # nodes that are added to the bot model
-    for alignment in list(diagnostic['alignment'] for diagnostic in alignments_results):
+    new_nodes = dict()  # activity label -> id of the node that is added to the bot model
+    variants = dict()  # trace as it is in the log -> index of the variant
+    variant_edges = []  # edges of each variant
+    variant_counts = []  # number of cases of each variant
+    approximate_traces = 0
+    for diagnostic in alignments_results:
+        if diagnostic is None:
+            continue  # the alignment could not be computed
+        if diagnostic.get('approximate', False):
+            approximate_traces += 1
+        alignment = diagnostic['alignment']
         log_trace = tuple(log_move[0] for model_move,
-                          log_move in alignment if log_move[0] != ">>")  # trace as it is in the log
-        # model_trace = tuple(
-        #     log_move[1] for model_move, log_move in alignment if model_move[1] != ">>") # for debugging
-        log_trace_count = variants[log_trace]
+                          log_move in alignment if log_move[0] != ">>")
+        if log_trace not in variants:
+            variants[log_trace] = len(variant_edges)
+            variant_edges.append(_replayed_edges(alignment, new_nodes))
+            variant_counts.append(0)
+        variant_counts[variants[log_trace]] += 1
+
+    frequency_dfg = DFG(dfg)
+    start_act = set(start_act)
+    end_act = set(end_act)
+    for edges, log_trace_count in zip(variant_edges, variant_counts):
         potential_start_activities = set()
         potential_end_activities = set()
-
-        for ((source, align_source), (target, align_target)) in itertools.pairwise(alignment):
-            if (source[1] == ">>"):
-                if align_source[0] in new_nodes.keys():
-                    source_id = new_nodes[align_source[0]]
-                else:
-                    source_id = str(uuid.uuid4())
-                    new_nodes[align_source[0]] = source_id
-                    bot_parser.id_name_map[source_id] = align_source[0]
+        for edge, _, _ in edges:
+            if edge in frequency_dfg:
+                frequency_dfg[edge] += log_trace_count
             else:
-                source_id = source[1].split("_")[0]
-            if (target[1] == ">>"):
-                if align_target[0] in new_nodes.keys():
-                    target_id = new_nodes[align_target[0]]
-                else:
-                    target_id = str(uuid.uuid4())
-                    new_nodes[align_target[0]] = target_id
-                    bot_parser.id_name_map[target_id] = align_target[0]
-            else:
-                target_id = target[1].split("_")[0]
-
-            if (source_id, target_id) in frequency_dfg:
-                frequency_dfg[(source_id, target_id)] += log_trace_count
-            else:
-                potential_start_activities.add(source_id)
-                potential_end_activities.add(target_id)
-                frequency_dfg[(source_id, target_id)] = log_trace_count
-
+                potential_start_activities.add(edge[0])
+                potential_end_activities.add(edge[1])
+                frequency_dfg[edge] = log_trace_count
         for potential_start_activity in potential_start_activities:
-            # check if the potential start activity has no incoming edge
-            has_incoming_edge = False
-            for _, target in frequency_dfg.keys():
-                if target == potential_start_activity:
-                    has_incoming_edge = True
-                    break
-            if not has_incoming_edge and potential_start_activity not in start_act:
+            if not frequency_dfg.has_incoming(potential_start_activity):
                 start_act.add(potential_start_activity)
         for potential_end_activity in potential_end_activities:
-            # check if the potential end activity has no outgoing edge
-            has_outgoing_edge = False
-            for source, _ in frequency_dfg.keys():
-                if source == potential_end_activity:
-                    has_outgoing_edge = True
-                    break
-            if not has_outgoing_edge and potential_end_activity not in end_act:
+            if not frequency_dfg.has_outgoing(potential_end_activity):
                 end_act.add(potential_end_activity)
-    return frequency_dfg
+
+    performance_statistics = edge_duration_statistics(
+        event_log, variants, variant_edges, percentiles)
+    performance_dfg = DFG(dfg)
+    for edge in frequency_dfg.keys():
+        if edge in performance_statistics:
+            performance_dfg[edge] = performance_statistics[edge]["mean"]
+        else:
+            performance_dfg.setdefault(edge, 0)
+    return EnhancementResult(dfg, start_act, end_act, frequency_dfg, performance_dfg, performance_statistics,
+                             {node_id: label for label, node_id in new_nodes.items()}, approximate_traces)
 
 
-def add_edge_performance(event_log, dfg, start_act, end_act, bot_parser, alignments_results=None):
+def edge_duration_statistics(event_log, variants, variant_edges, percentiles=(25, 75, 90)):
     """
-    Add the edge performance to the bot model
+    Computes the duration statistics of the edges of the bot model for the whole log at once.
+    The durations between consecutive events of all cases are computed in one vectorized pass
+    and joined with the edges that the alignment of each variant maps the events to.
+    Cases are joined with the variants by their trace, events by their position in the trace.
     :param event_log: event log
-    :param bot_model_dfg: bot model as a DFG
-    :param start_act: start activities
-    :param end_act: end activities
-    :param bot_parser: bot parser
-    :return: bot model with edge frequency
+    :param variants: dict trace (tuple of activities in the order of the log) -> index of the variant,
+        cases whose trace is not in the dict are skipped
+    :param variant_edges: edges of each variant, see _replayed_edges
+    :param percentiles: percentiles of the durations
+    :return: dict edge -> duration statistics in seconds (mean, median and p<percentile>)
     """
-    performance_dfg = dfg.copy()
-    net, im, fm = bot_parser.to_petri_net(performance_dfg, start_act, end_act)
-    if alignments_results is None:
-        alignments_results = alignments_algorithm.apply(event_log, net, im, fm, {
-            Parameters.PARAM_ALIGNMENT_RESULT_IS_SYNC_PROD_AWARE: True})
-    variants = pm4py.stats.get_variants_as_tuples(event_log)
-    new_nodes = dict()  # nodes that are added to the bot model
-    for alignment in list(diagnostic['alignment'] for diagnostic in alignments_results):
-        log_trace = tuple(log_move[0] for model_move,
-                          log_move in alignment if log_move[0] != ">>")  # trace as it is in the log
-        model_trace = tuple(
-            log_move[1] for model_move, log_move in alignment if model_move[1] != ">>")  # for debugging
-        performance = _average_performance_of_trace(
-            log_trace, event_log, alignment)
-        potential_start_activities = set()
-        potential_end_activities = set()
-
-        for ((source, align_source), (target, align_target)) in itertools.pairwise(alignment):
-            if (source[1] == ">>"):
-                if align_source[0] in new_nodes.keys():
-                    source_id = new_nodes[align_source[0]]
-                else:
-                    source_id = str(uuid.uuid4())
-                    new_nodes[align_source[0]] = source_id
-                    bot_parser.id_name_map[source_id] = align_source[0]
-            else:
-                source_id = source[1].split("_")[0]
-            if (target[1] == ">>"):
-                if align_target[0] in new_nodes.keys():
-                    target_id = new_nodes[align_target[0]]
-                else:
-                    target_id = str(uuid.uuid4())
-                    new_nodes[align_target[0]] = target_id
-                    bot_parser.id_name_map[target_id] = align_target[0]
-            else:
-                target_id = target[1].split("_")[0]
+    edge_ids = dict()  # edge -> index
+    mapping = [(variant, source_event, edge_ids.setdefault(edge, len(edge_ids)))
+               for variant, edges in enumerate(variant_edges)
+               for edge, source_event, target_event in edges if source_event is not None and target_event is not None]
+    if len(mapping) == 0:
+        return dict()
+    mapping = pd.DataFrame(mapping, columns=["variant", "position", "edge"])
+
+    # the trace of each case is built in the order of the log like the traces that were aligned, see get_variants
+    cases = event_log.groupby("case:concept:name", sort=False)
+    case_variants = [variants.get(trace, -1)
+                     for trace in cases["concept:name"].agg(tuple)]
+    timestamps = event_log["time:timestamp"]
+    events = pd.DataFrame({
+        "variant": np.asarray(case_variants, dtype=np.int64)[cases.ngroup().to_numpy()],
+        "position": cases.cumcount().to_numpy(),
+        "duration": (cases["time:timestamp"].shift(-1) - timestamps).dt.total_seconds().to_numpy(),
+    })
+    durations = events.merge(mapping, on=["variant", "position"])
+    durations = durations[durations["duration"].notna()].groupby("edge")[
+        "duration"]
+    statistics = durations.agg(["mean", "median"])
+    quantiles = durations.quantile(
+        [percentile / 100 for percentile in percentiles]).unstack()
+
+    edges = list(edge_ids.keys())
+    performance_statistics = dict()
+    for edge_id, row in statistics.iterrows():
+        edge_statistics = {"mean": float(row["mean"]),
+                           "median": float(row["median"])}
+        for percentile in percentiles:
+            edge_statistics[f"p{percentile}"] = float(
+                quantiles.loc[edge_id, percentile / 100])
+        performance_statistics[edges[edge_id]] = edge_statistics
+    return performance_statistics
+
+
+def _replayed_edges(alignment, new_nodes):
+    """
+    Resolves the moves of an alignment to edges of the bot model.
+    Moves on log are mapped to new nodes, one per activity, that are added to new_nodes.
+    The time between two consecutive events is attributed to the edge that leads to the second event,
+    also if moves on model were replayed between them.
+    :return: list of (edge, index of the event before the edge in the trace, index of the target event in the trace),
+        the source index is None before the first event and the target index is None for edges to moves on model
+    """
+    nodes = []
+    event_index = 0
+    previous_event = None
+    for model_move, log_move in alignment:
+        if model_move[1] == ">>":
+            if log_move[0] not in new_nodes:
+                new_nodes[log_move[0]] = str(
+                    uuid.uuid5(new_node_namespace, str(log_move[0])))
+            node_id = new_nodes[log_move[0]]
+        else:
+            node_id = model_move[1].split("_")[0]
+        if model_move[0] != ">>":
+            nodes.append((node_id, previous_event, event_index))
+            previous_event = event_index
+            event_index += 1
+        else:
+            nodes.append((node_id, previous_event, None))
+    return [((source, target), source_event, target_event)
+            for (source, _, _), (target, source_event, target_event) in itertools.pairwise(nodes)]
 
-            if (source_id, target_id) in performance_dfg and performance_dfg[(source_id, target_id)] != 0:
-                performance_dfg[(source_id, target_id)] = statistics.mean([
-                    performance_dfg[(source_id, target_id)], performance[(source_id, target_id)]]) if (source_id, target_id) in performance else performance_dfg[(source_id, target_id)]
-            else:
-                potential_start_activities.add(source_id)
-                potential_end_activities.add(target_id)
-                performance_dfg[(source_id, target_id)
-                                ] = performance[(source_id, target_id)] if (source_id, target_id) in performance else 0
 
-        for potential_start_activity in potential_start_activities:
-            # check if the potential start activity has no incoming edge
-            has_incoming_edge = False
-            for _, target in performance_dfg.keys():
-                if target == potential_start_activity:
-                    has_incoming_edge = True
-                    break
-            if not has_incoming_edge and potential_start_activity not in start_act:
-                start_act.add(potential_start_activity)
-        for potential_end_activity in potential_end_activities:
-            # check if the potential end activity has no outgoing edge
-            has_outgoing_edge = False
-            for source, _ in performance_dfg.keys():
-                if source == potential_end_activity:
-                    has_outgoing_edge = True
-                    break
-            if not has_outgoing_edge and potential_end_activity not in end_act:
-                end_act.add(potential_end_activity)
-    return performance_dfg
+def average_intent_confidence(botName, connection):
+    """
+    Get the confidence of the intents in the bot model.
+    Served from the incrementally maintained rollup, see utils.db.intent_confidence
+    :param botName: bot name
+    :param connection: database connection
+    :return: confidence of intents
+    """
+    return intent_confidence_rollup.average(botName, connection)
 
 
-def _average_performance_of_trace(log_trace, event_log, alignment):
+def case_durations(log, ids=None):
     """
-    gets the average performance of a trace in the event log. For each edge in the trace, we get the average duration
+    Get the throughput times of the bot model
+    :param log: event log
+    :param ids: ids of the cases whose traces are added (optional), defaults to all cases
+    :return: dict case id -> start time, end time, duration (seconds) and trace, ordered by start time
     """
-    cases = pm4py.filtering.filter_variants(event_log, [log_trace])
-    durations = dict()
-    for case in cases.groupby("case:concept:name"):
-        case = case[1]
-        for i in range(0, len(case) - 1):
-            edge = (case.iloc[i]["concept:name"],
-                    case.iloc[i + 1]["concept:name"])
-            corresponding_model_ids = tuple(map(lambda x: x.split(
-                "_")[0], (alignment[i][0][1], alignment[i+1][0][1])))
-            if corresponding_model_ids is None:
-                corresponding_model_ids = edge
-            if corresponding_model_ids in durations:
-                statistics.mean(
-                    [durations[corresponding_model_ids], (
-                        (case.iloc[i + 1]["time:timestamp"] - case.iloc[i]["time:timestamp"]).total_seconds())])
-            else:
-                durations[corresponding_model_ids] = (
-                    (case.iloc[i + 1]["time:timestamp"] - case.iloc[i]["time:timestamp"]).total_seconds())
-    return durations
+    summary = case_summary(log).sort_values('startTime', kind='stable')
+    traces = case_traces(log, summary.index if ids is None else set(ids))
+    stats = {}
+    for case_id, start, end, duration in zip(summary.index, summary['startTime'], summary['endTime'], summary['caseDuration']):
+        stats[case_id] = {'startTime': int(start), 'endTime': int(end), 'caseDuration': float(duration)}
+        if case_id in traces:
+            stats[case_id]['trace'] = traces[case_id]
+    return stats
+
+
+# columns that cases can be sorted by, see case_duration_page
+case_sort_columns = ['startTime', 'endTime', 'caseDuration', 'length']
 
 
-def _find_trace_in_log(log_moves, log):
+def case_duration_page(log, sort_by='startTime', ascending=True, limit=100, cursor=None):
     """
-    Find a trace in the event log
-    :param log_moves: moves of the trace
+    Get one page of the throughput times of the cases, sorted by a column and the case id.
+    Only the traces of the cases of the page are built.
     :param log: event log
-    :return: trace
+    :param sort_by: startTime, endTime, caseDuration or length (number of events)
+    :param ascending: sort direction
+    :param limit: maximum number of cases of the page
+    :param cursor: cursor returned with the previous page, None for the first page
+    :return: dict with the cases of the page, the cursor of the next page (None on the last page) and the total number of cases
     """
-    log = log.copy()
-    # iterate over cases
-    for case in log.groupby("case:concept:name"):
-        # check if the case contains the moves
-        if (set(log_moves).issubset(set(case[1]["concept:name"].values))):
-            return case[1]
-    return None
+    if sort_by not in case_sort_columns:
+        raise ValueError(f"sort must be one of {case_sort_columns}")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    summary = case_summary(log)
+    total = len(summary)
+    if cursor is not None:
+        value, case_id = decode_cursor(cursor)
+        column = summary[sort_by]
+        ids = summary.index.astype(str)
+        if ascending:
+            after = (column > value) | ((column == value) & (ids > case_id))
+        else:
+            after = (column < value) | ((column == value) & (ids < case_id))
+        summary = summary[after]
+    summary = summary.assign(caseId=summary.index.astype(str)).sort_values(
+        [sort_by, 'caseId'], ascending=ascending).head(limit)
+    traces = case_traces(log, summary.index)
+    cases = [{'caseId': case_id, 'startTime': int(start), 'endTime': int(end), 'caseDuration': float(duration),
+              'length': int(length), 'trace': traces.get(index, [])}
+             for index, case_id, start, end, duration, length in zip(summary.index, summary['caseId'], summary['startTime'],
+                                                                     summary['endTime'], summary['caseDuration'], summary['length'])]
+    next_cursor = None
+    if len(summary) == limit and len(summary) > 0:
+        last = summary.iloc[-1]
+        next_cursor = encode_cursor(last[sort_by], last['caseId'])
+    return {'cases': cases, 'nextCursor': next_cursor, 'total': total}
+
+
+def case_summary(log):
+    """
+    Get the first and last timestamp (seconds since epoch), the duration (seconds) and the number of events of each case.
+    The events do not have to be sorted by time.
+    :param log: event log
+    :return: dataframe indexed by case id
+    """
+    summary = log.groupby('case:concept:name', observed=True, sort=False)[
+        'time:timestamp'].agg(['min', 'max', 'size'])
+    return pd.DataFrame({
+        'startTime': summary['min'].astype('int64') // 10 ** 9,
+        'endTime': summary['max'].astype('int64') // 10 ** 9,
+        'caseDuration': (summary['max'] - summary['min']).dt.total_seconds(),
+        'length': summary['size'],
+    }, index=summary.index)
 
 
-def _closest_aligned_trace(alignment, ):
+def case_traces(log, ids):
     """
-    Find the closest aligned trace in the event log
-    :param alignment: alignment
+    Get the activities of the cases with the given ids
     :param log: event log
-    :return: trace
+    :param ids: case ids
+    :return: dict case id -> list of activities ordered by time
     """
-    log = log.copy()
-    log_moves = tuple(move[0] for move in alignment if move[0] != ">>")
-    filtered_log = pm4py.filtering.filter_variants(log, [log_moves])
+    events = log[log['case:concept:name'].isin(ids)].sort_values('time:timestamp', kind='stable')
+    return events.groupby('case:concept:name', observed=True, sort=False)['concept:name'].agg(list).to_dict()
 
 
-def average_intent_confidence(botName, connection):
+def encode_cursor(value, case_id):
     """
-    Get the confidence of the intents in the bot model
-    :param botName: bot name
-    :param connection: database connection
-    :return: confidence of intents
+    Encodes the position after a case as opaque pagination cursor
     """
-    statement = "SELECT json_extract(REMARKS, '$.intent.intentKeyword') AS intentKeyword, AVG(json_extract(REMARKS, '$.intent.confidence')) AS averageConfidence FROM MESSAGE WHERE json_extract(REMARKS, '$.botName') = %s  GROUP BY intentKeyword;"
-    df = pd.read_sql(statement, con=connection, params=(botName,))
-    return df
+    value = value.item() if hasattr(value, 'item') else value
+    return base64.urlsafe_b64encode(json.dumps([value, case_id]).encode('utf-8')).decode('utf-8')
 
 
-def case_durations(log, ids=None):
+def decode_cursor(cursor):
     """
-    Get the throughput times of the bot model
-    :param botName: bot name
-    :param log: event log
-    :return: throughput times
+    Decodes a pagination cursor
+    :return: (value of the sort column, case id)
+    :raises ValueError: if the cursor was not created by encode_cursor
     """
-    stats = case_statistics.get_cases_description(log)
-    if ids is None:
-        ids = log["case:concept:name"].unique()
-
-    traces = log.groupby("case:concept:name").agg(
-        {'concept:name': lambda x: list(x), 'case:concept:name': 'first'})
-    # add the traces to the case stats
-    for case_id, trace in traces.iterrows():
-        if case_id in ids:
-            stats[case_id]['trace'] = trace['concept:name']
-    return stats
+    try:
+        value, case_id = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    except Exception:
+        raise ValueError("invalid cursor")
+    # all sort columns are numeric
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not isinstance(case_id, str):
+        raise ValueError("invalid cursor")
+    return value, case_id
 
 
 def __replace_nan_with_null(obj):
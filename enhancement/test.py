@@ -2,12 +2,13 @@ import unittest
 import json
 import os
 import pm4py
+import pandas as pd
 import os
 import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from enhancement.main import add_edge_frequency,add_edge_performance
+from enhancement.main import replay_alignments,case_durations,case_duration_page,encode_cursor
 from utils.bot.parse_lib import get_parser, BotParser
 
 
@@ -34,7 +35,7 @@ class TestBotParser(unittest.TestCase):
         self.instance = get_parser(self.bot_model)
         self.assertIsInstance(self.instance, BotParser)
         dfg, start,end = self.instance.get_dfg()
-        result_dfg = add_edge_frequency(event_log=event_log, dfg=dfg,start_act=start,end_act=end,bot_parser=self.instance)
+        result_dfg = replay_alignments(event_log, dfg, start, end, self.instance).frequency_dfg
         self.assertEqual(len(result_dfg.keys()), 2)
         self.assertEqual(result_dfg[('a', 'a2')], 1)
         self.assertEqual(result_dfg[('a2', 'e')], 1)
@@ -45,11 +46,102 @@ class TestBotParser(unittest.TestCase):
         self.instance = get_parser(self.bot_model)
         self.assertIsInstance(self.instance, BotParser)
         dfg, start,end = self.instance.get_dfg()
-        result_dfg = add_edge_performance(event_log=event_log, dfg=dfg,start_act=start,end_act=end,bot_parser=self.instance)
+        result_dfg = replay_alignments(event_log, dfg, start, end, self.instance).performance_dfg
         self.assertEqual(len(result_dfg.keys()), 2)
         self.assertEqual(result_dfg[('a', 'a2')], 65)
         self.assertEqual(result_dfg[('a2', 'e')], 30)
 
+    def test_performance_statistics(self):
+        self.bot_model = get_bot_model_json('assets/alignment-test.json')
+        event_log = get_event_log('assets/test.xes')
+        self.instance = get_parser(self.bot_model)
+        dfg, start,end = self.instance.get_dfg()
+        result = replay_alignments(event_log, dfg, start, end, self.instance)
+        self.assertEqual(result.frequency_dfg[('a', 'a2')], 1)
+        self.assertEqual(result.performance_dfg[('a', 'a2')], 65)
+        self.assertEqual(result.performance_statistics[('a', 'a2')], {'mean': 65, 'median': 65, 'p25': 65, 'p75': 65, 'p90': 65})
+
+    def test_model_move_inside_trace(self):
+        self.bot_model = get_bot_model_json('assets/alignment-test.json')
+        event_log = get_event_log('assets/test.xes')
+        # the second case skips longPath, its cases are listed before the first case
+        skipped = event_log[event_log['concept:name'] != 'longPath'].copy()
+        skipped['case:concept:name'] = 'case0'
+        skipped['time:timestamp'] = skipped['time:timestamp'].iloc[0] + pd.to_timedelta([0, 100], unit='s')
+        event_log = pd.concat([event_log, skipped], ignore_index=True).iloc[[3, 0, 4, 1, 2]]
+        self.instance = get_parser(self.bot_model)
+        dfg, start,end = self.instance.get_dfg()
+        result = replay_alignments(event_log, dfg, start, end, self.instance)
+        self.assertEqual(result.frequency_dfg[('a', 'a2')], 2)
+        self.assertEqual(result.frequency_dfg[('a2', 'e')], 2)
+        # the time between start and endConvo is attributed to the edge that leads to endConvo
+        self.assertEqual(result.performance_statistics[('a', 'a2')]['mean'], 65)
+        self.assertEqual(result.performance_statistics[('a2', 'e')]['mean'], 65)
+        self.assertEqual(result.performance_statistics[('a2', 'e')]['p90'], 93)
+
+    def test_parser_is_not_modified(self):
+        self.bot_model = get_bot_model_json('assets/alignment-test.json')
+        event_log = get_event_log('assets/test.xes')
+        event_log['concept:name'] = event_log['concept:name'].replace('longPath', 'detour')
+        self.instance = get_parser(self.bot_model)
+        names = dict(self.instance.id_name_map)
+        dfg, start,end = self.instance.get_dfg()
+        result = replay_alignments(event_log, dfg, start, end, self.instance)
+        self.assertEqual(self.instance.id_name_map, names)
+        self.assertEqual(list(result.new_nodes.values()), ['detour'])
+        again = replay_alignments(event_log, dfg, start, end, self.instance)
+        self.assertEqual(again.new_nodes, result.new_nodes)
+        self.assertEqual(again.frequency_dfg, result.frequency_dfg)
+
+
+class TestCaseDurations(unittest.TestCase):
+    def setUp(self):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        self.event_log = get_event_log(os.path.join(current_dir, '..', 'assets', 'event_logs', 'demo.xes'))
+
+    def test_case_durations(self):
+        stats = case_durations(self.event_log)
+        self.assertEqual(len(stats), self.event_log['case:concept:name'].nunique())
+        for case_id, case in stats.items():
+            events = self.event_log[self.event_log['case:concept:name'] == case_id]
+            self.assertEqual(case['trace'], list(events['concept:name']))
+            self.assertEqual(case['caseDuration'], (events['time:timestamp'].iloc[-1] - events['time:timestamp'].iloc[0]).total_seconds())
+
+    def test_pages_cover_all_cases_in_order(self):
+        cases = []
+        cursor = None
+        while True:
+            page = case_duration_page(self.event_log, sort_by='caseDuration', ascending=False, limit=5, cursor=cursor)
+            self.assertLessEqual(len(page['cases']), 5)
+            cases += page['cases']
+            cursor = page['nextCursor']
+            if cursor is None:
+                break
+        self.assertEqual(len(cases), page['total'])
+        self.assertEqual(len({case['caseId'] for case in cases}), page['total'])
+        keys = [(case['caseDuration'], case['caseId']) for case in cases]
+        self.assertEqual(keys, sorted(keys, reverse=True))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            case_duration_page(self.event_log, cursor='invalid')
+        for value, case_id in [('1', '1'), (None, '1'), (1, 1), (True, '1'), ([1], '1')]:
+            with self.assertRaises(ValueError):
+                case_duration_page(self.event_log, cursor=encode_cursor(value, case_id))
+
+    def test_unsorted_events(self):
+        # events with the same timestamp keep the order of the log, so the timestamps are made distinct before shuffling
+        event_log = self.event_log.sort_values('time:timestamp', kind='stable')
+        event_log['time:timestamp'] += pd.to_timedelta(range(len(event_log)), unit='ms')
+        expected = case_durations(event_log)
+        stats = case_durations(event_log.sample(frac=1, random_state=0))
+        self.assertEqual(stats.keys(), expected.keys())
+        for case_id, case in stats.items():
+            for key in ['startTime', 'endTime', 'caseDuration']:
+                self.assertEqual(case[key], expected[case_id][key])
+            events = event_log[event_log['case:concept:name'] == case_id]
+            self.assertEqual(case['trace'], list(events['concept:name']))
+
 
 
 
@@ -0,0 +1,100 @@
+from flask import Blueprint, current_app, request, make_response, url_for
+from utils.jobs import job_manager, JobQueueFull
+
+jobs_resource = Blueprint('jobs_resource', __name__)
+
+# endpoints of the bot blueprint that can run as background jobs
+job_endpoints = ['enhanced-model', 'petri-net', 'bpmn', 'statistics']
+
+
+@jobs_resource.route('/bot/<botName>/<endpoint>', methods=['POST'])
+def submit_job(botName, endpoint):
+    """
+    Runs a bot endpoint in the background, e.g. POST /jobs/bot/<botName>/petri-net?enhance=true&...
+    The query parameters are passed to the endpoint. If a json body is sent, the endpoint is called with POST and the body
+    (e.g. {"bot-model": ...}), otherwise with GET.
+    Returns the id of the job, the result can be fetched from /jobs/<id>/result when the job is finished.
+    """
+    if endpoint not in job_endpoints:
+        return {
+            "error": f"{endpoint} can not run as a job, use one of {', '.join(job_endpoints)}"
+        }, 400
+    body = request.get_json(silent=True)
+    method = 'POST' if body is not None else 'GET'
+    path = f"/bot/{botName}/{endpoint}"
+    query_string = request.query_string.decode("utf-8")
+    app = current_app._get_current_object()
+
+    def run():
+        with app.test_request_context(path, method=method, query_string=query_string, json=body):
+            response = app.full_dispatch_request()
+            return response.get_data(), response.status_code, response.mimetype
+
+    try:
+        job = job_manager.submit(f"{method} {path}", run)
+    except JobQueueFull as e:
+        return {
+            "error": str(e)
+        }, 503
+    return job_status(job), 202
+
+
+@jobs_resource.route('/<jobId>', methods=['GET'])
+def get_job(jobId):
+    """
+    Returns the status of a job: queued, running, finished, failed or cancelled
+    """
+    job = job_manager.get(jobId)
+    if job is None:
+        return {
+            "error": f"Job {jobId} does not exist or expired"
+        }, 404
+    return job_status(job)
+
+
+@jobs_resource.route('/<jobId>/result', methods=['GET'])
+def get_job_result(jobId):
+    """
+    Returns the response of the endpoint that the job ran
+    """
+    job = job_manager.get(jobId)
+    if job is None:
+        return {
+            "error": f"Job {jobId} does not exist or expired"
+        }, 404
+    if job.status in ('queued', 'running'):
+        return job_status(job), 202
+    if job.status != 'finished':
+        return job_status(job), 409
+    data, status_code, mimetype = job.result
+    response = make_response(data, status_code)
+    response.mimetype = mimetype
+    return response
+
+
+@jobs_resource.route('/<jobId>', methods=['DELETE'])
+def cancel_job(jobId):
+    """
+    Cancels a job. A job that is already running finishes in the background, but its result is discarded
+    """
+    job = job_manager.cancel(jobId)
+    if job is None:
+        return {
+            "error": f"Job {jobId} does not exist or expired"
+        }, 404
+    return job_status(job)
+
+
+@jobs_resource.route('/stats', methods=['GET'])
+def get_job_stats():
+    """
+    Returns the number of jobs by status
+    """
+    return job_manager.stats()
+
+
+def job_status(job):
+    status = job.to_dict()
+    status['statusUrl'] = url_for('jobs_resource.get_job', jobId=job.id)
+    status['resultUrl'] = url_for('jobs_resource.get_job_result', jobId=job.id)
+    return status
@@ -1,66 +1,216 @@
-import requests as r
 import pm4py
 import pandas as pd
 import json
-from pm4py.objects.log.importer.xes import variants as xes_importer
 import base64
+import os
+import time
+from utils import http_client
+from utils.cache import LRUCache
+from utils.db.connection import read_event_log
+from utils.xes_stream import read_xes_stream
 
 
 bot_model_file_path = "./assets/models/test_bot_model.json"
 event_log_file_path = "assets/event_logs/demo.xes"
 
+# parsed event logs shared by all requests of this process, keyed by (bot name, resource ids, event log url)
+event_log_cache = LRUCache(max_size=16, ttl=300)
+# last full event log and its newest timestamp per cache key, used for incremental refreshes
+event_log_snapshots = LRUCache(max_size=16)
+# on-disk snapshots of parsed event logs shared by all worker processes (utils.event_log_store.EventLogStore), None disables them
+event_log_store = None
+event_log_backends = ["generator", "database"]
+# attributes of the events that are used by the service, other attributes are dropped while parsing
+event_log_columns = ['case:concept:name', 'concept:name', 'time:timestamp', 'lifecycle:transition', 'EVENT_TYPE',
+                     'RESOURCE', 'RESOURCE_TYPE', 'REMARKS', 'user', 'in-service-context', 'serviceEndpoint']
+# only completed user messages and service requests are part of the event log, bot messages are dropped
+event_log_filter = {'EVENT_TYPE': {'SERVICE_REQUEST', 'USER_MESSAGE'},
+                    'lifecycle:transition': {'complete'}}
+# columns that are used to recognize events which were fetched twice
+event_identity_columns = ['case:concept:name', 'concept:name',
+                          'time:timestamp', 'lifecycle:transition', 'EVENT_TYPE']
+# resource ids of the bots per bot manager url, see get_resource_ids_from_bot_manager
+bot_index_cache = LRUCache(max_size=16, ttl=300)
+# unknown bots trigger a new download of the listing, but not more often than every few seconds
+bot_index_min_refresh = 5
+# seconds to wait for the event log generator, which only starts to respond after it has queried all events
+event_log_read_timeout = 300
+
 
 def fetch_bot_model(name, endpoint="https://mobsos.tech4comp.dbis.rwth-aachen.de/SBFManager"):
     # fetches a bot model from the social bot manager. available at <base_url>/models/{name}
-    request = r.get(f"{endpoint}/models/{name}")
+    request = http_client.get(f"{endpoint}/models/{name}")
     if request.status_code == 200:
         return request.json()
     else:
         return None
 
 
-def fetch_event_log(bot_name, url=None, botManagerUrl=None):
-    if url is None:
+def fetch_event_log(bot_name, url=None, botManagerUrl=None, use_cache=True, incremental=False, db_connection=None, backend="generator"):
+    """
+    Fetches the event log of a bot from the event log generator or directly from the events database.
+    Parsed logs are cached per process, concurrent requests for the same log share one download.
+    In incremental mode, an expired log of the database backend is refreshed by reading only the events that are newer
+    than the newest event of the last fetch and appending them to the log. Logs of the event log generator have a
+    different format than the rows of the MESSAGE table, they are always loaded completely.
+    :param bot_name: name of the bot
+    :param url: url of the event log generator, required for the generator backend
+    :param botManagerUrl: url of the social bot manager, used to get the resource ids of the bot
+    :param use_cache: whether the event log cache should be used
+    :param incremental: whether expired logs of the database backend should be refreshed incrementally
+    :param db_connection: connection to the events database, required for the database backend
+    :param backend: "generator" to fetch the log from the event log generator, "database" to read it from the MESSAGE table
+    :return: the event log as a dataframe or None if it could not be fetched
+    """
+    if backend not in event_log_backends:
+        raise ValueError(
+            f"event log backend must be one of {event_log_backends}")
+    if url is None and backend == "generator":
         raise ValueError("event log url must be set")
     if botManagerUrl is None:
         raise ValueError("botManagerUrl must be set")
+    if backend == "database" and db_connection is None:
+        raise ValueError(
+            "db_connection must be set for the database backend")
     resource_ids = get_resource_ids_from_bot_manager(botManagerUrl, bot_name)
-    response = r.post(f"{url}/resources", json={"resource_ids": resource_ids})
-    # response is xml, use pm4py to parse it
-    if response.status_code == 200:
-        xml = response.content
+    if not use_cache:
+        return _load_event_log(backend, url, resource_ids, db_connection)
+    key = (bot_name, tuple(sorted(resource_ids)), url, backend)
+    if incremental and backend == "database":
+        log = event_log_cache.get_or_load(
+            key, lambda: _versioned(key, _refresh_event_log(key, backend, url, resource_ids, db_connection)))
+    else:
+        log = event_log_cache.get_or_load(
+            key, lambda: _versioned(key, _restore_or_load_event_log(key, backend, url, resource_ids, db_connection)))
+    if log is None:
+        return None
+    # the cached dataframe is shared, callers get their own frame so that added columns do not leak into the cache
+    return log.copy(deep=False)
+
+
+def _versioned(key, log):
+    """
+    Stores the cache key and the version (number of events and newest timestamp) of a loaded log in its attrs,
+    so that results derived from the log can be keyed without hashing it, see utils.render_cache.log_fingerprint
+    """
+    if log is not None:
+        log.attrs['version'] = (key, len(log), str(log['time:timestamp'].max()) if len(log) > 0 else None)
+    return log
+
+
+def _load_event_log(backend, url, resource_ids, db_connection):
+    if backend == "database":
+        if len(resource_ids) == 0:
+            print("No resource ids found for bot")
+            return None
+        return read_event_log(db_connection, resource_ids)
+    return _download_event_log(url, resource_ids)
+
+
+def _restore_or_load_event_log(key, backend, url, resource_ids, db_connection):
+    """
+    Restores the event log from the on-disk store if another worker has loaded it recently, loads it otherwise
+    """
+    if event_log_store is not None:
+        log = event_log_store.load(key, max_age=event_log_cache.ttl)
+        if log is not None:
+            return log
+    log = _load_event_log(backend, url, resource_ids, db_connection)
+    if log is not None and event_log_store is not None:
+        event_log_store.save(key, log)
+    return log
+
+
+def _refresh_event_log(key, backend, url, resource_ids, db_connection):
+    """
+    Appends the events that happened since the last fetch to the last fetched log.
+    Falls back to the on-disk snapshot or to loading the full log if there is no previous log in memory.
+    """
+    snapshot = event_log_snapshots.get(key)
+    if snapshot is None:
+        log = event_log_store.load(
+            key) if event_log_store is not None else None
+        if log is None:
+            log = _load_event_log(backend, url, resource_ids, db_connection)
+            if log is None:
+                return None
+            if event_log_store is not None:
+                event_log_store.save(key, log)
+            event_log_snapshots.set(key, (log, log['time:timestamp'].max()))
+            return log
+        # the snapshot on disk may be old, catch up with the events since then
+        snapshot = (log, log['time:timestamp'].max())
+
+    log, high_water_mark = snapshot
+    if high_water_mark.tzinfo is not None:
+        start_date = high_water_mark.tz_convert(None).to_pydatetime()
+    else:
+        start_date = high_water_mark.to_pydatetime()
+    # the high water mark is a TIME_OF_EVENT, so the new events are filtered on the same column.
+    # The lower bound is inclusive, events at the high water mark are read again and dropped below
+    new_events = read_event_log(
+        db_connection, resource_ids, since=start_date)
+    if new_events is None:
+        event_log_snapshots.set(key, (log, high_water_mark))
+        return log
+    new_events = new_events[[
+        column for column in log.columns if column in new_events.columns]]
+    if high_water_mark.tzinfo is None:
+        new_events = new_events.assign(
+            **{'time:timestamp': new_events['time:timestamp'].dt.tz_convert(None)})
+    boundary = log[log['time:timestamp'] == high_water_mark]
+    known = pd.MultiIndex.from_frame(
+        boundary[event_identity_columns].astype(str))
+    is_known = pd.MultiIndex.from_frame(
+        new_events[event_identity_columns].astype(str)).isin(known)
+    new_events = new_events[~is_known]
+    if len(new_events) > 0:
+        log = pd.concat([log, new_events], ignore_index=True)
+        high_water_mark = max(
+            high_water_mark, new_events['time:timestamp'].max())
+        if event_log_store is not None:
+            event_log_store.save(key, log)
+    event_log_snapshots.set(key, (log, high_water_mark))
+    return log
+
+
+def _download_event_log(url, resource_ids):
+    response = http_client.post(f"{url}/resources", json={"resource_ids": resource_ids}, stream=True,
+                                timeout=(http_client.connect_timeout, event_log_read_timeout))
+    try:
+        if response.status_code != 200:
+            print("Could not fetch event log, status code: ",
+                  response.status_code, response.content)
+            return None
+        # response is xml, parse it while it is downloaded
+        response.raw.decode_content = True
         try:
-            log = pm4py.convert_to_dataframe(
-                xes_importer.iterparse.import_from_string(xml))
+            log = read_xes_stream(
+                response.raw, event_filter=event_log_filter, attributes=event_log_columns)
         except Exception as e:
             print("Could not parse event log")
             print(e)
             return None
-        if not "head" in dir(log):
+        if log is None:
             print("log is empty")
             return None
-        log['time:timestamp'] = pd.to_datetime(
-            log['time:timestamp'])  # convert timestamp to datetime
-        log = log[(log['EVENT_TYPE'] == 'SERVICE_REQUEST') | (
-            log['EVENT_TYPE'] == 'USER_MESSAGE')]  # drop bot messages
-        # only complete events
-        log = log[(log['lifecycle:transition'] == 'complete')]
         return log
-
-    else:
-        print("Could not fetch event log, status code: ",
-              response.status_code, response.content)
-        return None
+    finally:
+        response.close()
 
 
 def get_resource_ids_from_bot_manager(bot_manager_url, botName):
     """
-    This function returns the resource ids of the bot
+    This function returns the resource ids of the bot.
+    The bots of a bot manager are downloaded once and indexed by name, the index is refreshed when it expires
+    or when a bot is not found in it.
 
     Parameters
     ----------
     bot_manager_url : string
         URL of the bot manager
+    botName : string
+        name of the bot
 
     Returns
     -------
@@ -70,22 +220,42 @@ def get_resource_ids_from_bot_manager(bot_manager_url, botName):
     if bot_manager_url is None:
         raise ValueError('bot_manager_url must be set')
 
-    response = r.get(bot_manager_url + '/bots')
-    try:
-        data = response.json()
-        keys = []
+    index, loaded_at = bot_index_cache.get_or_load(
+        bot_manager_url, lambda: _load_bot_index(bot_manager_url)) or ({}, None)
+    if botName not in index and loaded_at is not None and time.time() - loaded_at > bot_index_min_refresh:
+        # the bot may have been created since the listing was downloaded
+        bot_index_cache.invalidate(bot_manager_url)
+        index, _ = bot_index_cache.get_or_load(
+            bot_manager_url, lambda: _load_bot_index(bot_manager_url)) or ({}, None)
+    return list(index.get(botName, []))
 
-        for key, value in data.items():
-            if isinstance(value, dict) and "name" in value and value["name"] == botName:
-                keys.append(key)
-        return keys
 
+def _load_bot_index(bot_manager_url):
+    """
+    Downloads the bots of the bot manager and indexes their resource ids by bot name
+    :return: (dict bot name -> list of resource ids, time of the download), None if the listing could not be read
+    """
+    response = http_client.get(bot_manager_url + '/bots')
+    try:
+        data = response.json()
     except json.JSONDecodeError as e:
         print("Invalid JSON format:", e)
-        return []
+        return None
+    index = {}
+    for key, value in data.items():
+        if isinstance(value, dict) and "name" in value:
+            index.setdefault(value["name"], []).append(key)
+    return index, time.time()
 
 
 def get_default_event_log():
+    # served from the on-disk store as long as the xes file has not changed
+    key = ('default', os.path.abspath(event_log_file_path))
+    if event_log_store is not None:
+        log = event_log_store.load(
+            key, newer_than=os.path.getmtime(event_log_file_path))
+        if log is not None:
+            return log
     log = pm4py.read_xes(event_log_file_path)
     # remove events lifecycle:transition=start
     log = log[(log['lifecycle:transition'] == 'complete')]
@@ -94,6 +264,8 @@ def get_default_event_log():
               | (log['EVENT_TYPE'] == 'USER_MESSAGE')]
     # convert timestamp to datetime
     log['time:timestamp'] = pd.to_datetime(log['time:timestamp'])
+    if event_log_store is not None:
+        event_log_store.save(key, log)
     return log
 
 
@@ -123,7 +295,8 @@ def fetch_success_model(endpoint, botName, bot_pw, group_id=None, service_id=Non
     headers = {'authorization': __getAuthorizationHeader(botName, bot_pw)}
     print(f"Fetching success model from {endpoint}")
     try:
-        success_model_response = r.get(f"{endpoint}", headers=headers)
+        success_model_response = http_client.get(
+            f"{endpoint}", headers=headers)
         return success_model_response.json()["xml"] if success_model_response.status_code == 200 else None
     except Exception as e:
         print("Could not fetch success model")
@@ -147,7 +320,7 @@ def fetchL2PGroups(success_modeling_service_endpoint, user_name, pw):
     """
     success_modeling_service_endpoint += "/groups"
     print(f"Fetching groups from {success_modeling_service_endpoint}")
-    response = r.get(success_modeling_service_endpoint, headers={'authorization': __getAuthorizationHeader(user_name, pw),
+    response = http_client.get(success_modeling_service_endpoint, headers={'authorization': __getAuthorizationHeader(user_name, pw),
                                                                  'Content-Type': 'application/json'})
     return response.json() if response.status_code == 200 else None
 
@@ -157,7 +330,7 @@ def fetchL2PServices(endpoint="https://mobsos.tech4comp.dbis.rwth-aachen.de/mobs
     Fetches all Las2peer services available at the given endpoint
     """
     print(f"Fetching services from {endpoint}")
-    response = r.get(endpoint)
+    response = http_client.get(endpoint)
     return response.json() if response.status_code == 200 else None
 
 
@@ -173,7 +346,7 @@ def fetchVisualization(endpoint, username, password, SQLQuery, vizFormat="CSV"):
         'dbkey': 'las2peermon',
         'query': SQLQuery,
     }
-    response = r.post(endpoint, data=json.dumps(body), headers={'authorization': __getAuthorizationHeader(
+    response = http_client.post(endpoint, data=json.dumps(body), headers={'authorization': __getAuthorizationHeader(
         username, password), 'Content-Type': 'application/json'})
     return response.content if response.status_code < 300 else None
 
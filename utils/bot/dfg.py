@@ -0,0 +1,122 @@
+class DFG(dict):
+    """
+    Directly follows graph that maps (source, target) edges to values, like the dfgs of pm4py.
+    The incoming and outgoing edges of each node are indexed while edges are added and removed,
+    so that questions like "does the node have an incoming edge" do not scan all edges.
+
+    :example:
+    >>> dfg = DFG({("a", "b"): 0})
+    >>> dfg.has_incoming("b")
+    True
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._outgoing = {}  # node -> set of targets
+        self._incoming = {}  # node -> set of sources
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, edge, value):
+        if edge not in self:
+            source, target = edge
+            self._outgoing.setdefault(source, set()).add(target)
+            self._incoming.setdefault(target, set()).add(source)
+        super().__setitem__(edge, value)
+
+    def __delitem__(self, edge):
+        super().__delitem__(edge)
+        source, target = edge
+        self._remove_neighbour(self._outgoing, source, target)
+        self._remove_neighbour(self._incoming, target, source)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def pop(self, edge, *default):
+        if edge not in self:
+            return super().pop(edge, *default)
+        value = self[edge]
+        del self[edge]
+        return value
+
+    def popitem(self):
+        edge, value = super().popitem()
+        super().__setitem__(edge, value)
+        del self[edge]
+        return edge, value
+
+    def setdefault(self, edge, default=None):
+        if edge not in self:
+            self[edge] = default
+        return self[edge]
+
+    def update(self, *args, **kwargs):
+        for edge, value in dict(*args, **kwargs).items():
+            self[edge] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        super().clear()
+        self._outgoing.clear()
+        self._incoming.clear()
+
+    def copy(self):
+        return self.__class__(self)
+
+    def has_incoming(self, node):
+        """
+        Checks whether a node is the target of an edge
+        """
+        return node in self._incoming
+
+    def has_outgoing(self, node):
+        """
+        Checks whether a node is the source of an edge
+        """
+        return node in self._outgoing
+
+    def contains_node(self, node):
+        """
+        Checks whether a node is the source or the target of an edge
+        """
+        return node in self._outgoing or node in self._incoming
+
+    def in_degree(self, node):
+        """
+        Gets the number of edges that end in a node
+        """
+        return len(self._incoming.get(node, ()))
+
+    def out_degree(self, node):
+        """
+        Gets the number of edges that start in a node
+        """
+        return len(self._outgoing.get(node, ()))
+
+    def predecessors(self, node):
+        """
+        Gets the sources of the edges that end in a node
+        """
+        return set(self._incoming.get(node, ()))
+
+    def successors(self, node):
+        """
+        Gets the targets of the edges that start in a node
+        """
+        return set(self._outgoing.get(node, ()))
+
+    def nodes(self):
+        """
+        Gets all nodes that are connected by an edge
+        """
+        return set(self._outgoing) | set(self._incoming)
+
+    @staticmethod
+    def _remove_neighbour(index, node, neighbour):
+        neighbours = index[node]
+        neighbours.discard(neighbour)
+        if len(neighbours) == 0:
+            del index[node]
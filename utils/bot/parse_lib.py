@@ -1,6 +1,13 @@
+import hashlib
+import json
+from copy import deepcopy
 from pm4py.convert import convert_to_petri_net
 from pm4py import reduce_petri_net_invisibles
-bot_parsers = {}  # map of botParser instances for each bot
+from utils.bot.dfg import DFG
+from utils.cache import LRUCache
+# parsed bot models keyed by the hash of their content, an edited model is parsed again
+bot_parsers = LRUCache(max_size=32)
+
 
 def get_parser(bot_model):
     """
@@ -19,9 +26,16 @@ def get_parser(bot_model):
     if bot_id is None:
         raise Exception("No bot node found in bot model")
 
-    if bot_id not in bot_parsers:
-        bot_parsers[bot_id] = BotParser(bot_model)
-    return bot_parsers[bot_id]
+    return bot_parsers.get_or_load(model_hash(bot_model), lambda: BotParser(bot_model))
+
+
+def model_hash(bot_model):
+    """
+    Computes a hash of the content of a bot model that does not depend on the order of the keys
+    :param bot_model: the bot model
+    :return: hex digest
+    """
+    return hashlib.sha256(json.dumps(bot_model, sort_keys=True).encode('utf-8')).hexdigest()
 
 
 class BotParser:
@@ -36,6 +50,9 @@ class BotParser:
         self.id_name_map = {}
         # for each node id of interest, store a state representative of the node
         self.id_state_map = {}
+        # compiled artifacts of the bot model, see get_dfg and to_petri_net
+        self._dfg = None
+        self._petri_nets = LRUCache(max_size=8)  # labeled petri nets keyed by the dfg they are built from
         self.node_types_of_interest = [
             'Incoming Message', 'Bot Action']
         self.edge_types_of_interest = ['leadsTo', 'uses', 'generates']
@@ -44,6 +61,14 @@ class BotParser:
 
         self.nodes = bot_model['nodes']
         self.edges = bot_model['edges']
+        # indexes of the edges by source, target and type, each index keeps the order of the edges in the bot model
+        self.outgoing_edges = {}
+        self.incoming_edges = {}
+        self.edges_by_type = {}
+        for edge_id, edge in self.edges.items():
+            self.outgoing_edges.setdefault(edge['source'], {})[edge_id] = edge
+            self.incoming_edges.setdefault(edge['target'], {})[edge_id] = edge
+            self.edges_by_type.setdefault(edge['type'], {})[edge_id] = edge
         
         for node_id, node in bot_model['nodes'].items():
             if node['type'] == 'Bot':
@@ -55,7 +80,7 @@ class BotParser:
             if node['type'] not in self.node_types_of_interest:
                 continue
             name = extract_activity_name(
-                node_id, node, bot_model['edges'])
+                node_id, node, self.incoming_edges.get(node_id, {}))
             self.id_name_map[node_id] = name
             state_label = extract_state_label_new(node)
             if state_label is not None:
@@ -78,6 +103,13 @@ class BotParser:
         if(dfg is None):
             dfg, start_activities, end_activities = self.get_dfg()
 
+        key = (tuple(dfg.keys()), _frozen(start_activities), _frozen(end_activities))
+        petri_net = self._petri_nets.get_or_load(
+            key, lambda: self._build_petri_net(dfg, start_activities, end_activities))
+        # callers may modify the net, e.g. when it is repaired
+        return deepcopy(petri_net)
+
+    def _build_petri_net(self, dfg, start_activities, end_activities):
         net, im, fm = convert_to_petri_net(
             dfg, start_activities, end_activities)
         net, im , fm = self.rename_labels(net, im, fm)
@@ -90,19 +122,25 @@ class BotParser:
         :param json: the bot model
         :return: the dfg, the start activities and the end activities
         """
+        if self._dfg is None:
+            self._dfg = self._build_dfg()
+        dfg, start_activities, end_activities = self._dfg
+        # copies, since callers add the edges and activities that they discover
+        return dfg.copy(), set(start_activities), set(end_activities)
 
+    def _build_dfg(self):
         edges = self.edges.copy() # copy the edges since we need to remove some of them 
         
         start_activities = set()
         end_activities = set()
-        dfg = {}
+        dfg = DFG()
 
         edges_to_remove = set()
         # find patterns of the form A -> Bot Action and A -> Incoming Message and replace them with A -> Bot Action -> Incoming Message
         # The reason for doing this is the pattern A -> Bot Action -> Incoming Message is semantically more meaningful because it shows that
         # the Bot Action is triggered by the Incoming Message and the next Incoming Message is only handled after the Bot Action is finished.
-        for edge_id, edge in self.edges.items():
-            if edge['type'] == 'uses' and self.nodes[edge['target']]['type'] == 'Bot Action':  # A -> Bot Action
+        for edge_id, edge in self.edges_by_type.get('uses', {}).items():
+            if self.nodes[edge['target']]['type'] == 'Bot Action':  # A -> Bot Action
                 source_id = edge['source']
                 target_id = edge['target']
                 if (source_id, target_id) not in dfg:
@@ -111,9 +149,9 @@ class BotParser:
                 # remove the uses edge since we have already handled it
                 edges_to_remove.add(edge_id)
 
-                for edge2_id, edge2 in self.edges.items():
+                for edge2_id, edge2 in self.outgoing_edges.get(edge['source'], {}).items():
                     # A -> Incoming Message
-                    if edge2['type'] == 'leadsTo' and edge2['source'] == edge['source']:
+                    if edge2['type'] == 'leadsTo':
 
                         # create Bot Action -> Incoming Message
                         source_id = edge['target']  # Bot Action
@@ -152,12 +190,7 @@ class BotParser:
         for node_id, node in self.nodes.items():
             if node['type'] not in self.node_types_of_interest:
                 continue
-            has_outgoing_edge = False
-            for source, _ in dfg.keys():
-                if source == node_id :
-                    has_outgoing_edge = True
-                    break
-            if not has_outgoing_edge:
+            if not dfg.has_outgoing(node_id):
                 # also check whether the ode is in the dfg, if not it is a start activity and an end activity
                 if node_id in start_activities and not self.dfg_contains_node(dfg,node_id):
                     dfg[(node_id, 'empty_intent')] = 0
@@ -190,8 +223,8 @@ class BotParser:
         >>> edges = get_outgoing_edges("n1")
         """
         outgoing_edges = []
-        for edge in self.edges.values():
-            if edge['source'] == node_id and edge['type'] in self.edge_types_of_interest:
+        for edge in self.outgoing_edges.get(node_id, {}).values():
+            if edge['type'] in self.edge_types_of_interest:
                 outgoing_edges.append(edge)
         return outgoing_edges
     
@@ -205,10 +238,10 @@ class BotParser:
         >>> edges = get_incoming_edges("n1")
         """
         incoming_edges = []
-        for edge in self.edges.values():
+        for edge in self.incoming_edges.get(node_id, {}).values():
             if edge['source'] not in end_activities:
                 continue
-            if edge['target'] == node_id and edge['type'] in self.edge_types_of_interest and self.nodes[edge['source']]['type'] in self.node_types_of_interest:
+            if edge['type'] in self.edge_types_of_interest and self.nodes[edge['source']]['type'] in self.node_types_of_interest:
                 incoming_edges.append(edge)
         return incoming_edges
     
@@ -248,6 +281,8 @@ class BotParser:
         :example:
         >>> contains_node("n1")
         """
+        if isinstance(dfg, DFG):
+            return dfg.contains_node(node_id)
         for source, target in dfg.keys():
             if source == node_id or target == node_id:
                 return True
@@ -265,21 +300,18 @@ class BotParser:
         return self.id_name_map[name]
     
     def rename_labels(self, net, im, fm):
-        # replace the ids with the activity names
-        for node_id in self.id_name_map.keys():
-            name = self.id_name_map[node_id]
-
-            for t in net.transitions:
-                if t._Transition__label == "empty_intent" or  t._Transition__label == "empty_activity":
-                    t._Transition__label = None
-                if node_id == t._Transition__label: 
-                    if name == "empty_intent" or name == "empty_activity":
-                        t._Transition__label = None
-                    else:
-                        t._Transition__label = name
+        """
+        Replaces the node ids that label the transitions with the activity names. Transitions of empty intents and activities become invisible
+        """
+        empty_labels = ("empty_intent", "empty_activity")
+        for t in net.transitions:
+            label = self.id_name_map.get(t.label, t.label)
+            t.label = None if label in empty_labels else label
         return net, im, fm
 
 
+def _frozen(activities):
+    return None if activities is None else frozenset(activities)
 
 
 def extract_function_name(node):
@@ -301,7 +333,7 @@ def extract_intent_keyword(node_id, node, edges):
     Extracts the intent keyword from the node. If the intent keyword is empty, it is extracted from the ingoing edge of the node instead.
     :param node_id: the id of the node
     :param node: the node
-    :param edges: the edges of the bot model
+    :param edges: the edges of the bot model, it is sufficient to pass the ingoing edges of the node
     :return: the intent keyword
 
     :example:
@@ -331,7 +363,7 @@ def extract_activity_name(node_id, node, edges):
     Extracts the activity name from the node. If the activity name is empty, it is extracted from the ingoing edge of the node instead.
     :param node_id: the id of the node
     :param node: the node
-    :param edges: the edges of the bot model
+    :param edges: the edges of the bot model, it is sufficient to pass the ingoing edges of the node
     :return: the activity name
 
     :example:
@@ -1,5 +1,6 @@
 import unittest
 from utils.bot.parse_lib import get_parser, BotParser
+from utils.bot.dfg import DFG
 import json
 import os
 
@@ -72,6 +73,55 @@ class TestBotParser(unittest.TestCase):
         self.assertEqual(end, {"empty_intent"})
         self.assertEqual(dfg, {('A', "empty_intent"): 0})
 
+    def test_parser_cache_is_keyed_by_content(self):
+        model = get_bot_model_json('assets/sequential_path_model.json')
+        self.instance = get_parser(model)
+        self.assertIs(get_parser(json.loads(json.dumps(model))), self.instance)
+        edited = json.loads(json.dumps(model))
+        edited['edges'] = {}
+        self.assertIsNot(get_parser(edited), self.instance)
+
+    def test_compiled_artifacts_are_copied(self):
+        self.instance = BotParser(get_bot_model_json('assets/sequential_path_model.json'))
+        dfg, start, end = self.instance.get_dfg()
+        dfg[('B', 'C')] = 0
+        start.add('C')
+        self.assertEqual(self.instance.get_dfg(), ({('A', 'B'): 0}, {'A'}, {'B'}))
+        net, _, _ = self.instance.to_petri_net()
+        other_net, _, _ = self.instance.to_petri_net()
+        self.assertIsNot(net, other_net)
+        self.assertEqual(sorted(t.name for t in net.transitions), sorted(t.name for t in other_net.transitions))
+
+    def test_transitions_are_labeled_with_activity_names(self):
+        self.instance = BotParser(get_bot_model_json('assets/single_conversation_node.json'))
+        dfg, start, end = self.instance.get_dfg()
+        net, _, _ = self.instance.to_petri_net(dfg, start, end)
+        self.assertEqual(sorted(str(t.label) for t in net.transitions), sorted(str(self.instance.id_name_map.get(t.name.rsplit('_', 1)[0], None)) for t in net.transitions))
+        self.instance.to_petri_net(dfg, start, end)
+        self.assertEqual(self.instance._petri_nets.stats()['hits'], 1)
+
+
+class TestDFG(unittest.TestCase):
+    def test_adjacency_is_maintained(self):
+        dfg = DFG({('A', 'B'): 0, ('A', 'C'): 0})
+        self.assertEqual(dfg.out_degree('A'), 2)
+        self.assertTrue(dfg.has_incoming('B'))
+        self.assertFalse(dfg.has_incoming('A'))
+        dfg.pop(('A', 'B'))
+        self.assertFalse(dfg.contains_node('B'))
+        self.assertEqual(dfg.successors('A'), {'C'})
+        dfg[('C', 'A')] = 1
+        self.assertEqual(dfg.nodes(), {'A', 'C'})
+        self.assertEqual(dfg.in_degree('A'), 1)
+
+    def test_copy_is_independent(self):
+        dfg = DFG({('A', 'B'): 0})
+        copy = dfg.copy()
+        copy[('B', 'C')] = 0
+        self.assertIsInstance(copy, DFG)
+        self.assertFalse(dfg.has_outgoing('B'))
+        self.assertEqual(dfg, {('A', 'B'): 0})
+
 
 if __name__ == '__main__':
     unittest.main()
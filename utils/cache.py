@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded least recently used cache with an optional time to live.
+    Concurrent loads of the same key are deduplicated: the first caller runs the loader
+    and every other caller waits for its result instead of loading the value again.
+    """
+
+    def __init__(self, max_size=128, ttl=None):
+        """
+        :param max_size: maximum number of entries, the least recently used entry is evicted first
+        :param ttl: time to live of an entry in seconds, None means that entries never expire
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0  # loads that were served by a concurrent load of the same key
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, expiry time)
+        self._loading = {}  # key -> _PendingLoad
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Gets a value from the cache
+        :param key: the key
+        :param default: value returned if the key is not cached or expired
+        :return: the cached value or the default
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        Stores a value in the cache and evicts the least recently used entries if the cache is full
+        :param key: the key
+        :param value: the value
+        """
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_load(self, key, loader):
+        """
+        Gets a value from the cache or loads it using the loader.
+        If another thread is already loading the same key, we wait for its result.
+        None results are not cached.
+        :param key: the key
+        :param loader: function without arguments that returns the value
+        :return: the value
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            pending = self._loading.get(key)
+            leader = pending is None
+            if leader:
+                self.misses += 1
+                pending = _PendingLoad()
+                self._loading[key] = pending
+            else:
+                self.shared += 1
+        if not leader:
+            return pending.wait()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            with self._lock:
+                self._loading.pop(key, None)
+            pending.fail(e)
+            raise
+        with self._lock:
+            if value is not None:
+                self._store(key, value)
+            self._loading.pop(key, None)
+        pending.resolve(value)
+        return value
+
+    def invalidate(self, key=None):
+        """
+        Removes a key from the cache, or all keys if no key is given
+        :param key: the key
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """
+        Gets the usage statistics of the cache
+        :return: dict with size, hits, misses, shared loads, evictions and hit ratio
+        """
+        with self._lock:
+            requests = self.hits + self.misses + self.shared
+            return {
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "evictions": self.evictions,
+                "hitRatio": (self.hits + self.shared) / requests if requests > 0 else None,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key)[0]
+
+    def _lookup(self, key):
+        # must be called while holding the lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _store(self, key, value):
+        # must be called while holding the lock
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+class _PendingLoad:
+    """
+    Result of a load that is in progress, other threads can wait for it
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+
+    def resolve(self, value):
+        self._value = value
+        self._done.set()
+
+    def fail(self, error):
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
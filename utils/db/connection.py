@@ -1,5 +1,6 @@
 import sqlalchemy
 import pandas as pd
+from pandas.api.types import union_categoricals
 
 # pip install dogpile.cache for caching the sql results
 """
@@ -19,6 +20,118 @@ def read_events_into_df(db_connection,start_date = None, end_date =None, resourc
     df.rename(columns={'CASE_ID': 'case:concept:name', 'ACTIVITY_NAME': 'concept:name', 'TIME_OF_EVENT': 'time:timestamp', 'LIFECYCLE_PHASE': 'lifecycle:transition'}, inplace=True)
     return df
 
+# projection of the MESSAGE table to the event log format of the event log generator.
+# Only completed user messages and service requests are part of the event log.
+event_log_statement = """SELECT CASE_ID AS `case:concept:name`, ACTIVITY_NAME AS `concept:name`, TIME_OF_EVENT AS `time:timestamp`,
+        LOWER(LIFECYCLE_PHASE) AS `lifecycle:transition`, EVENT AS EVENT_TYPE, RESOURCE, RESOURCE_TYPE, REMARKS,
+        REMARKS->>'$.user' AS `user`, REMARKS->'$."in-service-context"' AS `in-service-context`,
+        REMARKS->>'$.serviceEndpoint' AS serviceEndpoint
+    FROM MESSAGE
+    WHERE CASE_ID IS NOT NULL AND RESOURCE IN :resource_ids
+        AND EVENT IN ('SERVICE_REQUEST', 'USER_MESSAGE') AND LIFECYCLE_PHASE = 'complete'"""
+# statistics of the conversations of a bot, computed from the same events as event_log_statement
+bot_statistics_statement = """SELECT conversations.numberOfConversations, conversations.averageConversationLength,
+        conversations.averageConversationDuration, states.numberOfStates, states.numberOfUsers
+    FROM (SELECT COUNT(*) AS numberOfConversations, AVG(events) AS averageConversationLength,
+            AVG(TIMESTAMPDIFF(MICROSECOND, firstEvent, lastEvent)) / 1000000 AS averageConversationDuration
+        FROM (SELECT COUNT(*) AS events, MIN(TIME_OF_EVENT) AS firstEvent, MAX(TIME_OF_EVENT) AS lastEvent
+            FROM MESSAGE
+            WHERE CASE_ID IS NOT NULL AND RESOURCE IN :resource_ids
+                AND EVENT IN ('SERVICE_REQUEST', 'USER_MESSAGE') AND LIFECYCLE_PHASE = 'complete'
+            GROUP BY CASE_ID) AS cases) AS conversations
+    CROSS JOIN (SELECT COUNT(DISTINCT ACTIVITY_NAME) AS numberOfStates, COUNT(DISTINCT REMARKS->>'$.user') AS numberOfUsers
+        FROM MESSAGE
+        WHERE CASE_ID IS NOT NULL AND RESOURCE IN :resource_ids
+            AND EVENT IN ('SERVICE_REQUEST', 'USER_MESSAGE') AND LIFECYCLE_PHASE = 'complete') AS states"""
+# columns with few distinct values, stored as categoricals while streaming
+categorical_event_log_columns = [
+    'lifecycle:transition', 'EVENT_TYPE', 'RESOURCE', 'RESOURCE_TYPE']
+
+
+def read_event_log(db_connection, resource_ids, start_date=None, end_date=None, chunksize=10000, since=None):
+    """
+    Reads the event log of a bot directly from the MESSAGE table.
+    The rows are streamed from a server side cursor in chunks, so the full result set is never held by the driver.
+    :param db_connection: sqlalchemy engine
+    :param resource_ids: resource ids of the bot
+    :param start_date: only events with a TIME_STAMP at or after this date (optional)
+    :param end_date: only events with a TIME_STAMP at or before this date (optional)
+    :param chunksize: number of rows that are fetched at once
+    :param since: only events with a TIME_OF_EVENT (the time:timestamp of the event log) at or after this time (optional)
+    :return: event log as a dataframe in the same format as the logs of the event log generator, None if there are no events
+    """
+    if db_connection is None:
+        raise ValueError('db_connection must be set')
+    if not resource_ids:
+        raise ValueError('resource_ids must not be empty')
+    statement = event_log_statement
+    params = {'resource_ids': list(resource_ids)}
+    if start_date is not None:
+        statement += ' AND TIME_STAMP >= :start_date'
+        params['start_date'] = start_date
+    if end_date is not None:
+        statement += ' AND TIME_STAMP <= :end_date'
+        params['end_date'] = end_date
+    if since is not None:
+        statement += ' AND TIME_OF_EVENT >= :since'
+        params['since'] = since
+    statement += ' ORDER BY CASE_ID, TIME_OF_EVENT, ID'
+    statement = sqlalchemy.text(statement).bindparams(
+        sqlalchemy.bindparam('resource_ids', expanding=True))
+
+    chunks = []
+    with db_connection.connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        for chunk in pd.read_sql(statement, con=connection, params=params, chunksize=chunksize):
+            chunk['time:timestamp'] = pd.to_datetime(
+                chunk['time:timestamp'], utc=True)
+            chunk['in-service-context'] = chunk['in-service-context'].map(
+                {'true': True, 'false': False})
+            for column in categorical_event_log_columns:
+                chunk[column] = chunk[column].astype('category')
+            chunks.append(chunk)
+    if len(chunks) == 0 or sum(len(chunk) for chunk in chunks) == 0:
+        return None
+
+    columns = {}
+    for column in chunks[0].columns:
+        if column in categorical_event_log_columns:
+            columns[column] = union_categoricals(
+                [chunk[column] for chunk in chunks])
+        else:
+            columns[column] = pd.concat(
+                [chunk[column] for chunk in chunks], ignore_index=True)
+        for chunk in chunks:
+            del chunk[column]  # release the chunk column as soon as it is copied
+    return pd.DataFrame(columns)
+
+
+def read_bot_statistics(db_connection, resource_ids):
+    """
+    Computes the statistics of the conversations of a bot in the database, the events are not transferred
+    :param db_connection: sqlalchemy engine
+    :param resource_ids: resource ids of the bot
+    :return: dict with numberOfConversations, numberOfStates, numberOfUsers, averageConversationLength and
+        averageConversationDuration (seconds), the averages are None if the bot has no conversations
+    """
+    if db_connection is None:
+        raise ValueError('db_connection must be set')
+    if not resource_ids:
+        raise ValueError('resource_ids must not be empty')
+    statement = sqlalchemy.text(bot_statistics_statement).bindparams(
+        sqlalchemy.bindparam('resource_ids', expanding=True))
+    with db_connection.connect() as connection:
+        row = connection.execute(
+            statement, {'resource_ids': list(resource_ids)}).mappings().one()
+    return {
+        'numberOfConversations': int(row['numberOfConversations']),
+        'numberOfStates': int(row['numberOfStates']),
+        'numberOfUsers': int(row['numberOfUsers']),
+        'averageConversationLength': float(row['averageConversationLength']) if row['averageConversationLength'] is not None else None,
+        'averageConversationDuration': float(row['averageConversationDuration']) if row['averageConversationDuration'] is not None else None,
+    }
+
+
 def get_connection(host,port, user, password, db = 'LAS2PEERMON'):
     if(host is None or user is None or password is None):
         raise ValueError('mysql host, user and password must be set')
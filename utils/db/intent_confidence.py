@@ -0,0 +1,165 @@
+import threading
+import time
+import pandas as pd
+import sqlalchemy
+
+# counts and sums of the intent confidences of the messages with an ID in (:low, :high], per bot and intent
+rollup_statement = """SELECT json_unquote(json_extract(REMARKS, '$.botName')) AS botName,
+        json_extract(REMARKS, '$.intent.intentKeyword') AS intentKeyword,
+        COUNT(json_extract(REMARKS, '$.intent.confidence')) AS confidenceCount,
+        SUM(json_extract(REMARKS, '$.intent.confidence')) AS confidenceSum
+    FROM MESSAGE
+    WHERE ID > :low AND ID <= :high AND json_extract(REMARKS, '$.botName') IS NOT NULL
+    GROUP BY botName, intentKeyword"""
+# the same rollup using the generated columns of the MESSAGE table (see utils.db.migrations)
+generated_rollup_statement = """SELECT BOT_NAME AS botName, INTENT_KEYWORD AS intentKeyword,
+        COUNT(INTENT_CONFIDENCE) AS confidenceCount, SUM(INTENT_CONFIDENCE) AS confidenceSum
+    FROM MESSAGE
+    WHERE ID > :low AND ID <= :high AND BOT_NAME IS NOT NULL
+    GROUP BY BOT_NAME, INTENT_KEYWORD"""
+
+# the summary table stores intents without keyword as empty string, since the keyword is part of the primary key
+table_rollup_statement = """INSERT INTO INTENT_CONFIDENCE_ROLLUP (BOT_NAME, INTENT_KEYWORD, CONFIDENCE_COUNT, CONFIDENCE_SUM)
+    SELECT botName, COALESCE(intentKeyword, ''), confidenceCount, COALESCE(confidenceSum, 0) FROM ({rollup}) AS new_messages
+    ON DUPLICATE KEY UPDATE CONFIDENCE_COUNT = CONFIDENCE_COUNT + VALUES(CONFIDENCE_COUNT),
+        CONFIDENCE_SUM = CONFIDENCE_SUM + VALUES(CONFIDENCE_SUM)"""
+
+table_average_statement = """SELECT NULLIF(INTENT_KEYWORD, '') AS intentKeyword,
+        CONFIDENCE_SUM / NULLIF(CONFIDENCE_COUNT, 0) AS averageConfidence
+    FROM INTENT_CONFIDENCE_ROLLUP WHERE BOT_NAME = :bot_name"""
+
+# average intent confidence of a single bot, read from the MESSAGE_BOT_INTENT index
+index_average_statement = """SELECT INTENT_KEYWORD AS intentKeyword, AVG(INTENT_CONFIDENCE) AS averageConfidence
+    FROM MESSAGE WHERE BOT_NAME = :bot_name GROUP BY INTENT_KEYWORD"""
+# average intent confidence of a single bot for databases without the generated columns, scans the whole table
+scan_average_statement = """SELECT json_extract(REMARKS, '$.intent.intentKeyword') AS intentKeyword,
+        AVG(json_extract(REMARKS, '$.intent.confidence')) AS averageConfidence
+    FROM MESSAGE WHERE json_unquote(json_extract(REMARKS, '$.botName')) = :bot_name GROUP BY intentKeyword"""
+
+rollup_backends = ["memory", "table", "index"]
+
+
+class IntentConfidenceRollup:
+    """
+    Average intent confidence per bot and intent, maintained incrementally from the MESSAGE table.
+    Only messages with an ID above the highest ID that was already rolled up are read, so the MESSAGE table
+    is scanned once and later refreshes only read the new rows by primary key.
+    The rollup is kept in memory of the process or in the INTENT_CONFIDENCE_ROLLUP table (see utils.db.migrations),
+    which is shared by all worker processes. The "index" backend does not keep a rollup, it aggregates the messages of
+    the bot using the MESSAGE_BOT_INTENT index on each request.
+    If the MESSAGE table has the generated columns of the migrations, they are used instead of extracting the json attributes.
+    A rollup belongs to one database, all calls have to pass a connection to the same database.
+    """
+
+    def __init__(self, backend="memory", refresh_interval=10):
+        """
+        :param backend: "memory" keeps the rollup in this process, "table" in the INTENT_CONFIDENCE_ROLLUP table,
+            "index" aggregates the messages of the bot on each request
+        :param refresh_interval: minimum time in seconds between two reads of new messages
+        """
+        self.backend = backend
+        self.refresh_interval = refresh_interval
+        self.high_water_id = 0  # highest message ID that is part of the in-memory rollup
+        self._rollup = {}  # bot name -> {intent keyword -> [count of confidences, sum of confidences]}
+        self._refreshed = None  # time of the last refresh
+        self._generated_columns = None  # whether the MESSAGE table has the generated columns
+        self._lock = threading.Lock()  # guards the rollup and the high water mark, it is not held during queries
+        self._refresh_lock = threading.Lock()  # only one thread reads new messages at a time
+
+    def average(self, bot_name, connection):
+        """
+        Gets the average intent confidence of a bot
+        :param bot_name: bot name
+        :param connection: database connection
+        :return: dataframe with the columns intentKeyword and averageConfidence
+        """
+        if self.backend not in rollup_backends:
+            raise ValueError(
+                f"intent confidence backend must be one of {rollup_backends}")
+        if self.backend == "index":
+            statement = index_average_statement if self.has_generated_columns(
+                connection) else scan_average_statement
+            return pd.read_sql(sqlalchemy.text(statement), con=connection, params={'bot_name': bot_name})
+        self.refresh(connection)
+        if self.backend == "table":
+            return pd.read_sql(sqlalchemy.text(table_average_statement), con=connection,
+                               params={'bot_name': bot_name})
+        with self._lock:
+            intents = dict(self._rollup.get(bot_name, {}))
+        return pd.DataFrame({
+            'intentKeyword': list(intents.keys()),
+            'averageConfidence': [total / count if count > 0 else None for count, total in intents.values()],
+        }, columns=['intentKeyword', 'averageConfidence'])
+
+    def refresh(self, connection, force=False):
+        """
+        Adds the messages that were stored since the last refresh to the rollup.
+        Requests wait for the first refresh, later requests that arrive while another thread refreshes use the current rollup.
+        :param connection: database connection
+        :param force: refresh even if the last refresh was less than refresh_interval seconds ago, waits for a running refresh
+        """
+        if not force and self._refreshed is not None and time.time() - self._refreshed < self.refresh_interval:
+            return
+        if not self._refresh_lock.acquire(blocking=force or self._refreshed is None):
+            return
+        try:
+            if not force and self._refreshed is not None and time.time() - self._refreshed < self.refresh_interval:
+                return  # refreshed by another thread while waiting
+            started = time.time()
+            if self.backend == "table":
+                self._refresh_table(connection)
+            else:
+                self._refresh_memory(connection)
+            self._refreshed = started
+        finally:
+            self._refresh_lock.release()
+
+    def has_generated_columns(self, connection):
+        """
+        Checks whether the MESSAGE table has the generated columns BOT_NAME, INTENT_KEYWORD and INTENT_CONFIDENCE
+        """
+        if self._generated_columns is None:
+            columns = {column['name'].upper() for column in sqlalchemy.inspect(
+                connection).get_columns('MESSAGE')}
+            self._generated_columns = {
+                'BOT_NAME', 'INTENT_KEYWORD', 'INTENT_CONFIDENCE'} <= columns
+        return self._generated_columns
+
+    def _rollup_statement(self, connection):
+        return generated_rollup_statement if self.has_generated_columns(connection) else rollup_statement
+
+    def _refresh_memory(self, connection):
+        # called with the refresh lock held, so no other thread moves the high water mark during the queries
+        low = self.high_water_id
+        with connection.connect() as c:
+            high = c.execute(sqlalchemy.text(
+                "SELECT MAX(ID) FROM MESSAGE")).scalar()
+            if high is None or high <= low:
+                return
+            rows = c.execute(sqlalchemy.text(self._rollup_statement(connection)), {
+                'low': low, 'high': high}).fetchall()
+        with self._lock:
+            for bot_name, keyword, count, total in rows:
+                intent = self._rollup.setdefault(
+                    bot_name, {}).setdefault(keyword, [0, 0.0])
+                intent[0] += count
+                intent[1] += float(total or 0)
+            self.high_water_id = high
+
+    def _refresh_table(self, connection):
+        # the row of the state table is locked while the rollup is updated, so that concurrent refreshes of
+        # other worker processes wait and do not add the same messages twice
+        with connection.begin() as c:
+            low = c.execute(sqlalchemy.text(
+                "SELECT HIGH_WATER_ID FROM ROLLUP_STATE WHERE NAME = 'intent_confidence' FOR UPDATE")).scalar()
+            high = c.execute(sqlalchemy.text(
+                "SELECT MAX(ID) FROM MESSAGE")).scalar()
+            if high is None or (low is not None and high <= low):
+                return
+            c.execute(sqlalchemy.text(table_rollup_statement.format(rollup=self._rollup_statement(connection))),
+                      {'low': low or 0, 'high': high})
+            c.execute(sqlalchemy.text("REPLACE INTO ROLLUP_STATE (NAME, HIGH_WATER_ID) VALUES ('intent_confidence', :high)"),
+                      {'high': high})
+
+
+intent_confidence_rollup = IntentConfidenceRollup()
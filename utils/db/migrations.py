@@ -0,0 +1,128 @@
+import os
+import sys
+import sqlalchemy
+
+sys.path.append(os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..', '..')))
+
+from utils.db.connection import event_log_statement, get_connection
+from utils.db.intent_confidence import index_average_statement, generated_rollup_statement
+
+# schema changes of the events database that are used by this service, applied in order by migrate.
+# Each migration is (name, list of statements)
+migrations = [
+    ("001_intent_confidence_rollup", [
+        """CREATE TABLE IF NOT EXISTS INTENT_CONFIDENCE_ROLLUP (
+            BOT_NAME varchar(255) NOT NULL,
+            INTENT_KEYWORD varchar(255) NOT NULL,
+            CONFIDENCE_COUNT bigint NOT NULL DEFAULT 0,
+            CONFIDENCE_SUM double NOT NULL DEFAULT 0,
+            PRIMARY KEY (BOT_NAME, INTENT_KEYWORD)
+        )""",
+        """CREATE TABLE IF NOT EXISTS ROLLUP_STATE (
+            NAME varchar(64) NOT NULL,
+            HIGH_WATER_ID bigint NOT NULL,
+            PRIMARY KEY (NAME)
+        )""",
+    ]),
+    # generated columns of the REMARKS attributes that are filtered and aggregated, and indexes of the hot queries.
+    # The rollup is rebuilt from the generated columns, which store the intent keyword unquoted
+    ("002_message_generated_columns", [
+        """ALTER TABLE MESSAGE
+            ADD COLUMN BOT_NAME varchar(255) GENERATED ALWAYS AS (JSON_VALUE(REMARKS, '$.botName' RETURNING CHAR(255) NULL ON EMPTY NULL ON ERROR)) STORED,
+            ADD COLUMN INTENT_KEYWORD varchar(255) GENERATED ALWAYS AS (JSON_VALUE(REMARKS, '$.intent.intentKeyword' RETURNING CHAR(255) NULL ON EMPTY NULL ON ERROR)) STORED,
+            ADD COLUMN INTENT_CONFIDENCE double GENERATED ALWAYS AS (JSON_VALUE(REMARKS, '$.intent.confidence' RETURNING DOUBLE NULL ON EMPTY NULL ON ERROR)) STORED""",
+        "CREATE INDEX MESSAGE_RESOURCE_TIME ON MESSAGE (RESOURCE, TIME_STAMP)",
+        "CREATE INDEX MESSAGE_BOT_INTENT ON MESSAGE (BOT_NAME, INTENT_KEYWORD, INTENT_CONFIDENCE)",
+        "DELETE FROM INTENT_CONFIDENCE_ROLLUP",
+        "DELETE FROM ROLLUP_STATE WHERE NAME = 'intent_confidence'",
+    ]),
+    # incremental refreshes of cached event logs read the events since the last TIME_OF_EVENT
+    ("003_message_resource_event_time", [
+        "CREATE INDEX MESSAGE_RESOURCE_EVENT_TIME ON MESSAGE (RESOURCE, TIME_OF_EVENT)",
+    ]),
+]
+
+# queries that should use an index after the migrations: (name, statement, parameters, expected index)
+checked_queries = [
+    ("event log of a bot since a date", event_log_statement + " AND TIME_STAMP >= :start_date",
+     {'resource_ids': [''], 'start_date': '2000-01-01'}, 'MESSAGE_RESOURCE_TIME'),
+    ("new events of a cached event log", event_log_statement + " AND TIME_OF_EVENT >= :since",
+     {'resource_ids': [''], 'since': '2000-01-01'}, 'MESSAGE_RESOURCE_EVENT_TIME'),
+    ("intent confidence of a bot", index_average_statement,
+     {'bot_name': ''}, 'MESSAGE_BOT_INTENT'),
+    ("new messages of the intent confidence rollup", generated_rollup_statement,
+     {'low': 0, 'high': 1}, 'PRIMARY'),
+]
+
+
+def migrate(db_connection):
+    """
+    Applies the migrations that were not applied to the database yet
+    :param db_connection: sqlalchemy engine
+    :return: names of the applied migrations
+    """
+    applied = []
+    with db_connection.begin() as c:
+        c.execute(sqlalchemy.text(
+            "CREATE TABLE IF NOT EXISTS SCHEMA_MIGRATIONS (NAME varchar(255) NOT NULL, APPLIED_AT timestamp DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (NAME))"))
+        done = {row[0] for row in c.execute(
+            sqlalchemy.text("SELECT NAME FROM SCHEMA_MIGRATIONS"))}
+    for name, statements in migrations:
+        if name in done:
+            continue
+        print(f"Applying migration {name}")
+        with db_connection.begin() as c:
+            for statement in statements:
+                c.execute(sqlalchemy.text(statement))
+            c.execute(sqlalchemy.text(
+                "INSERT INTO SCHEMA_MIGRATIONS (NAME) VALUES (:name)"), {'name': name})
+        applied.append(name)
+    return applied
+
+
+def check_indexes(db_connection, resource=None, bot_name=None):
+    """
+    Explains the hot queries and checks that they use their index.
+    The optimizer may prefer a full table scan for small tables, run the check against a database with realistic data.
+    :param db_connection: sqlalchemy engine
+    :param resource: a resource id, makes the plan of the event log query realistic (optional)
+    :param bot_name: a bot name, makes the plan of the intent confidence query realistic (optional)
+    :return: list of (query name, expected index, used index, whether the expected index is used)
+    """
+    results = []
+    with db_connection.connect() as c:
+        for name, statement, parameters, expected in checked_queries:
+            parameters = dict(parameters)
+            if resource is not None and 'resource_ids' in parameters:
+                parameters['resource_ids'] = [resource]
+            if bot_name is not None and 'bot_name' in parameters:
+                parameters['bot_name'] = bot_name
+            statement = sqlalchemy.text("EXPLAIN " + statement)
+            if 'resource_ids' in parameters:
+                statement = statement.bindparams(
+                    sqlalchemy.bindparam('resource_ids', expanding=True))
+            plan = c.execute(statement, parameters).mappings().all()
+            used = [row['key'] for row in plan if row['table'] == 'MESSAGE']
+            results.append((name, expected, used[0] if used else None,
+                            len(used) > 0 and all(key == expected for key in used)))
+    return results
+
+
+if __name__ == '__main__':
+    # python utils/db/migrations.py [--check [resource id] [bot name]], uses the database settings of the .env file
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=os.path.join(
+        os.path.dirname(__file__), '..', '..', '.env'))
+    engine = get_connection(os.environ.get('MYSQL_HOST', 'localhost'), os.environ.get('MYSQL_PORT', '3306'),
+                            os.environ.get('MYSQL_USER', 'root'), os.environ.get(
+                                'MYSQL_PASSWORD', 'root'),
+                            os.environ.get('MYSQL_EVENTS_DB', 'LAS2PEERMON'))
+    if len(sys.argv) > 1 and sys.argv[1] == '--check':
+        arguments = sys.argv[2:] + [None, None]
+        checks = check_indexes(engine, arguments[0], arguments[1])
+        for name, expected, used, ok in checks:
+            print(f"{'OK  ' if ok else 'FAIL'} {name}: expected {expected}, uses {used}")
+        sys.exit(0 if all(ok for _, _, _, ok in checks) else 1)
+    applied = migrate(engine)
+    print(f"Applied {len(applied)} migrations")
@@ -0,0 +1,146 @@
+import glob
+import hashlib
+import os
+import tempfile
+import time
+import pyarrow as pa
+import pyarrow.feather as feather
+
+
+class EventLogStore:
+    """
+    On-disk snapshots of parsed event logs in the Arrow IPC (Feather v2) format.
+    Files are written uncompressed and read with a memory map, so all worker processes share
+    the same pages of the OS page cache and the snapshots survive worker restarts.
+    Snapshots older than max_age are removed and at most max_files snapshots are kept, the least recently written
+    are removed first.
+    """
+
+    def __init__(self, directory, max_files=None, max_age=None):
+        """
+        :param directory: directory of the snapshot files, created if it does not exist
+        :param max_files: maximum number of snapshots (optional)
+        :param max_age: maximum age of a snapshot in seconds (optional)
+        """
+        self.directory = directory
+        self.max_files = max_files
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        """
+        Gets the path of the snapshot file of a key
+        :param key: any key with a stable repr, e.g. the event log cache key
+        :return: the path
+        """
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{name}.arrow")
+
+    def load(self, key, max_age=None, newer_than=None):
+        """
+        Loads a snapshot
+        :param key: the key
+        :param max_age: maximum age of the snapshot in seconds (optional)
+        :param newer_than: the snapshot must have been written after this unix time (optional)
+        :return: the event log as a dataframe, None if there is no valid snapshot
+        """
+        path = self.path(key)
+        try:
+            modified = os.path.getmtime(path)
+        except OSError:
+            return None
+        if max_age is not None and time.time() - modified > max_age:
+            return None
+        if self.max_age is not None and time.time() - modified > self.max_age:
+            return None
+        if newer_than is not None and modified < newer_than:
+            return None
+        try:
+            table = feather.read_table(path, memory_map=True)
+        except (OSError, pa.ArrowInvalid) as e:
+            print("Could not read event log snapshot", path)
+            print(e)
+            return None
+        # numeric and timestamp columns keep pointing into the memory map
+        return table.to_pandas(split_blocks=True)
+
+    def save(self, key, log):
+        """
+        Writes a snapshot atomically, readers see either the old or the new file
+        :param key: the key
+        :param log: the event log as a dataframe
+        """
+        try:
+            table = pa.Table.from_pandas(log, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            compatible = _arrow_compatible(log)
+            if compatible is None:
+                return
+            try:
+                table = pa.Table.from_pandas(compatible, preserve_index=False)
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                print("Could not convert event log to arrow")
+                print(e)
+                return
+        file_descriptor, tmp_path = tempfile.mkstemp(
+            dir=self.directory, suffix='.tmp')
+        os.close(file_descriptor)
+        try:
+            feather.write_feather(table, tmp_path, compression='uncompressed')
+            os.replace(tmp_path, self.path(key))
+        except OSError as e:
+            print("Could not write event log snapshot")
+            print(e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the snapshots that are older than max_age or exceed max_files, and temporary files of
+        writes that did not finish
+        """
+        now = time.time()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.arrow')) + glob.glob(os.path.join(self.directory, '*.tmp')):
+            try:
+                modified = os.path.getmtime(path)
+            except OSError:
+                continue  # removed by another worker
+            if path.endswith('.arrow'):
+                snapshots.append((modified, path))
+            elif now - modified > 3600:
+                _remove(path)  # the writing worker died an hour ago
+        snapshots.sort(reverse=True)
+        for i, (modified, path) in enumerate(snapshots):
+            if (self.max_files is not None and i >= self.max_files) or \
+                    (self.max_age is not None and now - modified > self.max_age):
+                _remove(path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _arrow_compatible(log):
+    """
+    Object columns of XES logs mix missing floats with strings or booleans, which arrow cannot store.
+    Missing values are replaced by None, the restored log has None instead of NaN in these columns.
+    :return: the converted log, None if a column still mixes types. Such logs are not stored, converting
+        the values of these columns to one type would change the log that other workers restore
+    """
+    log = log.copy(deep=False)
+    for column in log.columns:
+        if log[column].dtype != object:
+            continue
+        values = log[column].where(log[column].notna(), None)
+        try:
+            pa.array(values, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            print("Event log column", column, "mixes types, the event log is not stored")
+            return None
+        log[column] = values
+    return log
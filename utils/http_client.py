@@ -0,0 +1,122 @@
+import copy
+import hashlib
+import threading
+from http.cookiejar import DefaultCookiePolicy
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils.cache import LRUCache
+
+# seconds to wait for a connection and for the response of the bot manager and other services
+connect_timeout = 5
+read_timeout = 60
+# retries of failed connections and of 502, 503 and 504 responses, the n-th retry waits backoff_factor * 2^(n-1) seconds
+retries = 3
+backoff_factor = 0.5
+# connections that are kept alive per host, shared by all threads
+pool_size = 10
+
+# responses with an ETag or Last-Modified header, revalidated with conditional requests.
+# Keyed by (url, hash of the authorization header) so that users do not see responses of other users
+response_cache = LRUCache(max_size=256)
+
+_session = None
+_lock = threading.Lock()
+_revalidated = 0  # requests that were answered with 304 Not Modified
+_modified = 0  # conditional requests that were answered with a new response
+
+
+def get_session():
+    """
+    Gets the session of this process, created on first use. The session keeps connections alive and retries failed requests.
+    It is shared by all threads: the connection pool of urllib3 is thread-safe, and the session does not keep cookies,
+    so that cookies of one request are never sent with a request of another user.
+    """
+    global _session
+    with _lock:
+        if _session is not None:
+            return _session
+        session = requests.Session()
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'HEAD']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+        return session
+
+
+def get(url, headers=None, conditional=True, timeout=None, **kwargs):
+    """
+    Sends a GET request using the shared session.
+    If a previous response of the url had an ETag or Last-Modified header, the request is sent with If-None-Match or
+    If-Modified-Since and a 304 response is answered with a copy of the previous response.
+    :param url: the url
+    :param headers: request headers
+    :param conditional: whether responses should be cached and revalidated
+    :param timeout: (connect timeout, read timeout) in seconds, defaults to the module settings
+    :return: the response
+    """
+    global _revalidated, _modified
+    headers = dict(headers or {})
+    if timeout is None:
+        timeout = (connect_timeout, read_timeout)
+    if not conditional or kwargs.get('stream', False):
+        return get_session().get(url, headers=headers, timeout=timeout, **kwargs)
+
+    key = (url, _authorization_hash(headers))
+    cached = response_cache.get(key)
+    if cached is not None:
+        if cached.headers.get('ETag'):
+            headers['If-None-Match'] = cached.headers['ETag']
+        if cached.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = cached.headers['Last-Modified']
+    response = get_session().get(url, headers=headers, timeout=timeout, **kwargs)
+    if cached is not None and response.status_code == 304:
+        with _lock:
+            _revalidated += 1
+        response.close()
+        return copy.copy(cached)
+    if cached is not None:
+        with _lock:
+            _modified += 1
+    if response.status_code == 200 and (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+        response.content  # read the body before the response is shared
+        response_cache.set(key, response)
+    return response
+
+
+def post(url, timeout=None, **kwargs):
+    """
+    Sends a POST request using the shared session. POST requests are not retried
+    :param url: the url
+    :param timeout: (connect timeout, read timeout) in seconds, defaults to the module settings
+    :return: the response
+    """
+    if timeout is None:
+        timeout = (connect_timeout, read_timeout)
+    return get_session().post(url, timeout=timeout, **kwargs)
+
+
+def stats():
+    """
+    Gets the number of revalidated responses
+    """
+    with _lock:
+        revalidations = _revalidated + _modified
+        return {
+            "cachedResponses": len(response_cache),
+            "notModified": _revalidated,
+            "modified": _modified,
+            "notModifiedRatio": _revalidated / revalidations if revalidations > 0 else None,
+        }
+
+
+def _authorization_hash(headers):
+    authorization = next((value for name, value in headers.items()
+                         if name.lower() == 'authorization'), None)
+    if authorization is None:
+        return None
+    return hashlib.sha256(authorization.encode('utf-8')).hexdigest()
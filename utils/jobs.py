@@ -0,0 +1,157 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFull(Exception):
+    """
+    Raised when a job is submitted while the maximum number of jobs are queued or running
+    """
+
+
+class Job:
+    """
+    A function that is executed in the background. Its result is kept until the job expires.
+    """
+
+    def __init__(self, name):
+        self.id = str(uuid.uuid4())
+        self.name = name
+        self.status = "queued"  # queued, running, finished, failed or cancelled
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.future = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs long running jobs on a bounded pool of worker threads.
+    Jobs are kept in memory of the process, finished jobs are removed after the retention time.
+    """
+
+    def __init__(self, workers=2, max_pending=16, retention=3600):
+        """
+        :param workers: number of jobs that run at the same time
+        :param max_pending: maximum number of jobs that are queued or running. Cancelled jobs that are still running
+            count until they return, since they occupy a worker
+        :param retention: time in seconds that finished jobs and their results are kept
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention = retention
+        self._jobs = {}  # job id -> Job
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, name, function):
+        """
+        Submits a job
+        :param name: name of the job, e.g. the endpoint that it runs
+        :param function: function without arguments that computes the result
+        :return: the job
+        """
+        with self._lock:
+            self._remove_expired()
+            pending = sum(1 for job in self._jobs.values()
+                          if not job.future.done())
+            if pending >= self.max_pending:
+                raise JobQueueFull(
+                    f"{pending} jobs are queued or running, try again later")
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='job')
+            job = Job(name)
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._run, job, function)
+        return job
+
+    def get(self, job_id):
+        """
+        Gets a job
+        :param job_id: id of the job
+        :return: the job, None if there is no such job or it expired
+        """
+        with self._lock:
+            self._remove_expired()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels a job. Queued jobs are not started, the result of running jobs is discarded.
+        Running jobs can not be interrupted, they are cancelled but count toward max_pending until they return.
+        :param job_id: id of the job
+        :return: the job, None if there is no such job
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status in ("queued", "running"):
+                job.future.cancel()  # only succeeds if the job has not started
+                job.status = "cancelled"
+                job.finished = time.time()
+            return job
+
+    def stats(self):
+        """
+        Gets the number of jobs by status
+        """
+        with self._lock:
+            self._remove_expired()
+            counts = {"queued": 0, "running": 0,
+                      "finished": 0, "failed": 0, "cancelled": 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            counts["workers"] = self.workers
+            counts["maxPending"] = self.max_pending
+            return counts
+
+    def _run(self, job, function):
+        with self._lock:
+            if job.status == "cancelled":
+                return
+            job.status = "running"
+            job.started = time.time()
+        try:
+            result = function()
+        except Exception as e:
+            print("Job", job.id, job.name, "failed")
+            print(e)
+            with self._lock:
+                if job.status == "running":
+                    job.status = "failed"
+                    job.error = str(e)
+                    job.finished = time.time()
+            return
+        with self._lock:
+            if job.status == "running":
+                job.status = "finished"
+                job.result = result
+                job.finished = time.time()
+
+    def _remove_expired(self):
+        # must be called while holding the lock
+        now = time.time()
+        # cancelled jobs are kept while they still run, so that they count toward max_pending
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished is not None and now - job.finished > self.retention and job.future.done()]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+job_manager = JobManager()
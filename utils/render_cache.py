@@ -0,0 +1,138 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+# columns that identify the content of an event log, see log_fingerprint
+fingerprint_columns = ['case:concept:name', 'concept:name', 'time:timestamp']
+
+
+class RenderCache:
+    """
+    Size-bounded cache of rendered visualizations (e.g. svg output of graphviz).
+    Outputs are keyed by (model fingerprint, log fingerprint, variant, format). When the log of a visualization changed,
+    the output that was rendered for the previous version of the log is served while the new output is rendered in the background.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, workers=2):
+        """
+        :param max_bytes: maximum total size of the cached outputs, the least recently used outputs are evicted first
+        :param workers: number of threads that render in the background
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0  # requests that were served with the output of an older log
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> output
+        self._size = 0
+        self._latest = {}  # group -> (request number, key) of the most recently requested output of the group
+        self._rendering = {}  # key -> future of a render in progress
+        self._requests = 0  # number of renders that were started, orders the outputs of a group
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='render')
+
+    def get_or_render(self, key, render, group=None):
+        """
+        Gets a rendered output from the cache or renders it.
+        Concurrent requests for the same key share one render.
+        :param key: (model fingerprint, log fingerprint, variant, format)
+        :param render: function without arguments that returns the output as a string
+        :param group: outputs of the same group may be served while a newer output is rendered,
+            defaults to the key without the log fingerprint. Should identify where the log comes from, e.g. the event log url
+        :return: the output
+        """
+        if group is None:
+            group = (key[0],) + tuple(key[2:])
+        with self._lock:
+            output = self._entries.get(key)
+            if output is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return output
+            future = self._rendering.get(key)
+            if future is None:
+                self._requests += 1
+                future = self._executor.submit(
+                    self._render, key, group, render, self._requests)
+                self._rendering[key] = future
+            latest = self._latest.get(group, (None, None))[1]
+            if latest is not None and latest in self._entries:
+                self._entries.move_to_end(latest)
+                self.stale += 1
+                return self._entries[latest]
+            self.misses += 1
+        return future.result()
+
+    def invalidate(self):
+        """
+        Removes all outputs from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+            self._size = 0
+
+    def stats(self):
+        """
+        Gets the usage statistics of the cache
+        """
+        with self._lock:
+            requests = self.hits + self.misses + self.stale
+            return {
+                "size": len(self._entries),
+                "bytes": self._size,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "rendering": len(self._rendering),
+                "hitRatio": (self.hits + self.stale) / requests if requests > 0 else None,
+            }
+
+    def _render(self, key, group, render, number):
+        try:
+            output = render()
+        except Exception as e:
+            print("Could not render", key)
+            print(e)
+            with self._lock:
+                self._rendering.pop(key, None)
+            raise
+        with self._lock:
+            self._rendering.pop(key, None)
+            size = len(output)
+            if size > self.max_bytes:
+                return output
+            self._entries[key] = output
+            self._size += size
+            # renders of the same group can finish out of order, an older log must not replace the newer one
+            if self._latest.get(group, (0, None))[0] < number:
+                self._latest[group] = (number, key)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+        return output
+
+
+render_cache = RenderCache()
+
+
+def log_fingerprint(event_log):
+    """
+    Computes a hash of an event log. Logs from utils.api_requests.fetch_event_log are identified by their cache key and
+    version, other logs by a hash of their cases, activities and timestamps
+    :param event_log: event log as a dataframe
+    :return: hex digest, None if there is no event log
+    """
+    if event_log is None:
+        return None
+    if 'version' in event_log.attrs:
+        return hashlib.sha256(repr(event_log.attrs['version']).encode('utf-8')).hexdigest()
+    columns = [column for column in fingerprint_columns if column in event_log.columns]
+    hashes = pd.util.hash_pandas_object(event_log[columns], index=False)
+    return hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()
@@ -0,0 +1,472 @@
+import unittest
+import json
+import threading
+import time
+import io
+import os
+import sys
+import tempfile
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pm4py
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pm4py.objects.log.importer.xes import variants as xes_importer
+from utils.cache import LRUCache
+from utils.event_log_store import EventLogStore
+from utils.render_cache import RenderCache, log_fingerprint
+from utils.jobs import JobManager, JobQueueFull
+from utils import http_client, api_requests
+from utils.db.intent_confidence import IntentConfidenceRollup
+import sqlalchemy
+from utils.xes_stream import read_xes_stream
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+
+    def test_concurrent_loads_are_shared(self):
+        cache = LRUCache()
+        calls = []
+        started = threading.Event()
+
+        def loader():
+            calls.append(1)
+            started.set()
+            time.sleep(0.05)
+            return 'log'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            cache.get_or_load('key', loader))) for _ in range(4)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['log'] * 4)
+        stats = cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['shared'], 3)
+
+    def test_none_is_not_cached(self):
+        cache = LRUCache()
+        self.assertIsNone(cache.get_or_load('a', lambda: None))
+        self.assertEqual(cache.get_or_load('a', lambda: 1), 1)
+
+
+class TestXesStream(unittest.TestCase):
+    def setUp(self):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(current_dir, '..', 'assets', 'event_logs', 'demo.xes'), 'rb') as f:
+            self.xes = f.read()
+
+    def test_same_log_as_pm4py_importer(self):
+        event_filter = {'EVENT': {'SERVICE_REQUEST', 'USER_MESSAGE'},
+                        'lifecycle:transition': {'complete'}}
+        columns = ['case:concept:name', 'concept:name',
+                   'time:timestamp', 'EVENT', 'user', 'serviceEndpoint']
+        log = read_xes_stream(io.BytesIO(self.xes), event_filter, columns)
+
+        expected = pm4py.convert_to_dataframe(
+            xes_importer.iterparse.import_from_string(self.xes))
+        expected = expected[expected['EVENT'].isin(event_filter['EVENT']) & (
+            expected['lifecycle:transition'] == 'complete')].reset_index(drop=True)
+        self.assertEqual(set(log.columns), set(columns))
+        self.assertEqual(len(log), len(expected))
+        for column in columns:
+            self.assertTrue(log[column].astype(str).equals(
+                expected[column].astype(str)), column)
+
+    def test_empty_result(self):
+        log = read_xes_stream(io.BytesIO(self.xes), {
+                              'lifecycle:transition': {'unknown'}})
+        self.assertIsNone(log)
+
+
+class TestEventLogStore(unittest.TestCase):
+    def test_round_trip(self):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(current_dir, '..', 'assets', 'event_logs', 'demo.xes'), 'rb') as f:
+            log = read_xes_stream(f)
+        with tempfile.TemporaryDirectory() as directory:
+            store = EventLogStore(directory)
+            self.assertIsNone(store.load('demo'))
+            store.save('demo', log)
+            restored = store.load('demo')
+            self.assertEqual(list(restored.columns), list(log.columns))
+            self.assertTrue(restored['time:timestamp'].equals(
+                log['time:timestamp']))
+            self.assertTrue(restored['concept:name'].equals(
+                log['concept:name']))
+            self.assertIsNone(store.load('demo', max_age=-1))
+
+    def test_logs_with_mixed_columns_are_not_stored(self):
+        log = pd.DataFrame({'concept:name': ['a', 'b', 'c'], 'user': ['alice', float('nan'), 'bob'],
+                            'score': ['high', 1.5, True]})
+        with tempfile.TemporaryDirectory() as directory:
+            store = EventLogStore(directory)
+            store.save('mixed', log)
+            self.assertIsNone(store.load('mixed'))
+            store.save('missing', log.drop(columns=['score']))
+            restored = store.load('missing')
+            self.assertEqual(list(restored['user'].isna()), [False, True, False])
+            self.assertEqual(restored['user'][2], 'bob')
+
+    def test_snapshots_are_evicted(self):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(current_dir, '..', 'assets', 'event_logs', 'demo.xes'), 'rb') as f:
+            log = read_xes_stream(f)
+        with tempfile.TemporaryDirectory() as directory:
+            store = EventLogStore(directory, max_files=2, max_age=60)
+            for age, key in [(30, 'a'), (20, 'b'), (10, 'c')]:
+                store.save(key, log)
+                os.utime(store.path(key), (time.time() - age, time.time() - age))
+            store.save('d', log)
+            self.assertEqual(sorted(os.listdir(directory)),
+                             sorted(os.path.basename(store.path(key)) for key in ['c', 'd']))
+            os.utime(store.path('c'), (time.time() - 120, time.time() - 120))
+            self.assertIsNone(store.load('c'))
+            store.evict()
+            self.assertEqual(os.listdir(directory), [os.path.basename(store.path('d'))])
+
+
+class TestRenderCache(unittest.TestCase):
+    def test_cached_output_is_reused(self):
+        cache = RenderCache()
+        calls = []
+        render = lambda: calls.append(1) or '<svg/>'
+        self.assertEqual(cache.get_or_render(('model', 'log', 'petri-net', 'svg'), render), '<svg/>')
+        self.assertEqual(cache.get_or_render(('model', 'log', 'petri-net', 'svg'), render), '<svg/>')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_stale_output_is_served_while_rendering(self):
+        cache = RenderCache()
+        cache.get_or_render(('model', 'old log', 'petri-net', 'svg'), lambda: 'old')
+        release = threading.Event()
+
+        def render():
+            release.wait()
+            return 'new'
+        self.assertEqual(cache.get_or_render(('model', 'new log', 'petri-net', 'svg'), render), 'old')
+        release.set()
+        while cache.stats()['rendering'] > 0:
+            time.sleep(0.01)
+        self.assertEqual(cache.get_or_render(('model', 'new log', 'petri-net', 'svg'), render), 'new')
+
+    def test_older_render_finishing_last_is_not_served(self):
+        cache = RenderCache()
+        cache.get_or_render(('model', 'log 1', 'petri-net', 'svg'), lambda: '1')
+        release = threading.Event()
+
+        def render():
+            release.wait()
+            return '2'
+        cache.get_or_render(('model', 'log 2', 'petri-net', 'svg'), render)
+        cache.get_or_render(('model', 'log 3', 'petri-net', 'svg'), lambda: '3')
+        while cache.stats()['rendering'] > 1:
+            time.sleep(0.01)
+        release.set()
+        while cache.stats()['rendering'] > 0:
+            time.sleep(0.01)
+        # the log of the next request changed again, the newest output is served while it is rendered
+        release.clear()
+        self.assertEqual(cache.get_or_render(('model', 'log 4', 'petri-net', 'svg'), render), '3')
+        release.set()
+
+    def test_size_is_bounded(self):
+        cache = RenderCache(max_bytes=10)
+        cache.get_or_render(('a', None, 'petri-net', 'svg'), lambda: '123456')
+        cache.get_or_render(('b', None, 'petri-net', 'svg'), lambda: '123456')
+        stats = cache.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['evictions'], 1)
+
+    def test_log_fingerprint(self):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(current_dir, '..', 'assets', 'event_logs', 'demo.xes'), 'rb') as f:
+            log = read_xes_stream(f)
+        self.assertEqual(log_fingerprint(log), log_fingerprint(log.copy()))
+        self.assertNotEqual(log_fingerprint(log), log_fingerprint(log.iloc[1:]))
+
+    def test_fingerprint_of_fetched_log_does_not_hash_it(self):
+        log = pd.DataFrame({'case:concept:name': ['1'], 'concept:name': ['greeting'],
+                            'time:timestamp': [pd.Timestamp('2023-01-01 12:00:00')]})
+        api_requests._versioned('key', log)
+        with mock.patch.object(pd.util, 'hash_pandas_object') as hash_pandas_object:
+            fingerprint = log_fingerprint(log.copy(deep=False))
+            longer = api_requests._versioned('key', pd.concat([log, log], ignore_index=True))
+            self.assertNotEqual(log_fingerprint(longer), fingerprint)
+        hash_pandas_object.assert_not_called()
+
+
+class TestJobManager(unittest.TestCase):
+    def wait(self, manager, job):
+        job.future.result()
+        return job
+
+    def test_result_is_kept(self):
+        manager = JobManager(workers=1)
+        job = self.wait(manager, manager.submit('job', lambda: 42))
+        self.assertEqual(job.status, 'finished')
+        self.assertEqual(job.result, 42)
+
+    def test_failed_job(self):
+        manager = JobManager(workers=1)
+        job = self.wait(manager, manager.submit('job', lambda: 1 / 0))
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNotNone(job.error)
+
+    def test_queue_is_bounded_and_jobs_are_cancelled(self):
+        manager = JobManager(workers=1, max_pending=2)
+        release = threading.Event()
+        running = manager.submit('running', release.wait)
+        queued = manager.submit('queued', lambda: 42)
+        with self.assertRaises(JobQueueFull):
+            manager.submit('rejected', lambda: 42)
+        manager.cancel(queued.id)
+        manager.cancel(running.id)
+        # the cancelled job still occupies the worker
+        manager.submit('queued after cancel', lambda: 42)
+        with self.assertRaises(JobQueueFull):
+            manager.submit('rejected', lambda: 42)
+        release.set()
+        running.future.result()
+        self.assertEqual(manager.get(queued.id).status, 'cancelled')
+        self.assertEqual(manager.get(running.id).status, 'cancelled')
+        self.assertIsNone(manager.get(running.id).result)
+
+    def test_finished_jobs_expire(self):
+        manager = JobManager(workers=1, retention=0.01)
+        job = self.wait(manager, manager.submit('job', lambda: 42))
+        time.sleep(0.02)
+        self.assertIsNone(manager.get(job.id))
+
+
+class TestHttpClient(unittest.TestCase):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        body = b'{"name": "bot"}'
+        served = []
+
+        def do_GET(self):
+            self.served.append(self.headers.get('If-None-Match'))
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Set-Cookie', 'session=user')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(self.body)))
+            self.end_headers()
+            self.wfile.write(self.body)
+
+        def log_message(self, *args):
+            pass
+
+    def setUp(self):
+        self.Handler.served.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/models/bot"
+        http_client.response_cache.invalidate()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_not_modified_response_is_served_from_cache(self):
+        first = http_client.get(self.url)
+        second = http_client.get(self.url)
+        self.assertEqual(self.Handler.served, [None, '"v1"'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+
+    def test_responses_of_other_users_are_not_shared(self):
+        http_client.get(self.url, headers={'authorization': 'Basic a'})
+        http_client.get(self.url, headers={'authorization': 'Basic b'})
+        self.assertEqual(self.Handler.served, [None, None])
+
+    def test_session_is_shared_by_threads_and_keeps_no_cookies(self):
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(http_client.get_session())) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(session is sessions[0] for session in sessions))
+        http_client.get(self.url)
+        self.assertEqual(len(http_client.get_session().cookies), 0)
+
+
+class TestBotIndex(unittest.TestCase):
+    def setUp(self):
+        api_requests.bot_index_cache.invalidate()
+        self.bots = {"1": {"name": "MensaBot"}, "2": {"name": "MensaBot"}, "3": {"name": "OtherBot"}}
+        response = mock.Mock()
+        response.json = lambda: dict(self.bots)
+        self.get = mock.patch.object(http_client, 'get', return_value=response).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_lookups_share_one_download(self):
+        self.assertEqual(api_requests.get_resource_ids_from_bot_manager('http://sbm', 'MensaBot'), ['1', '2'])
+        self.assertEqual(api_requests.get_resource_ids_from_bot_manager('http://sbm', 'OtherBot'), ['3'])
+        self.assertEqual(self.get.call_count, 1)
+
+    def test_unknown_bot_refreshes_index(self):
+        api_requests.get_resource_ids_from_bot_manager('http://sbm', 'MensaBot')
+        self.bots["4"] = {"name": "NewBot"}
+        with mock.patch.object(api_requests, 'bot_index_min_refresh', 0):
+            self.assertEqual(api_requests.get_resource_ids_from_bot_manager('http://sbm', 'NewBot'), ['4'])
+        self.assertEqual(self.get.call_count, 2)
+
+
+class TestIncrementalEventLog(unittest.TestCase):
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine('sqlite://', poolclass=sqlalchemy.pool.StaticPool)
+        with self.engine.begin() as c:
+            c.execute(sqlalchemy.text("""CREATE TABLE MESSAGE (ID INTEGER PRIMARY KEY, EVENT TEXT, CASE_ID TEXT,
+                ACTIVITY_NAME TEXT, TIME_OF_EVENT TEXT, TIME_STAMP TEXT, LIFECYCLE_PHASE TEXT, RESOURCE TEXT,
+                RESOURCE_TYPE TEXT, REMARKS TEXT)"""))
+        api_requests.event_log_snapshots.invalidate()
+        store = mock.patch.object(api_requests, 'event_log_store', None)
+        store.start()
+        self.addCleanup(store.stop)
+
+    def add(self, case_id, activity, time_of_event, time_stamp):
+        with self.engine.begin() as c:
+            c.execute(sqlalchemy.text("""INSERT INTO MESSAGE (EVENT, CASE_ID, ACTIVITY_NAME, TIME_OF_EVENT, TIME_STAMP,
+                LIFECYCLE_PHASE, RESOURCE, RESOURCE_TYPE, REMARKS)
+                VALUES ('USER_MESSAGE', :case_id, :activity, :time_of_event, :time_stamp, 'complete', 'bot', 'bot', '{}')"""),
+                {'case_id': case_id, 'activity': activity, 'time_of_event': time_of_event, 'time_stamp': time_stamp})
+
+    def refresh(self):
+        log = api_requests._refresh_event_log('key', 'database', None, ['bot'], self.engine)
+        return sorted(zip(log['case:concept:name'], log['concept:name']))
+
+    def test_refresh_equals_full_reload_if_time_columns_differ(self):
+        # the time of the event is set by the client, the time stamp when the message is stored
+        self.add('1', 'greeting', '2023-01-01 12:00:00', '2023-01-01 10:00:00')
+        self.add('1', 'menu', '2023-01-01 11:00:00', '2023-01-01 13:00:00')
+        self.assertEqual(len(self.refresh()), 2)
+        self.add('1', 'goodbye', '2023-01-01 12:30:00', '2023-01-01 10:30:00')
+        self.add('2', 'greeting', '2023-01-01 12:00:00', '2023-01-01 14:00:00')
+        full = api_requests._load_event_log('database', None, ['bot'], self.engine)
+        self.assertEqual(len(full), 4)
+        self.assertEqual(self.refresh(), sorted(zip(full['case:concept:name'], full['concept:name'])))
+
+    def test_generator_logs_are_reloaded_without_database(self):
+        api_requests.event_log_cache.invalidate()
+        self.addCleanup(api_requests.event_log_cache.invalidate)
+        log = pd.DataFrame({'case:concept:name': ['1'], 'concept:name': ['greeting'],
+                            'time:timestamp': [pd.Timestamp('2023-01-01 12:00:00')]})
+        with mock.patch.object(api_requests, 'get_resource_ids_from_bot_manager', return_value=['bot']), \
+                mock.patch.object(api_requests, '_download_event_log', return_value=log) as download, \
+                mock.patch.object(api_requests, '_refresh_event_log') as refresh:
+            result = api_requests.fetch_event_log('bot', url='http://generator', botManagerUrl='http://manager',
+                                                  incremental=True)
+        self.assertEqual(len(result), 1)
+        download.assert_called_once()
+        refresh.assert_not_called()
+
+
+class TestIntentConfidenceRollup(unittest.TestCase):
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine('sqlite://', poolclass=sqlalchemy.pool.StaticPool,
+                                               connect_args={'check_same_thread': False})
+        # MySQL returns json values as json text, the rollup unquotes the bot name
+        sqlalchemy.event.listen(self.engine, 'connect', lambda connection, _: connection.create_function(
+            'json_unquote', 1, lambda value: value))
+        with self.engine.begin() as c:
+            c.execute(sqlalchemy.text('CREATE TABLE MESSAGE (ID INTEGER PRIMARY KEY, REMARKS TEXT)'))
+        self.add('MensaBot', 'menu', 0.5)
+        self.add('MensaBot', 'menu', 0.9)
+        self.add('OtherBot', 'menu', 0.1)
+
+    def add(self, bot_name, intent, confidence):
+        with self.engine.begin() as c:
+            c.execute(sqlalchemy.text('INSERT INTO MESSAGE (REMARKS) VALUES (:remarks)'), {'remarks': json.dumps(
+                {'botName': bot_name, 'intent': {'intentKeyword': intent, 'confidence': confidence}})})
+
+    def averages(self, rollup, bot_name):
+        df = rollup.average(bot_name, self.engine)
+        return dict(zip(df['intentKeyword'], df['averageConfidence']))
+
+    def test_averages_per_bot(self):
+        rollup = IntentConfidenceRollup()
+        self.assertAlmostEqual(self.averages(rollup, 'MensaBot')['menu'], 0.7)
+        self.assertAlmostEqual(self.averages(rollup, 'OtherBot')['menu'], 0.1)
+
+    def test_new_messages_are_added(self):
+        rollup = IntentConfidenceRollup(refresh_interval=0)
+        self.averages(rollup, 'MensaBot')
+        self.add('MensaBot', 'menu', 0.1)
+        self.add('MensaBot', 'greeting', 1.0)
+        averages = self.averages(rollup, 'MensaBot')
+        self.assertAlmostEqual(averages['menu'], 0.5)
+        self.assertAlmostEqual(averages['greeting'], 1.0)
+        self.assertEqual(rollup.high_water_id, 5)
+
+    def test_readers_are_not_blocked_by_a_refresh(self):
+        rollup = IntentConfidenceRollup(refresh_interval=0)
+        self.averages(rollup, 'MensaBot')
+        self.add('MensaBot', 'menu', 0.1)
+        started = threading.Event()
+        release = threading.Event()
+        refresh_memory = rollup._refresh_memory
+
+        def slow_refresh(connection):
+            started.set()
+            release.wait()
+            refresh_memory(connection)
+        with mock.patch.object(rollup, '_refresh_memory', side_effect=slow_refresh):
+            refresh = threading.Thread(target=rollup.refresh, args=(self.engine, True))
+            refresh.start()
+            started.wait()
+            # the rollup of the previous refresh is served while the new messages are read
+            self.assertAlmostEqual(self.averages(rollup, 'MensaBot')['menu'], 0.7)
+            release.set()
+            refresh.join()
+        self.assertAlmostEqual(self.averages(rollup, 'MensaBot')['menu'], 0.5)
+
+    def test_index_backend(self):
+        rollup = IntentConfidenceRollup(backend='index')
+        self.assertFalse(rollup.has_generated_columns(self.engine))
+        self.assertAlmostEqual(self.averages(rollup, 'MensaBot')['menu'], 0.7)
+
+    def test_generated_columns_are_used(self):
+        with self.engine.begin() as c:
+            c.execute(sqlalchemy.text('ALTER TABLE MESSAGE ADD COLUMN BOT_NAME TEXT'))
+            c.execute(sqlalchemy.text('ALTER TABLE MESSAGE ADD COLUMN INTENT_KEYWORD TEXT'))
+            c.execute(sqlalchemy.text('ALTER TABLE MESSAGE ADD COLUMN INTENT_CONFIDENCE REAL'))
+            c.execute(sqlalchemy.text("UPDATE MESSAGE SET BOT_NAME = 'GeneratedBot', INTENT_KEYWORD = 'menu', INTENT_CONFIDENCE = 0.3"))
+        for backend in ['memory', 'index']:
+            rollup = IntentConfidenceRollup(backend=backend)
+            self.assertTrue(rollup.has_generated_columns(self.engine))
+            self.assertAlmostEqual(self.averages(rollup, 'GeneratedBot')['menu'], 0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+from lxml import etree
+import pandas as pd
+
+
+def read_xes_stream(source, event_filter=None, attributes=None):
+    """
+    Parses an XES event log incrementally into a dataframe.
+    Events that do not pass the filter and attributes that are not requested are dropped while parsing,
+    so neither the document nor the discarded events are ever held in memory.
+    :param source: file path or file-like object, e.g. the raw body of a streamed http response
+    :param event_filter: dict mapping an attribute key to the set of accepted values (as written in the XES file), e.g. {'lifecycle:transition': {'complete'}}
+    :param attributes: event attribute keys to keep, trace attributes are kept as case:<key>. None keeps all attributes
+    :return: dataframe with one row per kept event, None if no event was kept
+
+    :example:
+    >>> log = read_xes_stream("log.xes", {'lifecycle:transition': {'complete'}}, ['concept:name', 'time:timestamp', 'case:concept:name'])
+    """
+    if event_filter is None:
+        event_filter = {}
+    wanted = set(attributes) if attributes is not None else None
+    columns = {}  # column -> list of values
+    date_columns = set()  # dates are kept as strings and converted per column at the end
+    number_of_rows = 0
+
+    trace_attributes = {}
+    trace_events = []  # kept events of the current trace, emitted when the trace is complete
+    for _, element in etree.iterparse(source, events=('end',), remove_comments=True):
+        tag = etree.QName(element).localname
+        parent = element.getparent()
+        parent_tag = etree.QName(parent).localname if parent is not None else None
+        if parent_tag == 'trace' and tag not in ('event', 'trace'):
+            key = element.get('key')
+            if key is not None:
+                trace_attributes['case:' + key] = (tag, element.get('value'))
+            continue
+        if tag == 'event':
+            event = {}
+            for child in element:
+                key = child.get('key')
+                if key is not None:
+                    event[key] = (etree.QName(child).localname, child.get('value'))
+            if all(key in event and event[key][1] in accepted for key, accepted in event_filter.items()):
+                trace_events.append(event)
+            _release(element)
+        elif tag == 'trace':
+            for event in trace_events:
+                event.update(trace_attributes)
+                for key, (attribute_type, value) in event.items():
+                    if wanted is not None and key not in wanted:
+                        continue
+                    if key not in columns:
+                        columns[key] = [None] * number_of_rows
+                    if attribute_type == 'date':
+                        date_columns.add(key)
+                    else:
+                        value = _parse_value(attribute_type, value)
+                    columns[key].append(value)
+                number_of_rows += 1
+                for values in columns.values():
+                    if len(values) < number_of_rows:
+                        values.append(None)
+            trace_attributes = {}
+            trace_events = []
+            _release(element)
+
+    if number_of_rows == 0:
+        return None
+    return pd.DataFrame({key: pd.to_datetime(pd.Series(values, dtype=object), utc=True, format='ISO8601')
+                         if key in date_columns else pd.Series(values) for key, values in columns.items()})
+
+
+def _release(element):
+    """
+    Frees a parsed element and the already processed siblings before it
+    """
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def _parse_value(attribute_type, value):
+    """
+    Converts the value of an XES attribute to the python type of the attribute
+    """
+    if value is None:
+        return None
+    if attribute_type == 'int':
+        return int(value)
+    if attribute_type == 'float':
+        return float(value)
+    if attribute_type == 'boolean':
+        return value.lower() == 'true'
+    return value